@@ -9,15 +9,29 @@ from __future__ import print_function
 
 import sys, os, shutil, fileinput
 import re
+import json
 import subprocess as sp
 import unittest
 import logging
 import fnmatch
+import tempfile
+import signal
+import threading
+import time
 from argparse import Namespace
 
 builddir = os.getcwd()
 
 # Detect basic context (service, os)
+# (defaults for running the tests outside of a CI service)
+ci_service = '<none>'
+if sys.platform.startswith('win'):
+    ci_os = 'windows'
+elif sys.platform == 'darwin':
+    ci_os = 'osx'
+else:
+    ci_os = 'linux'
+
 if 'TRAVIS' in os.environ:
     ci_service = 'travis'
     ci_os = os.environ['TRAVIS_OS_NAME']
@@ -325,6 +339,1903 @@ def repo_access(dep):
                             stdout=devnull, stderr=devnull)
 
 
+def make_local_repo(place, tag='main', files=None):
+    """Create a git repository at place with one commit on branch tag,
+    return the file:// URL to clone it from"""
+    if files is None:
+        files = {'configure/RELEASE': 'EPICS_BASE=/nowhere\n'}
+    with open(os.devnull, 'w') as devnull:
+        sp.check_call(['git', 'init', '--quiet', place], stdout=devnull)
+        for name, content in files.items():
+            fname = os.path.join(place, name)
+            if not os.path.isdir(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+            with open(fname, 'w') as f:
+                f.write(content)
+        sp.check_call(['git', 'checkout', '--quiet', '-b', tag], cwd=place, stdout=devnull)
+        sp.check_call(['git', 'add', '.'], cwd=place, stdout=devnull)
+        sp.check_call(['git', '-c', 'user.name=ci', '-c', 'user.email=ci@localhost',
+                       'commit', '--quiet', '-m', 'initial'], cwd=place, stdout=devnull)
+    return 'file://' + os.path.abspath(place).replace('\\', '/')
+
+
+class TestAddDependencies(unittest.TestCase):
+    mods = ['BASE', 'MOD1', 'MOD2', 'MOD3']
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['SETUP_PATH'] = '.'
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        os.environ['CLONE_JOBS'] = '3'
+        os.environ['MODULES'] = 'MOD1 MOD2 MOD3'
+        cue.clear_lists()
+        cue.detect_context()
+        cue.setup['BASE_VARNAME'] = 'EPICS_BASE'
+        for mod in self.mods:
+            # MOD3 depends on MOD2
+            release = 'EPICS_BASE=/nowhere\n'
+            if mod == 'MOD3':
+                release = 'MOD2=/nowhere\n' + release
+            cue.setup[mod + '_REPOURL'] = make_local_repo(os.path.join(self.tmpdir, 'repos', mod.lower()),
+                                                          files={'configure/RELEASE': release})
+            cue.setup[mod] = 'main'
+            cue.complete_setup(mod)
+        os.chdir(builddir)
+
+    def tearDown(self):
+        os.environ.pop('CACHEDIR', None)
+        os.environ.pop('CLONE_JOBS', None)
+        os.environ.pop('MODULES', None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_ParallelCheckout(self):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.add_dependencies(self.mods)
+        sys.stdout = sys.__stdout__
+        for mod in self.mods:
+            self.assertTrue(os.path.exists(os.path.join(cue.ci['cachedir'], mod.lower() + '-main', 'checked_out')),
+                            'Dependency {0} was not checked out'.format(mod))
+        self.assertEqual(cue.modules_to_compile, self.mods,
+                         'Freshly cloned modules not all scheduled for compilation in modlist order')
+        with open(os.path.join(cue.ci['cachedir'], 'RELEASE.local')) as f:
+            names = [line.split('=')[0] for line in f]
+        self.assertEqual(names, ['MOD1', 'MOD2', 'MOD3', 'EPICS_BASE'],
+                         'RELEASE.local not written in modlist order with EPICS_BASE last (found {0})'
+                         .format(names))
+        output = capturedOutput.getvalue()
+        positions = [output.index('dependency {0} into'.format(mod)) for mod in self.mods]
+        self.assertEqual(positions, sorted(positions), 'Checkout output not printed in modlist order')
+
+    def recompiled_after_removing(self, mod):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.add_dependencies(self.mods)
+        del cue.modules_to_compile[:]
+        cue.fresh_checkouts.clear()
+        shutil.rmtree(os.path.join(cue.ci['cachedir'], mod.lower() + '-main'), onerror=cue.remove_readonly)
+        cue.add_dependencies(self.mods)
+        sys.stdout = sys.__stdout__
+        return cue.modules_to_compile
+
+    def test_UpToDateNotRecompiled(self):
+        recompiled = self.recompiled_after_removing('MOD2')
+        self.assertEqual(recompiled, ['MOD2', 'MOD3'],
+                         'Expected only MOD2 and its dependent MOD3 to be recompiled (found {0})'
+                         .format(recompiled))
+
+    def test_IndependentNotRecompiled(self):
+        recompiled = self.recompiled_after_removing('MOD1')
+        self.assertEqual(recompiled, ['MOD1'],
+                         'Expected only MOD1 to be recompiled (found {0})'.format(recompiled))
+
+    def test_BaseRecompilesAll(self):
+        recompiled = self.recompiled_after_removing('BASE')
+        self.assertEqual(recompiled, self.mods,
+                         'Expected all modules to be recompiled after Base (found {0})'.format(recompiled))
+
+
+def clean_environ():
+    """Remove the settings of cue and the dependencies (e.g. SET from the CI configuration)
+    from the environment, return the saved environment"""
+    saved = dict(os.environ)
+    for var in list(os.environ):
+        if (var in ['SET', 'MODULES', 'ADD_MODULES', 'LOCKFILE', 'MIRROR_PATH', 'TRACE_FILE', 'BINARY_CACHE']
+                or re.match(r'^(BASE|MOD\d+)(_|$)', var)):
+            del os.environ[var]
+    return saved
+
+
+def restore_environ(saved):
+    os.environ.clear()
+    os.environ.update(saved)
+
+
+def add_local_commit(place, name, content):
+    """Add a commit changing file name to the git repository at place, return its hash"""
+    with open(os.path.join(place, name), 'w') as f:
+        f.write(content)
+    with open(os.devnull, 'w') as devnull:
+        sp.check_call(['git', 'add', name], cwd=place, stdout=devnull)
+        sp.check_call(['git', '-c', 'user.name=ci', '-c', 'user.email=ci@localhost',
+                       'commit', '--quiet', '-m', 'change ' + name], cwd=place, stdout=devnull)
+    return cue.get_git_hash(place)
+
+
+class TestAddDependencyUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        cue.clear_lists()
+        cue.detect_context()
+        self.repo = os.path.join(self.tmpdir, 'repos', 'mod1')
+        cue.setup['MOD1_REPOURL'] = make_local_repo(self.repo)
+        cue.setup['MOD1'] = 'main'
+        cue.complete_setup('MOD1')
+        self.location = os.path.join(cue.ci['cachedir'], 'mod1-main')
+        self.checked_file = os.path.join(self.location, 'checked_out')
+        self.product = os.path.join(self.location, 'O.test', 'product.o')
+        with open(os.path.join(self.repo, '.gitignore'), 'w') as f:
+            f.write('O.*\n')
+        add_local_commit(self.repo, '.gitignore', 'O.*\n')
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.add_dependency('MOD1')
+        sys.stdout = sys.__stdout__
+        os.makedirs(os.path.dirname(self.product))
+        with open(self.product, 'w') as f:
+            f.write('built\n')
+        self.new_head = add_local_commit(self.repo, 'src.c', 'int x;\n')
+
+    def tearDown(self):
+        os.environ.pop('CACHEDIR', None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_NoUpdateByDefault(self):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.add_dependency('MOD1')
+        sys.stdout = sys.__stdout__
+        self.assertNotEqual(cue.get_git_hash(self.location), self.new_head,
+                            'Up-to-date clone was updated without MOD1_UPDATE')
+
+    def test_UpdateInPlace(self):
+        cue.setup['MOD1_UPDATE'] = 'YES'
+        del cue.modules_to_compile[:]
+        cue.fresh_checkouts.clear()
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.add_dependency('MOD1')
+        sys.stdout = sys.__stdout__
+        self.assertRegex(capturedOutput.getvalue(), 'Updating main of dependency MOD1')
+        with open(self.checked_file, 'r') as bfile:
+            checked_out = bfile.read().strip()
+        self.assertEqual(checked_out, self.new_head,
+                         "Wrong commit after update (expected='{0}' found='{1}')"
+                         .format(self.new_head, checked_out))
+        self.assertTrue(os.path.exists(os.path.join(self.location, 'src.c')), 'New commit not checked out')
+        self.assertTrue(os.path.exists(self.product), 'Build products were removed by the update')
+        self.assertTrue(find_in_file(r'include \$\(TOP\)/../RELEASE.local',
+                                     os.path.join(self.location, 'configure', 'RELEASE')),
+                        'RELEASE was not rewritten after the update')
+        self.assertEqual(cue.modules_to_compile, ['MOD1'], 'Updated module not scheduled for compilation')
+
+
+class TestSharedObjects(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        os.environ['SHARED_OBJECTS'] = 'YES'
+        cue.clear_lists()
+        cue.detect_context()
+        self.repo = os.path.join(self.tmpdir, 'repos', 'mod1')
+        cue.setup['MOD1_REPOURL'] = make_local_repo(self.repo)
+        self.hashes = {}
+        for tag in ['R1', 'R2']:
+            self.hashes[tag] = add_local_commit(self.repo, 'version', tag + '\n')
+            sp.check_call(['git', 'tag', tag], cwd=self.repo)
+        cue.complete_setup('MOD1')
+
+    def tearDown(self):
+        os.environ.pop('CACHEDIR', None)
+        os.environ.pop('SHARED_OBJECTS', None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_TagsShareObjectStore(self):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        for tag in ['R1', 'R2']:
+            cue.setup['MOD1'] = tag
+            cue.add_dependency('MOD1')
+        sys.stdout = sys.__stdout__
+        store = cue.object_store(cue.setup['MOD1_REPOURL'])
+        self.assertTrue(os.path.isdir(store), 'Shared object store was not created')
+        for tag in ['R1', 'R2']:
+            location = os.path.join(cue.ci['cachedir'], 'mod1-' + tag)
+            self.assertEqual(cue.get_git_hash(location), self.hashes[tag],
+                             'Wrong commit checked out for {0}'.format(tag))
+            self.assertTrue(os.path.exists(os.path.join(location, '.git', 'objects', 'info', 'alternates')),
+                            'Checkout of {0} does not use the shared object store'.format(tag))
+            count = sp.check_output(['git', 'count-objects'], cwd=location).decode()
+            self.assertTrue(count.startswith('0 objects'),
+                            'Checkout of {0} has its own objects ({1})'.format(tag, count.strip()))
+
+    def test_UpdateThroughObjectStore(self):
+        cue.setup['MOD1'] = 'main'
+        cue.setup['MOD1_UPDATE'] = 'YES'
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.add_dependency('MOD1')
+        new_head = add_local_commit(self.repo, 'src.c', 'int x;\n')
+        cue.add_dependency('MOD1')
+        sys.stdout = sys.__stdout__
+        location = os.path.join(cue.ci['cachedir'], 'mod1-main')
+        self.assertEqual(cue.get_git_hash(location), new_head, 'Clone was not updated to the new commit')
+
+
+class TestPartialClone(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        cue.clear_lists()
+        cue.detect_context()
+        self.repo = os.path.join(self.tmpdir, 'repos', 'mod1')
+        cue.setup['MOD1_REPOURL'] = make_local_repo(self.repo, files={
+            'configure/RELEASE': 'EPICS_BASE=/nowhere\n',
+            'src/mod1.c': 'int x;\n',
+            'documentation/manual.txt': 'lots of text\n',
+        })
+        with open(os.devnull, 'w') as devnull:
+            sp.check_call(['git', 'config', 'uploadpack.allowFilter', 'true'], cwd=self.repo)
+            sp.check_call(['git', 'tag', 'R1'], cwd=self.repo, stdout=devnull)
+        cue.setup['MOD1'] = 'main'
+        cue.complete_setup('MOD1')
+        self.location = os.path.join(cue.ci['cachedir'], 'mod1-main')
+
+    def tearDown(self):
+        os.environ.pop('CACHEDIR', None)
+        os.environ.pop('SHARED_OBJECTS', None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def add_dependency(self):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.add_dependency('MOD1')
+        sys.stdout = sys.__stdout__
+
+    def test_SparseCheckout(self):
+        cue.setup['MOD1_SPARSE'] = 'src'
+        self.add_dependency()
+        self.assertTrue(os.path.exists(os.path.join(self.location, 'src', 'mod1.c')),
+                        'Sparse path src was not checked out')
+        self.assertTrue(os.path.exists(os.path.join(self.location, 'configure', 'RELEASE')),
+                        'configure was not checked out')
+        self.assertFalse(os.path.exists(os.path.join(self.location, 'documentation')),
+                         'Path outside of MOD1_SPARSE was checked out')
+
+    def test_SparseCheckoutSharedObjects(self):
+        os.environ['SHARED_OBJECTS'] = 'YES'
+        cue.detect_context()
+        cue.setup['MOD1_SPARSE'] = 'src'
+        self.add_dependency()
+        self.assertTrue(os.path.exists(os.path.join(self.location, 'src', 'mod1.c')),
+                        'Sparse path src was not checked out')
+        self.assertFalse(os.path.exists(os.path.join(self.location, 'documentation')),
+                         'Path outside of MOD1_SPARSE was checked out')
+
+    def test_SparseCheckoutLocked(self):
+        cue.setup['MOD1_SPARSE'] = 'src'
+        cue.setup['MOD1_FILTER'] = 'blob:none'
+        cue.locked.update({'MOD1': 'main', 'MOD1_REPOURL': cue.setup['MOD1_REPOURL'],
+                           'MOD1_COMMIT': sp.check_output(['git', 'rev-parse', 'HEAD'],
+                                                          cwd=self.repo).decode().strip()})
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.add_dependency('MOD1')
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertTrue('Fetching locked commit' in capturedOutput.getvalue(), 'locked commit not fetched')
+        self.assertTrue(os.path.exists(os.path.join(self.location, 'src', 'mod1.c')),
+                        'Sparse path src was not checked out')
+        self.assertFalse(os.path.exists(os.path.join(self.location, 'documentation')),
+                         'Path outside of MOD1_SPARSE was checked out')
+
+    def test_BlobFilter(self):
+        cue.setup['MOD1_FILTER'] = 'blob:none'
+        cue.setup['MOD1_SPARSE'] = 'src'
+        self.add_dependency()
+        missing = sp.check_output(['git', 'rev-list', '--objects', '--missing=print', 'HEAD'],
+                                  cwd=self.location).decode().split()
+        self.assertTrue([obj for obj in missing if obj.startswith('?')],
+                        'All blobs were fetched despite MOD1_FILTER=blob:none')
+
+    def test_SingleBranch(self):
+        cue.setup['MOD1_DEPTH'] = '0'
+        cue.setup['MOD1_SINGLE_BRANCH'] = 'YES'
+        self.add_dependency()
+        tags = sp.check_output(['git', 'tag'], cwd=self.location).decode().split()
+        self.assertEqual(tags, [], 'Tags were fetched despite MOD1_SINGLE_BRANCH=YES')
+
+
+class TestMirrors(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved_environ = clean_environ()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        os.environ['MIRROR_PATH'] = os.path.join(self.tmpdir, 'mirrors')
+        os.environ['SETUP_PATH'] = self.tmpdir
+        cue.clear_lists()
+        cue.detect_context()
+        self.repos = os.path.join(self.tmpdir, 'repos')
+        with open(os.path.join(self.tmpdir, 'defaults.set'), 'w') as f:
+            f.write('MODULES=mod1\n')
+            for mod in ['BASE', 'MOD1']:
+                url = make_local_repo(os.path.join(self.repos, mod.lower()))
+                f.write('{0}=main\n{0}_REPOURL={1}\n'.format(mod, url))
+
+    def tearDown(self):
+        restore_environ(self.saved_environ)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_MirrorLocation(self):
+        self.assertEqual(cue.mirror_location('https://github.com/epics-base/epics-base.git'),
+                         os.path.join(cue.ci['mirror_path'], 'github.com', 'epics-base', 'epics-base.git'))
+        self.assertEqual(cue.mirror_location('git@gitlab.example.org:group/mod'),
+                         os.path.join(cue.ci['mirror_path'], 'gitlab.example.org', 'group', 'mod.git'))
+
+    def test_SyncAndCloneOfflineWithSubmodules(self):
+        # MOD1 has a submodule that has a submodule of its own (with a relative URL)
+        os.environ['GIT_CONFIG_COUNT'] = '1'
+        os.environ['GIT_CONFIG_KEY_0'] = 'protocol.file.allow'
+        os.environ['GIT_CONFIG_VALUE_0'] = 'always'
+        try:
+            make_local_repo(os.path.join(self.repos, 'inner'), files={'inner.c': 'int y;\n'})
+            suburl = make_local_repo(os.path.join(self.repos, 'sub'), files={'sub.c': 'int x;\n'})
+            with open(os.devnull, 'w') as devnull:
+                for repo, url, path in [('sub', '../inner', 'inner'), ('mod1', suburl, 'sub')]:
+                    sp.check_call(['git', 'submodule', '--quiet', 'add', url, path],
+                                  cwd=os.path.join(self.repos, repo), stdout=devnull)
+                    sp.check_call(['git', '-c', 'user.name=ci', '-c', 'user.email=ci@localhost',
+                                   'commit', '--quiet', '-m', 'add submodule'],
+                                  cwd=os.path.join(self.repos, repo), stdout=devnull)
+            capturedOutput = getStringIO()
+            sys.stdout = capturedOutput
+            try:
+                cue.mirror_sync(Namespace(sets=[]))
+            finally:
+                sys.stdout = sys.__stdout__
+            for repo in ['sub', 'inner']:
+                self.assertTrue(os.path.isdir(cue.mirror_location(cue.file_url(os.path.join(self.repos, repo)))),
+                                'Mirror for submodule {0} was not created'.format(repo))
+            # upstream is gone: the submodules must come from the mirrors
+            shutil.rmtree(self.repos, onerror=cue.remove_readonly)
+            sys.stdout = capturedOutput
+            try:
+                cue.add_dependency('MOD1')
+            finally:
+                sys.stdout = sys.__stdout__
+            place = os.path.join(cue.ci['cachedir'], 'mod1-main')
+            self.assertTrue(os.path.exists(os.path.join(place, 'sub', 'sub.c')), 'Submodule not checked out')
+            self.assertTrue(os.path.exists(os.path.join(place, 'sub', 'inner', 'inner.c')),
+                            'Nested submodule not checked out')
+        finally:
+            for var in ['GIT_CONFIG_COUNT', 'GIT_CONFIG_KEY_0', 'GIT_CONFIG_VALUE_0']:
+                os.environ.pop(var, None)
+
+    def test_SyncAndCloneOffline(self):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.mirror_sync(Namespace(sets=[]))
+        sys.stdout = sys.__stdout__
+        for mod in ['BASE', 'MOD1']:
+            self.assertTrue(os.path.isdir(cue.mirror_location(cue.setup[mod + '_REPOURL'])),
+                            'Mirror for {0} was not created'.format(mod))
+        # upstream is gone: cloning must work from the mirror
+        shutil.rmtree(self.repos, onerror=cue.remove_readonly)
+        sys.stdout = capturedOutput
+        cue.add_dependency('MOD1')
+        sys.stdout = sys.__stdout__
+        self.assertTrue(os.path.exists(os.path.join(cue.ci['cachedir'], 'mod1-main', 'checked_out')),
+                        'Dependency was not checked out from the mirror')
+
+
+class TestSubmodules(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        # allow file:// submodules
+        os.environ['GIT_CONFIG_COUNT'] = '1'
+        os.environ['GIT_CONFIG_KEY_0'] = 'protocol.file.allow'
+        os.environ['GIT_CONFIG_VALUE_0'] = 'always'
+        cue.clear_lists()
+        cue.detect_context()
+        sub = os.path.join(self.tmpdir, 'repos', 'sub')
+        suburl = make_local_repo(sub, files={'sub.c': 'int x;\n'})
+        for i in range(3):
+            add_local_commit(sub, 'sub.c', 'int x{0};\n'.format(i))
+        repo = os.path.join(self.tmpdir, 'repos', 'mod1')
+        cue.setup['MOD1_REPOURL'] = make_local_repo(repo)
+        with open(os.devnull, 'w') as devnull:
+            sp.check_call(['git', 'submodule', '--quiet', 'add', suburl, 'sub'], cwd=repo, stdout=devnull)
+            sp.check_call(['git', '-c', 'user.name=ci', '-c', 'user.email=ci@localhost',
+                           'commit', '--quiet', '-m', 'add submodule'], cwd=repo, stdout=devnull)
+        cue.setup['MOD1'] = 'main'
+        cue.complete_setup('MOD1')
+        self.location = os.path.join(cue.ci['cachedir'], 'mod1-main')
+
+    def tearDown(self):
+        for var in ['CACHEDIR', 'GIT_CONFIG_COUNT', 'GIT_CONFIG_KEY_0', 'GIT_CONFIG_VALUE_0']:
+            os.environ.pop(var, None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def add_dependency(self):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.add_dependency('MOD1')
+        sys.stdout = sys.__stdout__
+
+    def test_ShallowSubmodules(self):
+        self.add_dependency()
+        submodule = os.path.join(self.location, 'sub')
+        self.assertTrue(os.path.exists(os.path.join(submodule, 'sub.c')), 'Submodule not checked out')
+        self.assertTrue(is_shallow_repo(submodule), 'Submodule not checked out shallow (requested: default=1)')
+
+    def test_FullSubmodules(self):
+        cue.setup['MOD1_SUBMODULE_DEPTH'] = '0'
+        cue.setup['MOD1_SUBMODULE_JOBS'] = '1'
+        self.add_dependency()
+        submodule = os.path.join(self.location, 'sub')
+        self.assertTrue(os.path.exists(os.path.join(submodule, 'sub.c')), 'Submodule not checked out')
+        self.assertFalse(is_shallow_repo(submodule), 'Submodule checked out shallow (requested full)')
+
+
+class TestLockFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved_environ = clean_environ()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        os.environ['SETUP_PATH'] = self.tmpdir
+        self.lockfile = os.path.join(self.tmpdir, 'test.lock')
+        cue.clear_lists()
+        cue.detect_context()
+        self.repo = os.path.join(self.tmpdir, 'repos', 'mod1')
+        with open(os.path.join(self.tmpdir, 'defaults.set'), 'w') as f:
+            f.write('MODULES=mod1\n')
+            for mod in ['BASE', 'MOD1']:
+                url = make_local_repo(os.path.join(self.tmpdir, 'repos', mod.lower()))
+                f.write('{0}=main\n{0}_REPOURL={1}\n'.format(mod, url))
+        for i in range(3):
+            self.locked = add_local_commit(self.repo, 'version', '{0}\n'.format(i))
+
+    def tearDown(self):
+        restore_environ(self.saved_environ)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def lock_and_reload(self):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.lock(Namespace(output=self.lockfile))
+        sys.stdout = sys.__stdout__
+        os.environ['LOCKFILE'] = self.lockfile
+        cue.clear_lists()
+        cue.detect_context()
+        cue.load_setup(None)
+        cue.load_lockfile(cue.ci['lockfile'])
+
+    def add_dependency(self):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.add_dependency('MOD1')
+        sys.stdout = sys.__stdout__
+
+    def test_LockWritesCommits(self):
+        self.lock_and_reload()
+        self.assertEqual(cue.locked['MOD1_COMMIT'], self.locked, 'Wrong commit locked for MOD1')
+        self.assertEqual(cue.locked['MOD1'], 'main', 'Wrong version recorded for MOD1')
+        self.assertTrue('BASE_COMMIT' in cue.locked, 'BASE missing in lock file')
+
+    def test_CheckoutLockedCommit(self):
+        self.lock_and_reload()
+        add_local_commit(self.repo, 'version', 'unlocked\n')
+        self.add_dependency()
+        location = os.path.join(cue.ci['cachedir'], 'mod1-main')
+        self.assertEqual(cue.get_git_hash(location), self.locked, 'Locked commit was not checked out')
+        self.assertTrue(is_shallow_repo(location), 'Locked commit not fetched shallow')
+        count = sp.check_output(['git', 'rev-list', '--count', 'HEAD'], cwd=location).decode().strip()
+        self.assertEqual(count, '1', 'Locked commit not fetched at depth 1 (found {0} commits)'.format(count))
+
+    def test_NewLockReplacesClone(self):
+        self.lock_and_reload()
+        self.add_dependency()
+        self.locked = add_local_commit(self.repo, 'version', 'new\n')
+        self.lock_and_reload()
+        self.add_dependency()
+        location = os.path.join(cue.ci['cachedir'], 'mod1-main')
+        self.assertEqual(cue.get_git_hash(location), self.locked, 'Clone was not replaced for the new locked commit')
+
+    def test_MismatchedLockIgnored(self):
+        self.lock_and_reload()
+        cue.setup['MOD1_REPOURL'] = cue.setup['MOD1_REPOURL'] + '/'
+        self.assertEqual(cue.locked_commit('MOD1'), None, 'Lock entry used for a different repository URL')
+
+
+@unittest.skipIf(ci_os == 'windows', 'Dependency build tests use POSIX shell commands')
+class TestBuildDependencies(unittest.TestCase):
+    makefiles = {
+        'BASE': 'all:\n\ttouch built\nclean:\n',
+        # MOD1 takes a while
+        'MOD1': 'all:\n\tsleep 1 && touch built\nclean:\n',
+        # MOD2 fails if MOD1 is not built yet
+        'MOD2': 'all:\n\ttest -f ../mod1-main/built && touch built\nclean:\n',
+        # MOD3 only depends on Base
+        'MOD3': 'all:\n\ttest ! -f ../mod1-main/built && touch built\nclean:\n',
+    }
+    releases = {
+        'BASE': '',
+        'MOD1': 'EPICS_BASE=/nowhere\n',
+        'MOD2': '#MOD1=/nowhere\nEPICS_BASE=/nowhere\n',
+        'MOD3': 'SUPPORT=/nowhere\nEPICS_BASE=/nowhere\n',
+    }
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        os.environ['SETUP_PATH'] = '.'
+        os.environ['PARALLEL_MAKE'] = '4'
+        os.environ['MODULES'] = 'MOD1 MOD2 MOD3'
+        cue.clear_lists()
+        cue.detect_context()
+        cue.is_make3 = bool(re.match(r'^GNU Make 3', sp.check_output(['make', '-v']).decode('ascii')))
+        cue.setup['BASE_VARNAME'] = 'EPICS_BASE'
+        for mod in cue.modlist():
+            cue.setup[mod + '_REPOURL'] = make_local_repo(os.path.join(self.tmpdir, 'repos', mod.lower()), files={
+                'Makefile': self.makefiles[mod],
+                'configure/RELEASE': self.releases[mod],
+            })
+            cue.setup[mod] = 'main'
+            cue.complete_setup(mod)
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.add_dependencies(cue.modlist())
+        sys.stdout = sys.__stdout__
+
+    def tearDown(self):
+        for var in ['CACHEDIR', 'PARALLEL_MAKE', 'MODULES']:
+            os.environ.pop(var, None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_DependencyGraph(self):
+        graph = cue.dependency_graph(cue.modules_to_compile)
+        self.assertEqual(graph['BASE'], set(), 'Base depends on {0}'.format(graph['BASE']))
+        self.assertEqual(graph['MOD1'], set(['BASE']), 'MOD1 depends on {0}'.format(graph['MOD1']))
+        self.assertEqual(graph['MOD2'], set(['BASE', 'MOD1']), 'MOD2 depends on {0}'.format(graph['MOD2']))
+        self.assertEqual(graph['MOD3'], set(['BASE']), 'MOD3 depends on {0}'.format(graph['MOD3']))
+
+    def test_BuildRespectsDependencies(self):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.build_dependencies(cue.modules_to_compile)
+        sys.stdout = sys.__stdout__
+        for mod in cue.modlist():
+            self.assertTrue(os.path.exists(os.path.join(cue.ci['cachedir'], mod.lower() + '-main', 'built')),
+                            '{0} was not built'.format(mod))
+
+    def test_BuildProfile(self):
+        cue.ci['build_profile'] = os.path.join(self.tmpdir, 'profiles')
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.build_dependencies(cue.modules_to_compile)
+        sys.stdout = sys.__stdout__
+        with open(os.path.join(cue.ci['build_profile'], 'MOD1.json')) as f:
+            result = json.load(f)
+        self.assertEqual([d['directory'] for d in result['directories']], ['.'],
+                         'wrong directories in profile ({0})'.format(result['directories']))
+        self.assertTrue(result['directories'][0]['seconds'] >= 0.9,
+                        'build time of MOD1 too short ({0})'.format(result['directories'][0]))
+        for mod in cue.modlist():
+            self.assertTrue('Build profile of {0}'.format(mod) in capturedOutput.getvalue(),
+                            'no profile summary printed for {0}'.format(mod))
+
+    def test_TraceEvents(self):
+        cue.ci['trace_file'] = os.path.join(self.tmpdir, 'trace.json')
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.build_dependencies(cue.modules_to_compile)
+        sys.stdout = sys.__stdout__
+        cue.write_trace('cue.py prepare')
+        with open(cue.ci['trace_file']) as f:
+            events = json.load(f)['traceEvents']
+        tracks = dict((e['tid'], e['args']['name']) for e in events if e['name'] == 'thread_name')
+        builds = dict((e['name'], e) for e in events if e.get('cat') == 'dependency')
+        for mod in cue.modlist():
+            self.assertTrue('build ' + mod in builds, 'no trace event for the build of {0}'.format(mod))
+            self.assertEqual(tracks[builds['build ' + mod]['tid']], mod, 'build of {0} on wrong track'.format(mod))
+        self.assertTrue(builds['build MOD1']['dur'] >= 900000,
+                        'build of MOD1 too short ({0})'.format(builds['build MOD1']))
+        makes = dict((tracks[e['tid']], e) for e in events
+                     if e.get('cat') == 'process' and not e['args']['cmd'].endswith('clean'))
+        self.assertTrue(makes['MOD2']['ts'] >= makes['MOD1']['ts'] + makes['MOD1']['dur'],
+                        'MOD2 built before MOD1 was done')
+
+    def test_FailureStopsBuild(self):
+        with open(os.path.join(cue.ci['cachedir'], 'mod3-main', 'Makefile'), 'w') as f:
+            f.write('all:\n\tfalse\n')
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            self.assertRaises(SystemExit, cue.build_dependencies, cue.modules_to_compile)
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertRegex(capturedOutput.getvalue(), 'Building dependency MOD3 failed')
+        self.assertFalse(os.path.exists(os.path.join(cue.ci['cachedir'], 'mod2-main', 'built')),
+                         'MOD2 was built after MOD3 failed')
+
+    def rebuild_mod1(self, makefile=None):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.build_dependencies(cue.modules_to_compile)
+            mod1 = os.path.join(cue.ci['cachedir'], 'mod1-main')
+            if makefile:
+                with open(os.path.join(mod1, 'Makefile'), 'w') as f:
+                    f.write(makefile)
+            os.remove(os.path.join(cue.ci['cachedir'], 'mod2-main', 'built'))
+            # MOD1 was updated, MOD2 depends on it
+            cue.fresh_checkouts.clear()
+            cue.fresh_checkouts.add('MOD1')
+            cue.modules_to_compile[:] = ['MOD1', 'MOD2']
+            cue.build_dependencies(cue.modules_to_compile)
+        finally:
+            sys.stdout = sys.__stdout__
+        return os.path.exists(os.path.join(cue.ci['cachedir'], 'mod2-main', 'built'))
+
+    def test_EarlyCutoff(self):
+        self.assertFalse(self.rebuild_mod1(), 'MOD2 was rebuilt although the outputs of MOD1 did not change')
+        self.assertEqual(cue.modules_to_compile, ['MOD1'],
+                         'Skipped MOD2 still listed as compiled ({0})'.format(cue.modules_to_compile))
+
+    def test_ChangedOutputsRebuildDependents(self):
+        self.assertTrue(self.rebuild_mod1('all:\n\tmkdir -p include && echo changed > include/mod1.h\nclean:\n'),
+                        'MOD2 was not rebuilt although the outputs of MOD1 changed')
+
+
+@unittest.skipIf(ci_os == 'windows', 'test Makefiles use POSIX shell commands')
+class TestBinaryCache(unittest.TestCase):
+    makefiles = {
+        'BASE': 'all:\n\tmkdir -p lib && echo base > lib/libbase && touch built\nclean:\n',
+        'MOD1': 'all:\n\tmkdir -p lib dbd && echo mod1 > lib/libmod1 && touch dbd/mod1.dbd built\nclean:\n',
+    }
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        os.environ['BINARY_CACHE'] = os.path.join(self.tmpdir, 'binaries')
+        os.environ['SETUP_PATH'] = '.'
+        os.environ['MODULES'] = 'MOD1'
+        os.environ['EPICS_HOST_ARCH'] = 'linux-x86_64'
+        cue.clear_lists()
+        cue.detect_context()
+        cue.is_make3 = bool(re.match(r'^GNU Make 3', sp.check_output(['make', '-v']).decode('ascii')))
+        cue.setup['BASE_VARNAME'] = 'EPICS_BASE'
+        for mod in cue.modlist():
+            cue.setup[mod + '_REPOURL'] = make_local_repo(os.path.join(self.tmpdir, 'repos', mod.lower()), files={
+                'Makefile': self.makefiles[mod],
+                'configure/RELEASE': 'EPICS_BASE=/nowhere\n',
+            })
+            cue.setup[mod] = 'main'
+            cue.complete_setup(mod)
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.add_dependencies(cue.modlist())
+        sys.stdout = sys.__stdout__
+
+    def tearDown(self):
+        for var in ['CACHEDIR', 'BINARY_CACHE', 'MODULES', 'EPICS_HOST_ARCH', 'CI_CROSS_TARGETS']:
+            os.environ.pop(var, None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def place(self, mod):
+        return os.path.join(cue.ci['cachedir'], mod.lower() + '-main')
+
+    def test_KeysCoverBuildInputs(self):
+        keys = cue.binary_cache_keys()
+        self.assertEqual(keys, cue.binary_cache_keys(), 'binary cache keys are not stable')
+        self.assertNotEqual(keys['BASE'], keys['MOD1'], 'different modules have the same key')
+        os.environ['CI_CROSS_TARGETS'] = 'linux-aarch64'
+        cross_keys = cue.binary_cache_keys()
+        self.assertNotEqual(keys['MOD1'], cross_keys['MOD1'], 'key does not cover the cross targets')
+        del os.environ['CI_CROSS_TARGETS']
+        # a local edit of Base changes the key of Base and of all modules depending on it
+        with open(os.path.join(self.place('BASE'), 'Makefile'), 'a') as f:
+            f.write('# CONFIG_SITE edit\n')
+        edited_keys = cue.binary_cache_keys()
+        self.assertNotEqual(keys['BASE'], edited_keys['BASE'], 'key does not cover local changes')
+        self.assertNotEqual(keys['MOD1'], edited_keys['MOD1'], 'key does not cover the keys of dependencies')
+        # files added to a dependency (e.g. by a hook) change the key, build products don't
+        os.makedirs(os.path.join(self.place('MOD1'), 'configure', 'os'))
+        os.makedirs(os.path.join(self.place('MOD1'), 'O.linux-x86_64'))
+        with open(os.path.join(self.place('MOD1'), 'O.linux-x86_64', 'mod1.o'), 'w') as f:
+            f.write('object\n')
+        self.assertEqual(edited_keys, cue.binary_cache_keys(), 'key covers build products')
+        with open(os.path.join(self.place('MOD1'), 'configure', 'os', 'CONFIG_SITE.Common.linux-x86_64'), 'w') as f:
+            f.write('USR_CFLAGS += -DHOOKED\n')
+        added_keys = cue.binary_cache_keys()
+        self.assertNotEqual(edited_keys['MOD1'], added_keys['MOD1'], 'key does not cover untracked files')
+        with open(os.path.join(self.place('MOD1'), 'configure', 'os', 'CONFIG_SITE.Common.linux-x86_64'), 'w') as f:
+            f.write('USR_CFLAGS += -DOTHER\n')
+        self.assertNotEqual(added_keys['MOD1'], cue.binary_cache_keys()['MOD1'],
+                            'key does not cover the contents of untracked files')
+
+    def test_StoreAndRestore(self):
+        keys = cue.binary_cache_keys()
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.build_dependencies(cue.modules_to_compile, keys)
+        finally:
+            sys.stdout = sys.__stdout__
+        for mod in cue.modlist():
+            self.assertTrue(os.path.exists(os.path.join(cue.ci['binary_cache'], keys[mod], 'lib')),
+                            'binaries of {0} not stored in binary cache'.format(mod))
+        place = self.place('MOD1')
+        shutil.rmtree(os.path.join(place, 'lib'))
+        os.remove(os.path.join(place, 'built'))
+        sys.stdout = capturedOutput
+        try:
+            self.assertTrue(cue.restore_binaries('MOD1', keys['MOD1']), 'binaries of MOD1 not restored')
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertTrue(os.path.exists(os.path.join(place, 'lib', 'libmod1')), 'lib/libmod1 was not restored')
+        self.assertTrue(os.path.exists(os.path.join(place, 'dbd', 'mod1.dbd')), 'dbd/mod1.dbd was not restored')
+        self.assertFalse(os.path.exists(os.path.join(place, 'built')), 'MOD1 was built instead of restored')
+
+    def test_MissingEntry(self):
+        self.assertFalse(cue.restore_binaries('MOD1', 64 * '0'), 'restored a missing cache entry')
+
+    def test_KeysCoverInstallLocation(self):
+        # the installed files refer to the dependency paths in RELEASE.local,
+        # so the same build in another cache area (e.g. a matrix configuration) has other keys
+        keys = cue.binary_cache_keys()
+        release_local = os.path.join(cue.ci['cachedir'], 'RELEASE.local')
+        with open(release_local) as f:
+            content = f.read()
+        self.assertTrue(cue.ci['cachedir'] in content, 'RELEASE.local has no paths in the cache area')
+        with open(release_local, 'w') as f:
+            f.write(content.replace(cue.ci['cachedir'], os.path.join(self.tmpdir, 'matrix', 'CMP-gcc')))
+        other_keys = cue.binary_cache_keys()
+        for mod in cue.modlist():
+            self.assertNotEqual(keys[mod], other_keys[mod], 'key of {0} does not cover the cache area'.format(mod))
+
+
+class TestTestShard(unittest.TestCase):
+    tests = ['testApp/t{0}.t'.format(i) for i in range(10)]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.curdir = cue.curdir
+        os.environ['TEST_SHARD'] = '2/3'
+        os.environ['EPICS_HOST_ARCH'] = 'linux-x86_64'
+        cue.clear_lists()
+        cue.detect_context()
+
+    def tearDown(self):
+        cue.curdir = self.curdir
+        for var in ['TEST_SHARD', 'EPICS_HOST_ARCH']:
+            os.environ.pop(var, None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_ParseShard(self):
+        self.assertEqual(cue.ci['test_shard'], (2, 3), 'TEST_SHARD=2/3 parsed as {0}'.format(cue.ci['test_shard']))
+        os.environ['TEST_SHARD'] = '4/3'
+        self.assertRaises(ValueError, cue.detect_context)
+
+    def test_ShardsCoverAllTests(self):
+        shards = [cue.select_shard(self.tests, {}, i, 3) for i in [1, 2, 3]]
+        self.assertEqual(sorted(sum(shards, [])), sorted(self.tests), 'shards do not partition the tests')
+        self.assertEqual([len(shard) for shard in shards], [4, 3, 3], 'shards not balanced by number of tests')
+
+    def test_ShardsBalancedByDuration(self):
+        durations = dict((name, 1.) for name in self.tests)
+        durations['testApp/t0.t'] = 100.
+        shards = [cue.select_shard(self.tests, durations, i, 3) for i in [1, 2, 3]]
+        self.assertEqual(shards[0], ['testApp/t0.t'], 'longest test not alone in its shard ({0})'.format(shards))
+
+    def test_DiscoverTestScripts(self):
+        for name in ['testApp/O.linux-x86_64/aTest.t', 'testApp/O.linux-x86_64/aTest',
+                     'testApp/O.linux-arm/aTest.t', 'src/test/O.linux-x86_64/bTest.t',
+                     '.cache/base/testApp/O.linux-x86_64/cTest.t']:
+            fname = os.path.join(self.tmpdir, name)
+            if not os.path.isdir(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+            open(fname, 'w').close()
+        cue.curdir = self.tmpdir
+        scripts = cue.discover_test_scripts()
+        self.assertEqual(sorted(scripts), ['src/test/bTest.t', 'testApp/aTest.t'],
+                         'wrong test scripts found ({0})'.format(sorted(scripts)))
+        self.assertEqual(scripts['testApp/aTest.t'],
+                         (os.path.join(self.tmpdir, 'testApp', 'O.linux-x86_64'), 'aTest.t'),
+                         'wrong location for testApp/aTest.t')
+
+
+@unittest.skipIf(ci_os == 'windows', 'test Makefiles use POSIX shell commands')
+class TestTestTimes(unittest.TestCase):
+    scripts = {
+        'a.t': 'echo a >> ../order; echo 1..1; echo ok 1',
+        'b.t': 'echo b >> ../order; echo 1..2; echo ok 1; echo not ok 2',
+        'c.t': 'echo c >> ../order; sleep 10; echo 1..1; echo ok 1',
+    }
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        os.environ['TEST_TIMES'] = 'YES'
+        os.environ['PARALLEL_MAKE'] = '1'
+        cue.clear_lists()
+        cue.detect_context()
+        self.odir = os.path.join(self.tmpdir, 'testApp', 'O.linux-x86_64')
+        os.makedirs(self.odir)
+        with open(os.path.join(self.odir, 'Makefile'), 'w') as f:
+            f.write('%.tap: %.t\n\t-sh $< > $@\n')
+        for script, content in self.scripts.items():
+            with open(os.path.join(self.odir, script), 'w') as f:
+                f.write(content + '\n')
+        self.tests = dict(('testApp/' + script, (self.odir, script)) for script in self.scripts)
+        cue.save_test_times({'testApp/a.t': (1., 'ok'), 'testApp/b.t': (5., 'ok')})
+
+    def tearDown(self):
+        cue.make_timeout = 0.
+        cue.kill_delay = 10.
+        for var in ['CACHEDIR', 'TEST_TIMES', 'PARALLEL_MAKE']:
+            os.environ.pop(var, None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_LongestFirstAndRecorded(self):
+        cue.make_timeout = 2.
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            # the make run of the timed-out test fails
+            self.assertRaises(SystemExit, cue.run_tests, self.tests)
+        finally:
+            sys.stdout = sys.__stdout__
+        with open(os.path.join(self.tmpdir, 'testApp', 'order')) as f:
+            order = f.read().split()
+        self.assertEqual(order, ['c', 'b', 'a'], 'tests not run unknown/longest first ({0})'.format(order))
+        times = cue.load_test_times()
+        outcomes = dict((name, times[name][1]) for name in times)
+        self.assertEqual(outcomes, {'testApp/a.t': 'ok', 'testApp/b.t': 'failed', 'testApp/c.t': 'timeout'},
+                         'wrong outcomes recorded ({0})'.format(outcomes))
+        self.assertTrue(times['testApp/c.t'][0] < 5., 'test c.t was not stopped at its timeout')
+        with open(os.path.join(self.odir, 'c.tap')) as f:
+            self.assertRegex(f.read(), 'Bail out!', 'TAP file of timed-out test does not show the failure')
+
+    @unittest.skipIf(ci_os == 'windows', 'Test uses POSIX signals')
+    def test_TestIgnoringTermKilled(self):
+        with open(os.path.join(self.odir, 'stubborn.t'), 'w') as f:
+            f.write("trap '' TERM; echo 1..1; sleep 31; echo ok 1\n")
+        # make waits for the recipe, which ignores SIGTERM as well
+        with open(os.path.join(self.odir, 'Makefile'), 'a') as f:
+            f.write("stubborn.tap: stubborn.t\n\t-trap '' TERM; sh $< > $@\n")
+        cue.make_timeout = 1.
+        cue.kill_delay = 1.
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        started = time.time()
+        try:
+            self.assertRaises(SystemExit, cue.run_tests, {'testApp/stubborn.t': (self.odir, 'stubborn.t')})
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertTrue(time.time() - started < 10, 'test ignoring SIGTERM was not killed')
+        self.assertTrue('killing it' in capturedOutput.getvalue(), 'SIGKILL not reported')
+        self.assertEqual(cue.load_test_times()['testApp/stubborn.t'][1], 'timeout', 'wrong outcome recorded')
+        time.sleep(0.5)
+        sleeps = [line for line in sp.check_output(['ps', '-A', '-o', 'args=']).decode().splitlines()
+                  if line.strip() == 'sleep 31']
+        self.assertEqual(sleeps, [], 'processes of the stopped test still running')
+
+    def test_MakeErrorPropagated(self):
+        with open(os.path.join(self.odir, 'Makefile'), 'a') as f:
+            f.write('broken.tap: a.t\n\texit 3\n')
+        tests = {'testApp/broken.t': (self.odir, 'broken.t'), 'testApp/a.t': (self.odir, 'a.t')}
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            with self.assertRaises(SystemExit) as cm:
+                cue.run_tests(tests)
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertNotEqual(cm.exception.code, 0, 'make error not propagated')
+        times = cue.load_test_times()
+        self.assertEqual(times['testApp/a.t'][1], 'ok', 'other tests not run')
+        self.assertEqual(times['testApp/broken.t'][1], 'failed', 'outcome of the failing make run not recorded')
+
+    def test_TimeoutFromHistory(self):
+        times = {'testApp/a.t': (1., 'ok'), 'testApp/b.t': (100., 'ok')}
+        self.assertEqual(cue.test_timeout('testApp/a.t', times), 60., 'timeout below one minute')
+        self.assertEqual(cue.test_timeout('testApp/b.t', times), 500., 'timeout not 5 times the duration')
+        self.assertEqual(cue.test_timeout('testApp/c.t', times), None, 'timeout for test without history')
+
+    def test_TapOutcome(self):
+        tapfile = os.path.join(self.odir, 'x.tap')
+        for content, outcome in [('1..2\nok 1\nok 2\n', 'ok'), ('1..2\nok 1\n', 'failed'),
+                                 ('1..1\nnot ok 1\n', 'failed'), ('ok 1\n', 'failed'),
+                                 ('1..2\nok 1 # SKIP no network\nnot ok 2 # TODO not done yet\n', 'ok'),
+                                 ('1..1\nnot ok 1 - todo list # skip\n', 'failed')]:
+            with open(tapfile, 'w') as f:
+                f.write(content)
+            self.assertEqual(cue.tap_outcome(tapfile), outcome, 'wrong outcome for {0!r}'.format(content))
+
+
+@unittest.skipIf(ci_os == 'windows', 'Watchdog tests use POSIX shell commands')
+class TestIdleWatchdog(unittest.TestCase):
+    makefile = ('idle:\n\t@echo started; (sleep 61 &); sleep 62; echo never\n'
+                'active:\n\t@for i in 1 2 3 4 5 6; do echo $$i; sleep 0.5; done\n'
+                '%.tap: %.t\n\t-sh $< > $@\n')
+    scripts = {
+        # writes to the TAP file regularly
+        'slow.t': 'echo 1..6; for i in 1 2 3 4 5 6; do sleep 0.5; echo ok $i; done',
+        'hung.t': 'echo 1..1; sleep 63; echo ok 1',
+    }
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        os.environ['PARALLEL_MAKE'] = '2'
+        cue.clear_lists()
+        cue.detect_context()
+        cue.idle_timeout = 1.5
+        self.odir = os.path.join(self.tmpdir, 'testApp', 'O.linux-x86_64')
+        os.makedirs(self.odir)
+        with open(os.path.join(self.odir, 'Makefile'), 'w') as f:
+            f.write(self.makefile)
+        for script, content in self.scripts.items():
+            with open(os.path.join(self.odir, script), 'w') as f:
+                f.write(content + '\n')
+
+    def tearDown(self):
+        cue.idle_timeout = 0.
+        cue.kill_delay = 10.
+        for var in ['CACHEDIR', 'PARALLEL_MAKE']:
+            os.environ.pop(var, None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def running_sleeps(self):
+        return [line for line in sp.check_output(['ps', '-A', '-o', 'args=']).decode().splitlines()
+                if re.match(r'^sleep 6[123]$', line.strip())]
+
+    def test_IdleMakeStopped(self):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        started = time.time()
+        try:
+            self.assertRaises(SystemExit, cue.call_make, ['idle'], cwd=self.odir, parallel=0)
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertTrue(time.time() - started < 15, 'idle make was not stopped')
+        output = capturedOutput.getvalue()
+        self.assertTrue('No output from make' in output, 'watchdog did not report the idle make')
+        self.assertTrue('sleep 62' in output and 'sleep 61' in output, 'process tree not shown:\n' + output)
+        self.assertFalse('never' in output.splitlines(), 'make continued after being stopped')
+        time.sleep(0.5)
+        self.assertEqual(self.running_sleeps(), [], 'processes of the idle make still running')
+
+    def test_ActiveMakeNotStopped(self):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.call_make(['active'], cwd=self.odir, parallel=0)
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertFalse('No output from' in capturedOutput.getvalue(), 'active make was stopped')
+
+    def test_SilentBuildsShowDirectories(self):
+        self.assertTrue('-w' in cue.make_options(2, silent=True), 'watched silent make has no directory messages')
+        cue.idle_timeout = 0.
+        self.assertFalse('-w' in cue.make_options(2, silent=True), 'unwatched silent make has directory messages')
+
+    def test_SignalsForwarded(self):
+        child = sp.Popen(['sh', '-c', 'sleep 61; echo never'], stdout=sp.PIPE, **cue.child_kws({}))
+        cue.OutputWatchdog(child, 'sleeper')
+        try:
+            time.sleep(0.2)
+            # forwarding only, no handler was installed
+            cue.forward_signal(signal.SIGTERM, None)
+            self.assertEqual(child.communicate()[0], b'', 'child continued after the signal')
+        finally:
+            cue.kill_process_tree(child, force=True)
+        self.assertEqual(child.returncode, -signal.SIGTERM, 'signal not forwarded to the child')
+        time.sleep(0.5)
+        self.assertEqual(self.running_sleeps(), [], 'processes of the child still running')
+
+    def test_IdleTestStopped(self):
+        tests = dict(('testApp/' + script, (self.odir, script)) for script in self.scripts)
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        started = time.time()
+        try:
+            self.assertRaises(SystemExit, cue.run_tests, tests)
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertTrue(time.time() - started < 15, 'idle test was not stopped')
+        times = cue.load_test_times()
+        outcomes = dict((name, times[name][1]) for name in times)
+        self.assertEqual(outcomes, {'testApp/slow.t': 'ok', 'testApp/hung.t': 'timeout'},
+                         'wrong outcomes ({0})'.format(outcomes))
+        with open(os.path.join(self.odir, 'hung.tap')) as f:
+            self.assertTrue('Bail out! No output' in f.read(), 'TAP file of the idle test does not show the failure')
+
+    def test_IdleTestIgnoringTermKilled(self):
+        with open(os.path.join(self.odir, 'stubborn.t'), 'w') as f:
+            f.write("trap '' TERM; echo 1..1; sleep 61; echo ok 1\n")
+        # make waits for the recipe, which ignores SIGTERM as well
+        with open(os.path.join(self.odir, 'Makefile'), 'a') as f:
+            f.write("stubborn.tap: stubborn.t\n\t-trap '' TERM; sh $< > $@\n")
+        cue.kill_delay = 1.
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        started = time.time()
+        try:
+            self.assertRaises(SystemExit, cue.run_tests, {'testApp/stubborn.t': (self.odir, 'stubborn.t')})
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertTrue(time.time() - started < 10, 'idle test ignoring SIGTERM was not killed')
+        self.assertEqual(cue.load_test_times()['testApp/stubborn.t'][1], 'timeout', 'wrong outcome recorded')
+        time.sleep(0.5)
+        self.assertEqual(self.running_sleeps(), [], 'processes of the idle test still running')
+
+
+@unittest.skipIf(ci_os == 'windows', 'test Makefiles use POSIX shell commands')
+class TestCompaction(unittest.TestCase):
+    makefiles = {
+        'BASE': 'all:\n\tmkdir -p lib include && echo base > lib/libbase && touch include/base.h\nclean:\n',
+        'MOD1': 'all:\n\tmkdir -p lib O.linux && echo mod1 > lib/libmod1 && touch O.linux/obj built\nclean:\n',
+    }
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        os.environ['CLEAN_DEPS'] = 'COMPACT'
+        os.environ['SETUP_PATH'] = '.'
+        os.environ['MODULES'] = 'MOD1'
+        os.environ['EPICS_HOST_ARCH'] = 'linux-x86_64'
+        cue.clear_lists()
+        cue.detect_context()
+        cue.is_make3 = bool(re.match(r'^GNU Make 3', sp.check_output(['make', '-v']).decode('ascii')))
+        cue.setup['BASE_VARNAME'] = 'EPICS_BASE'
+        for mod in cue.modlist():
+            cue.setup[mod + '_REPOURL'] = make_local_repo(os.path.join(self.tmpdir, 'repos', mod.lower()), files={
+                'Makefile': self.makefiles[mod],
+                'configure/RELEASE': 'EPICS_BASE=/nowhere\n',
+                'src/source.c': 'int x;\n',
+            })
+            cue.setup[mod] = 'main'
+            cue.complete_setup(mod)
+        self.place = os.path.join(cue.ci['cachedir'], 'mod1-main')
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.add_dependencies(cue.modlist())
+            self.commit = cue.get_git_hash(self.place)
+            self.keys = cue.binary_cache_keys()
+            cue.build_dependencies(cue.modules_to_compile)
+        finally:
+            sys.stdout = sys.__stdout__
+        self.output = capturedOutput.getvalue()
+
+    def tearDown(self):
+        for var in ['CACHEDIR', 'CLEAN_DEPS', 'MODULES', 'EPICS_HOST_ARCH']:
+            os.environ.pop(var, None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_OnlyInstalledFilesKept(self):
+        self.assertRegex(self.output, 'Compacted dependency MOD1')
+        for name in ['lib', 'configure', 'checked_out']:
+            self.assertTrue(os.path.exists(os.path.join(self.place, name)), '{0} removed by compaction'.format(name))
+        for name in ['.git', 'src', 'O.linux', 'Makefile', 'built']:
+            self.assertFalse(os.path.exists(os.path.join(self.place, name)), '{0} kept by compaction'.format(name))
+
+    def test_CompactedCheckoutUsable(self):
+        self.assertEqual(cue.get_git_hash(self.place), self.commit, 'wrong commit for compacted checkout')
+        self.assertEqual(cue.module_release_vars(self.place), set(['EPICS_BASE']),
+                         'RELEASE variables of compacted checkout lost')
+        self.assertEqual(cue.binary_cache_keys(), self.keys, 'binary cache keys changed by compaction')
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            self.assertFalse(cue.checkout_dependency('MOD1'), 'compacted checkout not found up-to-date')
+        finally:
+            sys.stdout = sys.__stdout__
+
+    def test_RebuildChecksOutAgain(self):
+        # new Base version with different outputs
+        add_local_commit(os.path.join(self.tmpdir, 'repos', 'base'), 'Makefile',
+                         'all:\n\tmkdir -p lib include && echo base2 > lib/libbase\nclean:\n')
+        cue.fresh_checkouts.clear()
+        cue.fresh_checkouts.add('BASE')
+        cue.modules_to_compile[:] = ['BASE', 'MOD1']
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.build_dependencies(cue.modules_to_compile)
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertRegex(capturedOutput.getvalue(), 'Checking out dependency MOD1 again')
+        self.assertTrue(os.path.exists(os.path.join(self.place, 'lib', 'libmod1')), 'MOD1 not rebuilt')
+        self.assertFalse(os.path.exists(os.path.join(self.place, 'src')), 'MOD1 not compacted after rebuild')
+
+
+class TestCachePrune(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        os.environ['SHARED_OBJECTS'] = 'YES'
+        os.environ['MODULES'] = 'MOD1'
+        os.environ['SETUP_PATH'] = '.'
+        cue.clear_lists()
+        cue.detect_context()
+        cue.setup['BASE_VARNAME'] = 'EPICS_BASE'
+        for mod in cue.modlist():
+            cue.setup[mod + '_REPOURL'] = make_local_repo(os.path.join(self.tmpdir, 'repos', mod.lower()),
+                                                          files={'configure/RELEASE': 'EPICS_BASE=/nowhere\n',
+                                                                 'data': 'x' * 10000})
+            cue.setup[mod] = 'main'
+            cue.complete_setup(mod)
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        cue.add_dependencies(cue.modlist())
+        # two old versions of MOD2 (not in the module list), the older one first
+        self.old = []
+        cue.setup['MOD2_REPOURL'] = make_local_repo(os.path.join(self.tmpdir, 'repos', 'mod2'),
+                                                    files={'data': 'y' * 10000})
+        for tag in ['R1', 'R2']:
+            cue.setup['MOD2'] = 'main'
+            cue.complete_setup('MOD2')
+            cue.checkout_dependency('MOD2')
+            place = os.path.join(cue.ci['cachedir'], 'mod2-' + tag)
+            os.rename(os.path.join(cue.ci['cachedir'], 'mod2-main'), place)
+            self.old.append(os.path.abspath(place))
+        sys.stdout = sys.__stdout__
+        self.mod2_store = cue.object_store(cue.setup['MOD2_REPOURL'])
+        cue.record_cache_use(cue.referenced_cache_entries())
+        last_used = cue.load_last_used()
+        last_used[self.old[0]] = 1000.
+        last_used[self.old[1]] = 2000.
+        cue.save_last_used(last_used)
+
+    def tearDown(self):
+        for var in ['CACHEDIR', 'SHARED_OBJECTS', 'MODULES', 'CACHE_MAX_SIZE']:
+            os.environ.pop(var, None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def prune(self, max_size):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.prune_cache(max_size)
+        finally:
+            sys.stdout = sys.__stdout__
+        return capturedOutput.getvalue()
+
+    def test_ParseSize(self):
+        self.assertEqual(cue.parse_size('2G'), 2 * 1024 ** 3, 'wrong size for 2G')
+        self.assertEqual(cue.parse_size('512 MiB'), 512 * 1024 ** 2, 'wrong size for 512 MiB')
+        self.assertEqual(cue.parse_size('1000'), 1000, 'wrong size for 1000')
+        self.assertRaises(ValueError, cue.parse_size, '2 apples')
+
+    def test_LeastRecentlyUsedFirst(self):
+        total = sum(cue.directory_size(entry) for entry in cue.cache_entries())
+        self.prune(total - 1)
+        self.assertFalse(os.path.exists(self.old[0]), 'least recently used entry not removed')
+        self.assertTrue(os.path.exists(self.old[1]), 'more recently used entry removed')
+
+    def test_ReferencedEntriesKept(self):
+        output = self.prune(0)
+        for place in self.old:
+            self.assertFalse(os.path.exists(place), '{0} not removed'.format(place))
+        self.assertFalse(os.path.exists(self.mod2_store), 'unused shared object store not removed')
+        for mod in cue.modlist():
+            place = os.path.join(cue.ci['cachedir'], mod.lower() + '-main')
+            self.assertTrue(os.path.exists(place), 'checkout of {0} in the module list removed'.format(mod))
+            self.assertTrue(os.path.exists(cue.object_store(cue.setup[mod + '_REPOURL'])),
+                            'shared object store of {0} in the module list removed'.format(mod))
+        self.assertRegex(output, 'exceeds the limit')
+
+    def test_CacheCommandRequired(self):
+        stderr = sys.stderr
+        sys.stderr = getStringIO()
+        try:
+            self.assertRaises(SystemExit, cue.getargs().parse_args, ['cache'])
+        finally:
+            sys.stderr = stderr
+        args = cue.getargs().parse_args(['cache', 'prune'])
+        self.assertEqual(args.func, cue.cache_prune, 'cache prune not selected')
+
+    def test_StoreKeptWhileUsed(self):
+        # R2 is the most recent entry, the store is older than it
+        total = sum(cue.directory_size(entry) for entry in cue.cache_entries())
+        self.prune(total - cue.directory_size(self.old[0]) - 1)
+        self.assertTrue(os.path.exists(self.mod2_store), 'shared object store removed while used by a checkout')
+
+
+@unittest.skipIf(ci_os == 'windows', 'test uses a shell script as compiler cache')
+class TestCompilerCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.environ['PATH']
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        os.environ['COMPILER_CACHE'] = 'YES'
+        cue.clear_lists()
+        cue.detect_context()
+        cue.ci['compiler'] = 'gcc'
+        # fake ccache executable
+        bindir = os.path.join(self.tmpdir, 'bin')
+        os.makedirs(bindir)
+        with open(os.path.join(bindir, 'ccache'), 'w') as f:
+            f.write('#!/bin/sh\nexit 0\n')
+        os.chmod(os.path.join(bindir, 'ccache'), 0o755)
+        os.environ['PATH'] = os.pathsep.join([bindir, self.path])
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        for var in ['CACHEDIR', 'COMPILER_CACHE', 'CCACHE_DIR', 'CUE_COMPILER_CACHE']:
+            os.environ.pop(var, None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_SetupEnvironment(self):
+        self.assertEqual(cue.ci['compiler_cache'], 'ccache', 'COMPILER_CACHE=YES does not select ccache')
+        cue.setup_compiler_cache()
+        self.assertEqual(os.environ.get('CUE_COMPILER_CACHE'), 'ccache', 'CUE_COMPILER_CACHE not set')
+        self.assertEqual(os.environ.get('CCACHE_DIR'), os.path.join(cue.ci['cachedir'], 'ccache'),
+                         'CCACHE_DIR not in the cache area')
+
+    def test_MissingToolDisablesCache(self):
+        # only the fake ccache is on the PATH
+        os.environ['PATH'] = os.path.join(self.tmpdir, 'bin')
+        cue.ci['compiler_cache'] = 'sccache'
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.setup_compiler_cache()
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertRegex(capturedOutput.getvalue(), 'sccache not found')
+        self.assertEqual(cue.ci['compiler_cache'], '', 'missing compiler cache not disabled')
+        self.assertFalse('CUE_COMPILER_CACHE' in os.environ, 'CUE_COMPILER_CACHE set for missing tool')
+
+    def test_MakeWrapsCompilers(self):
+        with open(os.path.join(self.tmpdir, 'Makefile'), 'w') as f:
+            f.write('T_A = linux-x86_64\nCC = gcc\nCCC = g++\n' + cue.compiler_cache_config
+                    + '\nall:\n\t@echo "$(CC),$(CCC)"\n')
+        env = dict(os.environ, CUE_COMPILER_CACHE='ccache')
+        out = sp.check_output(['make', '-s'], cwd=self.tmpdir, env=env).decode().strip()
+        self.assertEqual(out, 'ccache gcc,ccache g++', 'compilers not wrapped ({0})'.format(out))
+        env.pop('CUE_COMPILER_CACHE')
+        out = sp.check_output(['make', '-s'], cwd=self.tmpdir, env=env).decode().strip()
+        self.assertEqual(out, 'gcc,g++', 'compilers wrapped without CUE_COMPILER_CACHE ({0})'.format(out))
+
+
+@unittest.skipIf(ci_os == 'windows', 'no make jobserver on Windows')
+class TestJobServer(unittest.TestCase):
+    # every job records how many jobs are running while it runs
+    makefile = ('all: j1 j2 j3 j4 j5 j6\n'
+                'j%:\n'
+                '\t@mkdir running.$@ && ls -d running.* | wc -l >> counts && sleep 0.3 && rmdir running.$@\n')
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['PARALLEL_MAKE'] = '2'
+        cue.clear_lists()
+        cue.detect_context()
+        cue.is_make3 = bool(re.match(r'^GNU Make 3', sp.check_output(['make', '-v']).decode('ascii')))
+        with open(os.path.join(self.tmpdir, 'Makefile'), 'w') as f:
+            f.write(self.makefile)
+
+    def tearDown(self):
+        os.environ.pop('PARALLEL_MAKE', None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_TokenAccounting(self):
+        js = cue.JobServer(2)
+        try:
+            self.assertTrue(js.acquire(block=False), 'first slot not available')
+            self.assertTrue(js.acquire(block=False), 'second slot not available')
+            self.assertFalse(js.acquire(block=False), 'got more slots than the jobserver holds')
+            js.release()
+            self.assertTrue(js.acquire(block=False), 'released slot not available')
+        finally:
+            js.close()
+
+    def test_TokenTakenByClient(self):
+        js = cue.JobServer(1)
+        try:
+            # a client make took the token after select() said it was there
+            os.read(js.read_fd, 1)
+            self.assertFalse(js.take(), 'token read from an empty jobserver')
+            self.assertFalse(js.acquire(block=False), 'acquired a slot from an empty jobserver')
+            self.assertEqual(js.held, 0, 'slot counted as held')
+            # the client was killed
+            js.refill()
+            self.assertTrue(js.acquire(block=False), 'slot not restored by refill')
+            self.assertFalse(js.acquire(block=False), 'refill added too many slots')
+        finally:
+            js.close()
+
+    def test_KilledMakeSlotsRestored(self):
+        with open(os.path.join(self.tmpdir, 'Makefile'), 'a') as f:
+            f.write('killed: k1 k2\nk1:\n\tsleep 2\nk2:\n\tsleep 0.5; kill -KILL $$PPID\n')
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            self.assertRaises(SystemExit, cue.call_make, ['killed'], cwd=self.tmpdir)
+        finally:
+            sys.stdout = sys.__stdout__
+        slots = 0
+        while cue.jobserver.acquire(block=False):
+            slots += 1
+        self.assertEqual(slots, 2, 'jobserver has {0} free slots after killed make (expected 2)'.format(slots))
+
+    def test_MakeUsesJobServer(self):
+        cue.call_make(cwd=self.tmpdir)
+        with open(os.path.join(self.tmpdir, 'counts')) as f:
+            counts = [int(line) for line in f]
+        self.assertEqual(len(counts), 6, 'not all jobs ran ({0})'.format(counts))
+        self.assertTrue(max(counts) <= 2, 'more than 2 concurrent jobs ({0})'.format(counts))
+        slots = 0
+        while cue.jobserver.acquire(block=False):
+            slots += 1
+        self.assertEqual(slots, 2, 'jobserver has {0} free slots after make (expected 2)'.format(slots))
+
+    def test_ConcurrentMakesShareJobServer(self):
+        # a make started while one slot is taken only gets the other one
+        js = cue.get_jobserver()
+        js.acquire()
+        cue.call_make(cwd=self.tmpdir)
+        js.release()
+        with open(os.path.join(self.tmpdir, 'counts')) as f:
+            counts = [int(line) for line in f]
+        self.assertEqual(max(counts), 1, 'make did not share the jobserver ({0})'.format(counts))
+
+
+class TestParallelism(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'cgroup')
+        self.proc = os.path.join(self.tmpdir, 'proc-cgroup')
+        self.meminfo = os.path.join(self.tmpdir, 'meminfo')
+        self.saved = (cue.cgroup_cpu_limit, cue.available_memory)
+        cue.clear_lists()
+        cue.detect_context()
+
+    def tearDown(self):
+        cue.cgroup_cpu_limit, cue.available_memory = self.saved
+        os.environ.pop('MAX_LOAD', None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def write(self, name, content):
+        if not os.path.isdir(os.path.dirname(name)):
+            os.makedirs(os.path.dirname(name))
+        with open(name, 'w') as f:
+            f.write(content)
+
+    def test_CgroupV2Limits(self):
+        self.write(os.path.join(self.root, 'cgroup.controllers'), 'cpu memory\n')
+        self.write(self.proc, '0::/ci/job\n')
+        self.write(os.path.join(self.root, 'ci', 'cpu.max'), 'max 100000\n')
+        self.write(os.path.join(self.root, 'ci', 'job', 'cpu.max'), '150000 100000\n')
+        self.write(os.path.join(self.root, 'ci', 'memory.max'), 'max\n')
+        self.write(os.path.join(self.root, 'ci', 'job', 'memory.max'), '{0}\n'.format(4 * 1024 ** 3))
+        self.write(os.path.join(self.root, 'ci', 'job', 'memory.current'), '{0}\n'.format(1024 ** 3))
+        self.write(self.meminfo, 'MemTotal: 16777216 kB\nMemAvailable: 8388608 kB\n')
+        self.assertEqual(cue.cgroup_cpu_limit(self.root, self.proc), 1.5, 'wrong CPU quota')
+        self.assertEqual(cue.available_memory(self.root, self.proc, self.meminfo), 3 * 1024 ** 3,
+                         'wrong available memory')
+
+    def test_CgroupV1Limits(self):
+        self.write(os.path.join(self.root, 'cpu,cpuacct', 'cpu.cfs_quota_us'), '200000\n')
+        self.write(os.path.join(self.root, 'cpu,cpuacct', 'cpu.cfs_period_us'), '100000\n')
+        self.write(os.path.join(self.root, 'memory', 'memory.limit_in_bytes'), '9223372036854771712\n')
+        self.write(os.path.join(self.root, 'memory', 'memory.usage_in_bytes'), '1000\n')
+        self.write(self.meminfo, 'MemAvailable: 2097152 kB\n')
+        self.assertEqual(cue.cgroup_cpu_limit(self.root, self.proc), 2.0, 'wrong CPU quota')
+        self.assertEqual(cue.available_memory(self.root, self.proc, self.meminfo), 2 * 1024 ** 3,
+                         'unlimited cgroup memory not ignored')
+
+    def test_NoLimits(self):
+        os.makedirs(self.root)
+        self.assertEqual(cue.cgroup_cpu_limit(self.root, self.proc), None, 'CPU quota found without cgroup')
+        self.assertEqual(cue.available_memory(self.root, self.proc, self.meminfo), None,
+                         'available memory found without information')
+
+    def test_DefaultParallelism(self):
+        cpus = cue.cpu_count() or 2
+        if hasattr(os, 'sched_getaffinity'):
+            cpus = min(cpus, len(os.sched_getaffinity(0)))
+        cue.cgroup_cpu_limit = lambda: None
+        cue.available_memory = lambda: None
+        self.assertEqual(cue.default_parallel_make(1024 ** 3)[0], cpus, 'not using all CPUs without limits')
+        cue.cgroup_cpu_limit = lambda: 0.5
+        jobs, reason = cue.default_parallel_make(1024 ** 3)
+        self.assertEqual(jobs, 1, 'fractional CPU quota not rounded up to one job')
+        if cpus > 1:
+            self.assertTrue('cgroup CPU quota' in reason, 'wrong reason ({0})'.format(reason))
+        cue.cgroup_cpu_limit = lambda: None
+        cue.available_memory = lambda: 1024 ** 3
+        self.assertEqual(cue.default_parallel_make(512 * 1024 ** 2)[0], min(cpus, 2), 'jobs not limited by memory')
+        cue.available_memory = lambda: 100
+        self.assertEqual(cue.default_parallel_make(1024 ** 3)[0], 1, 'less than one job with little memory')
+        self.assertEqual(cue.default_parallel_make(0)[0], cpus, 'memory limit applied with MEMORY_PER_JOB=0')
+
+    def test_MaxLoad(self):
+        os.environ['MAX_LOAD'] = '3.5'
+        cue.detect_context()
+        self.assertTrue('-l3.5' in cue.make_options(2), 'load limit not passed to make')
+        self.assertFalse('-l3.5' in cue.make_options(0), 'load limit passed to a serial make')
+
+
+class TestTraceEvents(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['TRACE_FILE'] = os.path.join(self.tmpdir, 'trace.json')
+        cue.clear_lists()
+        cue.detect_context()
+        with open(os.path.join(self.tmpdir, 'Makefile'), 'w') as f:
+            f.write('all:\n\t@echo done\n')
+
+    def tearDown(self):
+        os.environ.pop('TRACE_FILE', None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def load_events(self):
+        with open(os.environ['TRACE_FILE']) as f:
+            return json.load(f)['traceEvents']
+
+    def test_FoldsAndProcesses(self):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            with cue.Folded('test.fold', 'Testing trace events'):
+                cue.call_git(['--version'])
+                cue.call_make(cwd=self.tmpdir, parallel=0)
+        finally:
+            sys.stdout = sys.__stdout__
+        cue.write_trace('cue.py test')
+        events = dict((e['name'], e) for e in self.load_events() if e['ph'] == 'X')
+        self.assertEqual(sorted(events), ['Testing trace events', 'git', 'make'],
+                         'wrong trace events ({0})'.format(sorted(events)))
+        self.assertEqual(events['make']['args']['exitcode'], 0, 'make exit code not recorded')
+        fold = events['Testing trace events']
+        for name in ['git', 'make']:
+            self.assertTrue(fold['ts'] <= events[name]['ts']
+                            and events[name]['ts'] + events[name]['dur'] <= fold['ts'] + fold['dur'],
+                            '{0} event is not inside the fold'.format(name))
+
+    def test_RunsAreCollected(self):
+        for run in ['prepare', 'build']:
+            cue.call_git(['--version'], stdout=sp.PIPE)
+            cue.write_trace('cue.py ' + run)
+        events = self.load_events()
+        processes = [e['args']['name'] for e in events if e['name'] == 'process_name']
+        self.assertEqual(processes, ['cue.py prepare', 'cue.py build'], 'runs not collected ({0})'.format(processes))
+        self.assertEqual(len([e for e in events if e['ph'] == 'X']), 2, 'wrong number of events')
+
+    def test_NoTraceFile(self):
+        os.environ.pop('TRACE_FILE')
+        cue.detect_context()
+        cue.call_git(['--version'], stdout=sp.PIPE)
+        self.assertEqual(cue.trace_events, [], 'events recorded without TRACE_FILE')
+
+
+@unittest.skipIf(ci_os == 'windows', 'Self-profiling test uses a POSIX shell')
+class TestSelfProfile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        os.chdir(self.tmpdir)
+        cue.clear_lists()
+        cue.detect_context()
+
+    def tearDown(self):
+        os.environ.pop('CACHEDIR', None)
+        os.environ.pop('TRACE_FILE', None)
+        os.chdir(builddir)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_ProfileSeparatesBlockedTime(self):
+        def busy_work():
+            total = 0
+            for i in range(300000):
+                total += i * i
+            return total
+        def command(args):
+            busy_work()
+            sp.call(['sleep', '0.5'])
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.run_profiled(command, None, 'test')
+        finally:
+            sys.stdout = sys.__stdout__
+        import pstats
+        fname = os.path.join(self.tmpdir, 'cache', 'cue-test.prof')
+        self.assertTrue(os.path.exists(fname), 'profile not written to the cache directory')
+        self.assertEqual(os.listdir(self.tmpdir), ['cache'], 'profile written to the current directory')
+        blocked, own, functions = cue.profile_times(pstats.Stats(fname))
+        self.assertTrue(blocked >= 0.4, 'waiting for the child not counted as blocked ({0})'.format(blocked))
+        self.assertTrue(own < blocked, 'waiting for the child counted as own time ({0})'.format(own))
+        self.assertTrue(any('busy_work' in f[2] for f in functions[:5]),
+                        'busy_work not among the functions with most own time ({0})'.format(functions[:5]))
+        self.assertTrue('Profile of test written to {0}'.format(fname) in capturedOutput.getvalue(),
+                        'no profile summary printed')
+
+    def test_ProfileNextToTrace(self):
+        os.environ['TRACE_FILE'] = os.path.join(self.tmpdir, 'logs', 'trace.json')
+        os.makedirs(os.path.join(self.tmpdir, 'logs'))
+        cue.detect_context()
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.run_profiled(lambda args: None, None, 'test')
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'logs', 'cue-test.prof')),
+                        'profile not written next to the trace file')
+
+    def test_ProfileOption(self):
+        args = cue.getargs().parse_args(['--profile', 'prepare'])
+        self.assertTrue(args.profile, '--profile not parsed')
+        args = cue.getargs().parse_args(['prepare'])
+        self.assertFalse(args.profile, 'profiling enabled by default')
+
+
+@unittest.skipIf(ci_os == 'windows', 'Build profile test uses a POSIX shell')
+class TestBuildProfile(unittest.TestCase):
+    # a module-like tree: the top make recurses into two O.<arch> directories
+    makefiles = {'Makefile': 'all:\n\t+$(MAKE) -C src\n',
+                 'src/Makefile': 'all:\n\t+$(MAKE) -C O.arch1 -f ../Makefile.arch\n'
+                                 '\t+$(MAKE) -C O.arch2 -f ../Makefile.arch\n',
+                 'src/Makefile.arch': 'all:\n\t@sleep 0.3 && echo built\n'}
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['BUILD_PROFILE'] = os.path.join(self.tmpdir, 'profiles')
+        cue.clear_lists()
+        cue.detect_context()
+        cue.is_make3 = bool(re.match(r'^GNU Make 3', sp.check_output(['make', '-v']).decode('ascii')))
+        self.top = os.path.join(self.tmpdir, 'top')
+        for name, content in self.makefiles.items():
+            path = os.path.join(self.top, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(content)
+        for odir in ['O.arch1', 'O.arch2']:
+            os.makedirs(os.path.join(self.top, 'src', odir))
+
+    def tearDown(self):
+        os.environ.pop('BUILD_PROFILE', None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_ProfileParsesDirectoryMessages(self):
+        profile = cue.MakeProfile('test', '/top')
+        profile.feed("make[1]: Entering directory '/top/src'", 10.)
+        profile.feed("make[2]: Entering directory `/top/src/O.linux-x86_64'", 11.)
+        profile.feed('gcc -c foo.c', 12.)
+        profile.feed("make[2]: Leaving directory `/top/src/O.linux-x86_64'", 14.)
+        profile.feed("make[1]: Leaving directory '/top/src'", 15.)
+        result = profile.result()
+        dirs = dict((d['directory'], d) for d in result['directories'])
+        self.assertEqual(dirs['src']['seconds'], 5., 'wrong time for src ({0})'.format(dirs['src']))
+        self.assertFalse(dirs['src']['leaf'], 'src is reported as leaf directory')
+        self.assertEqual(dirs['src/O.linux-x86_64']['seconds'], 3.,
+                         'wrong time for src/O.linux-x86_64 ({0})'.format(dirs['src/O.linux-x86_64']))
+        self.assertEqual(result['targets'], {'linux-x86_64': 3.}, 'wrong per target times')
+
+    def test_BuildWritesProfile(self):
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.call_make(cwd=self.top, silent=True, profile='build')
+        finally:
+            sys.stdout = sys.__stdout__
+        with open(os.path.join(os.environ['BUILD_PROFILE'], 'build.json')) as f:
+            result = json.load(f)
+        dirs = dict((d['directory'], d) for d in result['directories'])
+        for odir in ['src/O.arch1', 'src/O.arch2']:
+            self.assertTrue(odir in dirs, '{0} missing in profile ({1})'.format(odir, sorted(dirs)))
+            self.assertTrue(dirs[odir]['seconds'] >= 0.25, 'time for {0} too short ({1})'.format(odir, dirs[odir]))
+        self.assertTrue(dirs['src']['seconds'] >= dirs['src/O.arch1']['seconds'] + dirs['src/O.arch2']['seconds'],
+                        'time for src shorter than its parts ({0})'.format(dirs))
+        self.assertEqual(capturedOutput.getvalue().count('built'), 2, 'make output was not passed through')
+        self.assertTrue('Build profile of build' in capturedOutput.getvalue(), 'no profile summary printed')
+
+
+class TestMatrix(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.module = os.path.join(self.tmpdir, 'module')
+        make_local_repo(self.module, files={'configure/RELEASE': 'EPICS_BASE=/nowhere\n'})
+        self.saved_environ = clean_environ()
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        os.environ['SETUP_PATH'] = builddir
+        os.environ['BASE_REPOURL'] = make_local_repo(os.path.join(self.tmpdir, 'base'))
+        os.environ['PARALLEL_MAKE'] = '1'
+        cue.clear_lists()
+        cue.detect_context()
+        self.curdir = cue.curdir
+        cue.curdir = self.module
+
+    def tearDown(self):
+        cue.curdir = self.curdir
+        restore_environ(self.saved_environ)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_Configurations(self):
+        configs = cue.matrix_configurations(['CMP=gcc,clang', 'BCFG=static, default'])
+        self.assertEqual(configs, [[('CMP', 'gcc'), ('BCFG', 'static')], [('CMP', 'gcc'), ('BCFG', 'default')],
+                                   [('CMP', 'clang'), ('BCFG', 'static')], [('CMP', 'clang'), ('BCFG', 'default')]],
+                         'wrong configurations ({0})'.format(configs))
+        self.assertEqual(cue.configuration_name(configs[0]), 'CMP-gcc_BCFG-static', 'wrong configuration name')
+        self.assertRaises(ValueError, cue.matrix_configurations, ['CMP'])
+
+    def test_MatrixRunsConfigurations(self):
+        # uncommitted changes of the main module are used
+        with open(os.path.join(self.module, 'configure', 'RELEASE'), 'w') as f:
+            f.write('EPICS_BASE=/changed\n')
+        args = cue.getargs().parse_args(['matrix', '-a', 'lock', '-j', '2', 'BASE=main,nosuchbranch',
+                                         'LOCKFILE=matrix.lock'])
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            self.assertRaises(SystemExit, cue.matrix, args)
+        finally:
+            sys.stdout = sys.__stdout__
+        output = capturedOutput.getvalue()
+        matrixdir = os.path.join(cue.ci['cachedir'], 'matrix')
+        good = os.path.join(matrixdir, 'BASE-main_LOCKFILE-matrix.lock', 'src')
+        self.assertTrue(os.path.exists(os.path.join(good, 'matrix.lock')), 'lock action did not run in the worktree')
+        with open(os.path.join(good, 'configure', 'RELEASE')) as f:
+            self.assertEqual(f.read(), 'EPICS_BASE=/changed\n', 'local changes not applied to the worktree')
+        self.assertFalse(os.path.exists(os.path.join(matrixdir, 'BASE-nosuchbranch_LOCKFILE-matrix.lock', 'src',
+                                                     'matrix.lock')), 'lock file written for failing configuration')
+        self.assertRegex(output, r'BASE=main LOCKFILE=matrix.lock +[0-9.]+ s  .*ok', 'good configuration not reported')
+        self.assertRegex(output, r'BASE=nosuchbranch LOCKFILE=matrix.lock +[0-9.]+ s  .*failed',
+                         'failing configuration not reported')
+
+    def test_TraceFilesMerged(self):
+        trace_file = os.path.join(self.tmpdir, 'trace.json')
+        os.environ['TRACE_FILE'] = trace_file
+        cue.detect_context()
+        args = cue.getargs().parse_args(['matrix', '-a', 'lock', '-j', '2', 'BASE=main', 'LOCKFILE=a.lock,b.lock'])
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.matrix(args)
+        finally:
+            sys.stdout = sys.__stdout__
+        with open(trace_file) as f:
+            events = json.load(f)['traceEvents']
+        runs = [event['args']['name'] for event in events if event['name'] == 'process_name']
+        self.assertEqual(len(runs), 2, 'wrong runs in the merged trace file ({0})'.format(runs))
+        self.assertEqual(len(set(event['pid'] for event in events)), 2, 'runs not separate processes in the trace')
+        matrixdir = os.path.join(cue.ci['cachedir'], 'matrix')
+        self.assertEqual([name for name in os.listdir(matrixdir) if name.endswith('.trace.json')], [],
+                         'trace files of the configurations not removed')
+
+    def test_WorktreeFailureRecorded(self):
+        matrixdir = os.path.join(cue.ci['cachedir'], 'matrix')
+        os.makedirs(os.path.join(matrixdir, 'BASE-broken'))
+        # the worktree can't be created where a file is in the way
+        with open(os.path.join(matrixdir, 'BASE-broken', 'src'), 'w') as f:
+            f.write('in the way\n')
+        args = cue.getargs().parse_args(['matrix', '-a', 'lock', '-j', '2', 'BASE=broken,main'])
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            self.assertRaises(SystemExit, cue.matrix, args)
+        finally:
+            sys.stdout = sys.__stdout__
+        output = capturedOutput.getvalue()
+        self.assertTrue(os.path.exists(os.path.join(matrixdir, 'BASE-main', 'src', 'cue.lock')),
+                        'other configuration did not run')
+        self.assertRegex(output, r'BASE=broken +[0-9.]+ s  .*failed', 'worktree failure not reported')
+        self.assertRegex(output, r'BASE=main +[0-9.]+ s  .*ok', 'good configuration not reported')
+
+    def test_MatrixAreasPruned(self):
+        args = cue.getargs().parse_args(['matrix', '-a', 'lock', 'BASE=main'])
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.matrix(args)
+            area = os.path.abspath(os.path.join(cue.ci['cachedir'], 'matrix', 'BASE-main'))
+            os.makedirs(os.path.join(area, 'base-main'))
+            with open(os.path.join(area, 'base-main', 'checked_out'), 'w') as f:
+                f.write('x' * 10000)
+            entries = cue.cache_entries()
+            self.assertTrue(os.path.join(area, 'src') in entries, 'matrix worktree not a cache entry')
+            self.assertTrue(os.path.join(area, 'base-main') in entries, 'matrix dependency not a cache entry')
+            cue.cache_prune(Namespace(max_size='0'))
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertFalse(os.path.exists(area), 'matrix configuration area not removed')
+        self.assertFalse(os.path.exists(area + '.log'), 'log of the removed configuration not removed')
+        worktrees = sp.check_output(['git', 'worktree', 'list'], cwd=self.module).decode()
+        self.assertFalse('BASE-main' in worktrees, 'removed worktree still registered:\n' + worktrees)
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        cue.clear_lists()
+        cue.detect_context()
+
+    def tearDown(self):
+        os.environ.pop('CUE_TEST_VAR', None)
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def test_LauncherImportsLibrary(self):
+        self.assertEqual(cue.__name__, 'cuelib.cue', 'import cue does not give the implementation module')
+        output = sp.check_output([sys.executable, os.path.join(builddir, 'cue.py'), '--help']).decode()
+        self.assertTrue('prepare' in output, 'launcher does not run the script')
+
+    def test_SessionsKeepSeparateState(self):
+        cue.setup['OUTER'] = 'yes'
+        static = cue.Session(environ=dict(os.environ, BCFG='static', CUE_TEST_VAR='static'), cwd=self.tmpdir)
+        shared = cue.Session(environ=dict(os.environ, BCFG='default'))
+        with static:
+            self.assertEqual(cue.setup, {}, 'new session does not start with an empty setup')
+            self.assertEqual(os.getcwd(), os.path.realpath(self.tmpdir), 'session working directory not set')
+            cue.detect_context()
+            cue.setup['MOD'] = 'static'
+            os.environ['EPICS_HOST_ARCH'] = 'static-arch'
+            with shared:
+                self.assertFalse('CUE_TEST_VAR' in os.environ, 'environment leaked into another session')
+                cue.detect_context()
+                cue.setup['MOD'] = 'shared'
+                self.assertEqual(cue.ci['configuration'], 'shared-optimized', 'wrong configuration')
+            self.assertEqual(cue.ci['configuration'], 'static-optimized', 'configuration not restored')
+            self.assertEqual(cue.setup, {'MOD': 'static'}, 'setup not restored')
+            self.assertEqual(os.environ['EPICS_HOST_ARCH'], 'static-arch', 'environment not restored')
+        self.assertEqual(cue.setup, {'OUTER': 'yes'}, 'state of the outer session not restored')
+        self.assertFalse('CUE_TEST_VAR' in os.environ, 'session environment leaked')
+        self.assertEqual(os.getcwd(), builddir, 'working directory not restored')
+        with shared:
+            self.assertEqual(cue.setup, {'MOD': 'shared'}, 'session state not kept')
+
+    def test_SessionsAreSequential(self):
+        errors = []
+        def enter_other():
+            try:
+                with cue.Session():
+                    pass
+            except RuntimeError as e:
+                errors.append(e)
+        with cue.Session():
+            other = threading.Thread(target=enter_other)
+            other.start()
+            other.join()
+        self.assertEqual(len(errors), 1, 'session entered while another thread has an active session')
+        other = threading.Thread(target=enter_other)
+        other.start()
+        other.join()
+        self.assertEqual(len(errors), 1, 'session not usable after the active one was left')
+
+    def test_LazyVCVars(self):
+        if ci_os != 'windows':
+            self.assertEqual(cue.find_vcvars(), {}, 'Visual Studio found on {0}'.format(ci_os))
+
+
+class TestResolvedSetup(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.setupdir = os.path.join(self.tmpdir, 'setups')
+        os.makedirs(self.setupdir)
+        with open(os.path.join(self.setupdir, 'outer.set'), 'w') as f:
+            f.write('MODULES=mod1\nMOD1=R1-0\ninclude inner\n')
+        with open(os.path.join(self.setupdir, 'inner.set'), 'w') as f:
+            f.write('BASE=7.0\nMOD1=R0-9\n')
+        with open(os.path.join(self.setupdir, 'defaults.set'), 'w') as f:
+            f.write('REPOOWNER=epics-modules\n')
+        os.environ['SETUP_PATH'] = self.setupdir
+        os.environ['CACHEDIR'] = os.path.join(self.tmpdir, 'cache')
+        for var in ['BASE', 'MOD1', 'MODULES']:
+            os.environ.pop(var, None)
+        os.chdir(builddir)
+
+    def tearDown(self):
+        os.environ.pop('CACHEDIR', None)
+        os.environ.pop('MOD1', None)
+        os.environ.pop('MOD1_HOOK', None)
+        os.environ['SETUP_PATH'] = '.:appveyor'
+        cue.clear_lists()
+        shutil.rmtree(self.tmpdir, onerror=cue.remove_readonly)
+
+    def load(self):
+        cue.clear_lists()
+        cue.detect_context()
+        capturedOutput = getStringIO()
+        sys.stdout = capturedOutput
+        try:
+            cue.load_setup('outer')
+        finally:
+            sys.stdout = sys.__stdout__
+        return capturedOutput.getvalue()
+
+    def test_CachedSetupIsUsed(self):
+        output = self.load()
+        resolved = dict(cue.setup)
+        self.assertTrue('Opening setup file' in output, 'setup files not read on first load')
+        self.assertEqual(len(cue.seen_setups), 3, 'not all setup files recorded')
+        output = self.load()
+        self.assertFalse('Opening setup file' in output, 'cached setup not used')
+        self.assertEqual([os.path.basename(f) for f in re.findall(r'Using setup file (\S+)', output)],
+                         ['outer.set', 'inner.set', 'defaults.set'], 'cached setup files not in include order')
+        self.assertEqual(cue.setup, resolved, 'cached setup differs from resolved setup')
+        self.assertEqual(cue.setup['MOD1'], 'R1-0', 'first setting did not win')
+        self.assertEqual(cue.setup['MOD1_REPOURL'], 'https://github.com/epics-modules/mod1.git',
+                         'defaults not applied')
+
+    def test_ChangesInvalidateCache(self):
+        self.load()
+        with open(os.path.join(self.setupdir, 'inner.set'), 'a') as f:
+            f.write('FOO=bar\n')
+        output = self.load()
+        self.assertTrue('Opening setup file' in output, 'cache not invalidated by changed include file')
+        self.assertEqual(cue.setup['FOO'], 'bar', 'changed include file not read')
+        os.environ['MOD1'] = 'R2-0'
+        output = self.load()
+        self.assertTrue('Opening setup file' in output, 'cache not invalidated by environment override')
+        self.assertEqual(cue.setup['MOD1'], 'R2-0', 'environment override not applied')
+        self.assertEqual(cue.setup['MOD1_REPONAME'], 'mod1', 'defaults not applied')
+
+    def test_UnsetVariableInvalidatesCache(self):
+        self.load()
+        self.assertFalse('MOD1_HOOK' in cue.setup, 'hook set without being configured')
+        os.environ['MOD1_HOOK'] = 'myhook.sh'
+        output = self.load()
+        self.assertTrue('Opening setup file' in output, 'cache not invalidated by newly set hook variable')
+        self.assertEqual(cue.setup.get('MOD1_HOOK'), 'myhook.sh', 'hook from environment not applied')
+
+    def test_ResolvePrintsJson(self):
+        env = dict(os.environ, GITHUB_ACTIONS='1', RUNNER_OS='Linux')
+        output = sp.check_output([sys.executable, os.path.join(builddir, 'cue.py'), 'resolve', 'outer'],
+                                 env=env, stderr=sp.DEVNULL if hasattr(sp, 'DEVNULL') else None).decode()
+        resolved = json.loads(output)
+        self.assertEqual(resolved['modules'], ['BASE', 'MOD1'], 'wrong module list')
+        self.assertEqual(resolved['setup']['BASE'], '7.0', 'included setting missing')
+        self.assertEqual(len(resolved['files']), 3, 'wrong list of setup files')
+
+
 class TestDefaultModuleURLs(unittest.TestCase):
     modules = ['BASE', 'PVDATA', 'PVACCESS', 'NTYPES',
                'SNCSEQ', 'STREAM', 'ASYN', 'STD',
@@ -0,0 +1,8 @@
+"""EPICS CI build scripts as a library
+
+cuelib.cue implements the cue.py actions. All state of a run lives in the
+module; cuelib.cue.Session holds one set of that state, so that several
+configurations can be prepared one after the other in one process.
+Sessions cannot be active concurrently (in different threads); run
+concurrent configurations in separate processes.
+"""
@@ -0,0 +1,4384 @@
+"""EPICS CI build script for Linux/MacOS/Windows on Travis/GitLab/AppVeyor/GitHub-Actions
+
+Implementation of the cue.py actions (run through the cue.py launcher)
+"""
+
+from __future__ import print_function
+
+import sys, os, stat, shlex, shutil
+import collections
+import errno
+import fileinput
+import itertools
+import logging
+import hashlib
+import json
+import math
+import re
+import select
+import signal
+import time
+import threading
+from glob import glob
+from multiprocessing.pool import ThreadPool
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+import subprocess as sp
+import sysconfig
+import tempfile
+import shutil
+
+try:
+    from os import cpu_count
+except ImportError:
+    def cpu_count():
+        pass # undetermined
+
+logger = logging.getLogger(__name__)
+
+# Keep track of all files we write/append for later logging
+_realopen = open
+_modified_files = set()
+def open(fname, mode='r'):
+    F = _realopen(fname, mode)
+    if 'w' in mode or 'a' in mode:
+        _modified_files.add(os.path.normpath(os.path.abspath(fname)))
+    return F
+
+def log_modified():
+    for fname in _modified_files:
+        with Folded(os.path.basename(fname), 'Contents of '+fname):
+            with open(fname, 'r') as F:
+                sys.stdout.write(F.read())
+            sys.stdout.write(os.linesep)
+
+def whereis(cmd):
+    if hasattr(shutil, 'which'): # >= py3.3
+        loc = shutil.which(cmd)
+        print('{0}Found exec {1} at {2!r} {3}'.format(ANSI_CYAN, cmd, loc, ANSI_RESET))
+
+def prepare_env():
+    '''HACK
+    github actions yaml configuration doesn't allow
+    conditional (un)setting of environments, only values.
+    Currently this script treats unset and empty environment
+    variables differently.
+    While this is the case, we unset any empty environment variables.
+    '''
+    toclear = tuple(k for k,v in os.environ.items() if len(v.strip())==0)
+    for var in toclear:
+        print('{0}Clearing empty environment variable {1}{2}'.format(ANSI_CYAN, var, ANSI_RESET))
+        del os.environ[var]
+
+# Default build parallelism
+#
+# Unless PARALLEL_MAKE is set, the number of make jobs is the number of CPUs
+# that cue may use (CPU affinity, cgroup v1/v2 CPU quota), reduced so that
+# every job gets MEMORY_PER_JOB of the available memory (the free memory of
+# the host or the room left by a cgroup memory limit, whichever is smaller).
+
+def read_cgroup_file(fname):
+    try:
+        with open(fname) as f:
+            return f.read().split()
+    except (IOError, OSError):
+        return None
+
+
+# cgroup_v2_dirs(root, proc)
+#
+# Return the directories of this process's cgroup v2 and its parents
+# (innermost first), or [] if there is no cgroup v2 hierarchy
+def cgroup_v2_dirs(root='/sys/fs/cgroup', proc='/proc/self/cgroup'):
+    if not os.path.exists(os.path.join(root, 'cgroup.controllers')):
+        return []
+    rel = ''
+    try:
+        with open(proc) as f:
+            for line in f:
+                if line.startswith('0::'):
+                    rel = line.strip()[3:].strip('/')
+    except (IOError, OSError):
+        pass
+    dirs = []
+    while True:
+        place = os.path.join(root, rel)
+        if os.path.isdir(place):
+            dirs.append(place)
+        if not rel:
+            break
+        rel = os.path.dirname(rel)
+    return dirs
+
+
+# cgroup_cpu_limit(root, proc)
+#
+# Return the CPU quota (number of CPUs, may be fractional) of this process's cgroup, or None
+def cgroup_cpu_limit(root='/sys/fs/cgroup', proc='/proc/self/cgroup'):
+    limits = []
+    for place in cgroup_v2_dirs(root, proc):
+        value = read_cgroup_file(os.path.join(place, 'cpu.max'))
+        if value and value[0] != 'max':
+            limits.append(float(value[0]) / float(value[1]))
+    for controller in ['cpu', 'cpu,cpuacct', 'cpuacct,cpu']:
+        quota = read_cgroup_file(os.path.join(root, controller, 'cpu.cfs_quota_us'))
+        period = read_cgroup_file(os.path.join(root, controller, 'cpu.cfs_period_us'))
+        if quota and period and int(quota[0]) > 0:
+            limits.append(float(quota[0]) / float(period[0]))
+            break
+    return min(limits) if limits else None
+
+
+# available_memory(root, proc, meminfo)
+#
+# Return the memory (bytes) available to this process, or None if unknown
+def available_memory(root='/sys/fs/cgroup', proc='/proc/self/cgroup', meminfo='/proc/meminfo'):
+    available = []
+    try:
+        with open(meminfo) as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available.append(int(line.split()[1]) * 1024)
+    except (IOError, OSError):
+        pass
+    for place in cgroup_v2_dirs(root, proc):
+        limit = read_cgroup_file(os.path.join(place, 'memory.max'))
+        usage = read_cgroup_file(os.path.join(place, 'memory.current'))
+        if limit and limit[0] != 'max':
+            available.append(max(0, int(limit[0]) - int(usage[0] if usage else 0)))
+    limit = read_cgroup_file(os.path.join(root, 'memory', 'memory.limit_in_bytes'))
+    usage = read_cgroup_file(os.path.join(root, 'memory', 'memory.usage_in_bytes'))
+    # cgroup v1 reports a huge number if there is no limit
+    if limit and int(limit[0]) < 2 ** 60:
+        available.append(max(0, int(limit[0]) - int(usage[0] if usage else 0)))
+    return min(available) if available else None
+
+
+# default_parallel_make(memory_per_job)
+#
+# Return the default number of make jobs and the reason for it
+def default_parallel_make(memory_per_job):
+    jobs = cpu_count() or 2
+    reason = '{0} CPUs'.format(jobs)
+    if hasattr(os, 'sched_getaffinity'):
+        usable = len(os.sched_getaffinity(0))
+        if usable < jobs:
+            jobs, reason = usable, '{0} CPUs usable by the process'.format(usable)
+    quota = cgroup_cpu_limit()
+    if quota is not None and int(math.ceil(quota)) < jobs:
+        jobs = max(1, int(math.ceil(quota)))
+        reason = 'cgroup CPU quota of {0:g} CPUs'.format(quota)
+    memory = available_memory()
+    if memory is not None and memory_per_job > 0 and memory // memory_per_job < jobs:
+        jobs = max(1, int(memory // memory_per_job))
+        reason = '{0} of available memory, {1} per job'.format(format_size(memory), format_size(memory_per_job))
+    return jobs, reason
+
+
+# Detect the service and set up context hash accordingly
+def detect_context():
+    global homedir
+
+    buildconfig = 'default'
+    ci['cachedir'] = os.path.join(homedir, '.cache')
+
+    if 'TRAVIS' in os.environ:
+        ci['service'] = 'travis'
+        ci['os'] = os.environ['TRAVIS_OS_NAME']
+        ci['platform'] = 'x64'
+        ci['compiler'] = os.environ['TRAVIS_COMPILER']
+        ci['choco'] += ['strawberryperl']
+        if re.match(r'^vs', ci['compiler']):
+            # Only Visual Studio 2017 available
+            ci['compiler'] = 'vs2017'
+        if 'BCFG' in os.environ:
+            buildconfig = os.environ['BCFG'].lower()
+
+    if 'GITLAB_CI' in os.environ:
+        ci['service'] = 'gitlab'
+        ci['os'] = 'linux'
+        ci['platform'] = 'x64'
+        ci['sudo'] = []                                      # No sudo in GitLab Docker containers
+        ci['cachedir'] = os.path.join(curdir, '.cache')    # No caches outside project directory
+        if 'CMP' in os.environ:
+            ci['compiler'] = os.environ['CMP']
+        if 'BCFG' in os.environ:
+            buildconfig = os.environ['BCFG'].lower()
+
+    if 'APPVEYOR' in os.environ:
+        ci['service'] = 'appveyor'
+        if re.match(r'^Visual', os.environ['APPVEYOR_BUILD_WORKER_IMAGE']):
+            ci['os'] = 'windows'
+        elif re.match(r'^Ubuntu', os.environ['APPVEYOR_BUILD_WORKER_IMAGE']):
+            ci['os'] = 'linux'
+        elif re.match(r'^macOS', os.environ['APPVEYOR_BUILD_WORKER_IMAGE']):
+            ci['os'] = 'osx'
+        ci['platform'] = os.environ['PLATFORM'].lower()
+        if 'CMP' in os.environ:
+            ci['compiler'] = os.environ['CMP']
+        buildconfig = os.environ['CONFIGURATION'].lower()
+
+    if 'GITHUB_ACTIONS' in os.environ:
+        ci['service'] = 'github-actions'
+        if os.environ['RUNNER_OS'] == 'macOS':
+            ci['os'] = 'osx'
+        else:
+            ci['os'] = os.environ['RUNNER_OS'].lower()
+        ci['platform'] = 'x64'
+        if 'CMP' in os.environ:
+            ci['compiler'] = os.environ['CMP']
+        ci['choco'] += ['strawberryperl']
+        if 'BCFG' in os.environ:
+            buildconfig = os.environ['BCFG'].lower()
+
+    if re.search('static', buildconfig):
+        ci['static'] = True
+    if re.search('debug', buildconfig):
+        ci['debug'] = True
+
+    if 'STATIC' in os.environ:
+        print("{0}WARNING: Variable 'STATIC' not supported anymore; use 'BCFG' instead{1}"
+              .format(ANSI_RED, ANSI_RESET))
+        sys.stdout.flush()
+    if not re.match(r'^((default|static|shared|dynamic|optimized|debug)-?)+$', buildconfig):
+        print("{0}WARNING: Unrecognized build configuration setting '{1}'{2}"
+              .format(ANSI_RED, buildconfig, ANSI_RESET))
+        sys.stdout.flush()
+
+    if ci['static']:
+        ci['configuration'] = 'static'
+    else:
+        ci['configuration'] = 'shared'
+    if ci['debug']:
+        ci['configuration'] += '-debug'
+    else:
+        ci['configuration'] += '-optimized'
+
+    ci['scriptsdir'] = os.path.abspath(os.path.dirname(sys.argv[0]))
+
+    if 'CACHEDIR' in os.environ:
+        ci['cachedir'] = os.environ['CACHEDIR']
+
+    if 'CHOCO' in os.environ:
+        if os.environ['CHOCO'] == 'NO':
+            ci['choco'] = []
+        else:
+            ci['choco'].extend(os.environ['CHOCO'].split())
+
+    if 'APT' in os.environ:
+        ci['apt'].extend(os.environ['APT'].split())
+
+    if 'BREW' in os.environ:
+        ci['homebrew'].extend(os.environ['BREW'].split())
+
+    ci['test'] = True
+    if 'TEST' in os.environ and os.environ['TEST'].lower() == 'no':
+        ci['test'] = False
+
+    ci['test_shard'] = None
+    if 'TEST_SHARD' in os.environ:
+        m = re.match(r'^\s*(\d+)\s*/\s*(\d+)\s*$', os.environ['TEST_SHARD'])
+        if not m or not 1 <= int(m.group(1)) <= int(m.group(2)):
+            raise ValueError("Invalid TEST_SHARD='{0}' (expected i/N with 1 <= i <= N)"
+                             .format(os.environ['TEST_SHARD']))
+        ci['test_shard'] = (int(m.group(1)), int(m.group(2)))
+
+    ci['test_durations'] = os.environ.get('TEST_DURATIONS', '')
+
+    ci['test_times'] = False
+    if 'TEST_TIMES' in os.environ and os.environ['TEST_TIMES'].lower() in ['1', 'yes']:
+        ci['test_times'] = True
+    ci['test_timeout_factor'] = float(os.environ.get('TEST_TIMEOUT_FACTOR', '5'))
+
+    if 'PARALLEL_MAKE' in os.environ:
+        ci['parallel_make'] = int(os.environ['PARALLEL_MAKE'])
+        ci['parallel_make_reason'] = 'set by PARALLEL_MAKE'
+    else:
+        ci['parallel_make'], ci['parallel_make_reason'] = \
+            default_parallel_make(parse_size(os.environ.get('MEMORY_PER_JOB', '1G')))
+
+    ci['max_load'] = float(os.environ.get('MAX_LOAD', '0'))
+
+    ci['build_profile'] = os.environ.get('BUILD_PROFILE', '')
+    if ci['build_profile'].lower() in ['1', 'yes']:
+        ci['build_profile'] = 'build-profile'
+    elif ci['build_profile'].lower() in ['0', 'no']:
+        ci['build_profile'] = ''
+    ci['build_profile_top'] = int(os.environ.get('BUILD_PROFILE_TOP', '10'))
+
+    ci['trace_file'] = os.environ.get('TRACE_FILE', '')
+
+    ci['clone_jobs'] = 4
+    if 'CLONE_JOBS' in os.environ:
+        ci['clone_jobs'] = int(os.environ['CLONE_JOBS'])
+
+    ci['mirror_path'] = os.environ.get('MIRROR_PATH', '')
+
+    ci['lockfile'] = os.environ.get('LOCKFILE', '')
+
+    ci['binary_cache'] = os.environ.get('BINARY_CACHE', '')
+
+    ci['cache_max_size'] = None
+    if 'CACHE_MAX_SIZE' in os.environ:
+        ci['cache_max_size'] = parse_size(os.environ['CACHE_MAX_SIZE'])
+
+    ci['compiler_cache'] = os.environ.get('COMPILER_CACHE', '').lower()
+    if ci['compiler_cache'] in ['1', 'yes']:
+        ci['compiler_cache'] = 'ccache'
+    elif ci['compiler_cache'] in ['0', 'no']:
+        ci['compiler_cache'] = ''
+    if ci['compiler_cache'] == 'ccache':
+        ci['apt'].append('ccache')
+        ci['homebrew'].append('ccache')
+
+    ci['shared_objects'] = False
+    if 'SHARED_OBJECTS' in os.environ and os.environ['SHARED_OBJECTS'].lower() in ['1', 'yes']:
+        ci['shared_objects'] = True
+    ci['objects_dir'] = os.environ.get('SHARED_OBJECTS_DIR', '') or os.path.join(ci['cachedir'], 'git-objects')
+
+    ci['clean_deps'] = True
+    ci['compact_deps'] = False
+    if 'CLEAN_DEPS' in os.environ and os.environ['CLEAN_DEPS'].lower() == 'no':
+        ci['clean_deps'] = False
+    if 'CLEAN_DEPS' in os.environ and os.environ['CLEAN_DEPS'].lower() == 'compact':
+        ci['clean_deps'] = False
+        ci['compact_deps'] = True
+
+    ci['strip_deps'] = False
+    if 'STRIP_DEPS' in os.environ and os.environ['STRIP_DEPS'].lower() in ['1', 'yes']:
+        ci['strip_deps'] = True
+
+    logger.debug('Detected a build hosted on %s, using %s on %s (%s) configured as %s '
+                 + '(test: %s, clean_deps: %s)',
+                 ci['service'], ci['compiler'], ci['os'], ci['platform'], ci['configuration'],
+                 ci['test'], ci['clean_deps'])
+
+
+curdir = os.getcwd()
+
+ci = {}
+# setup files read (in include order)
+seen_setups = collections.OrderedDict()
+locked = {}
+modules_to_compile = []
+modules_restored = []
+fresh_checkouts = set()
+setup = {}
+places = {}
+extra_makeargs = []
+make_timeout = 0.
+idle_timeout = 0.
+jobserver = None
+trace_events = []
+trace_tracks = {}
+open_folds = {}
+
+is_base314 = False
+is_make3 = False
+has_test_results = False
+silent_dep_builds = True
+skip_dep_builds = False
+installed_7z = False
+
+
+def clear_lists():
+    global is_base314, has_test_results, silent_dep_builds, is_make3
+    global _modified_files, building_base, jobserver
+    seen_setups.clear()
+    del modules_to_compile[:]
+    del modules_restored[:]
+    fresh_checkouts.clear()
+    locked.clear()
+    del trace_events[:]
+    trace_tracks.clear()
+    open_folds.clear()
+    del extra_makeargs[:]
+    setup.clear()
+    places.clear()
+    is_base314 = False
+    is_make3 = False
+    has_test_results = False
+    silent_dep_builds = True
+    building_base = False
+    _modified_files = set()
+    if jobserver:
+        jobserver.close()
+    jobserver = None
+    ci['service'] = '<none>'
+    ci['os'] = '<unknown>'
+    ci['platform'] = '<unknown>'
+    ci['compiler'] = '<unknown>'
+    ci['static'] = False
+    ci['debug'] = False
+    ci['configuration'] = '<unknown>'
+    ci['scriptsdir'] = ''
+    ci['cachedir'] = ''
+    ci['choco'] = ['make']
+    ci['apt'] = []
+    ci['homebrew'] = []
+    ci['sudo'] = ['sudo']
+
+
+def detect_self_build():
+    global building_base, skip_dep_builds
+    if 'BASE' in os.environ and os.environ['BASE'] == 'SELF':
+        building_base = True
+        skip_dep_builds = True
+        places['EPICS_BASE'] = curdir
+
+
+clear_lists()
+detect_self_build()
+
+
+# Sessions
+#
+# All state of a cue run (configuration, setup, dependencies, build status)
+# lives in the module globals listed in session_vars. A Session holds one set
+# of that state, together with the environment and working directory of the run
+# (cue modifies the environment, and the builds use both).
+# Entering a session ('with session:') saves the state of the active session
+# and installs its own; a new session starts with fresh state.
+# Sessions let several configurations be prepared one after the other in one
+# process. Only one thread can use sessions at a time (entering a session in
+# another thread while one is active raises RuntimeError): the state,
+# the environment and the working directory are per process, so configurations
+# that run concurrently need separate processes (see 'cue.py matrix').
+session_vars = ['ci', 'seen_setups', 'locked', 'modules_to_compile', 'modules_restored', 'fresh_checkouts',
+                'setup', 'places', 'extra_makeargs', 'make_timeout', 'idle_timeout', 'jobserver',
+                'trace_events', 'trace_tracks', 'open_folds', 'is_base314', 'is_make3', 'has_test_results',
+                'silent_dep_builds', 'skip_dep_builds', 'installed_7z', 'building_base', '_modified_files',
+                'curdir']
+
+
+class Session(object):
+    def __init__(self, environ=None, cwd=None):
+        self.state = None
+        self.environ = dict(os.environ if environ is None else environ)
+        self.cwd = os.path.abspath(cwd or os.getcwd())
+        self.previous = []
+    def __enter__(self):
+        global session_thread
+        if session_thread not in (None, threading.current_thread()):
+            raise RuntimeError('{0}A cue session is active in another thread; '
+                               'use separate processes for concurrent configurations{1}'
+                               .format(ANSI_RED, ANSI_RESET))
+        self.previous.append((current_session, session_thread))
+        session_thread = threading.current_thread()
+        activate_session(self)
+        return self
+    def __exit__(self, A, B, C):
+        global session_thread
+        (previous, session_thread) = self.previous.pop()
+        activate_session(previous)
+    def run(self, raw):
+        '''Run cue.py with the command line arguments raw in this session'''
+        with self:
+            main(raw)
+
+
+def new_session_state():
+    global jobserver, curdir, make_timeout, idle_timeout, skip_dep_builds, installed_7z
+    g = globals()
+    for name in session_vars:
+        if isinstance(g[name], (dict, list, set)):
+            g[name] = type(g[name])()
+    # the jobserver belongs to the previous session
+    jobserver = None
+    curdir = os.getcwd()
+    make_timeout = idle_timeout = 0.
+    skip_dep_builds = installed_7z = False
+    clear_lists()
+    detect_self_build()
+
+
+def activate_session(session):
+    global current_session
+    if session is current_session:
+        return
+    g = globals()
+    current_session.state = dict((name, g[name]) for name in session_vars)
+    current_session.environ = dict(os.environ)
+    current_session.cwd = os.getcwd()
+    current_session = session
+    os.environ.clear()
+    os.environ.update(session.environ)
+    os.chdir(session.cwd)
+    if session.state is None:
+        new_session_state()
+    else:
+        g.update(session.state)
+
+
+# the state set up on import
+current_session = Session()
+# the thread that entered the active session (None outside of sessions)
+session_thread = None
+
+# Setup ANSI Colors
+ANSI_RED = "\033[31;1m"
+ANSI_GREEN = "\033[32;1m"
+ANSI_YELLOW = "\033[33;1m"
+ANSI_BLUE = "\033[34;1m"
+ANSI_MAGENTA = "\033[35;1m"
+ANSI_CYAN = "\033[36;1m"
+ANSI_RESET = "\033[0m"
+ANSI_CLEAR = "\033[0K"
+
+
+# Travis log fold control
+# from https://github.com/travis-ci/travis-rubies/blob/build/build.sh
+# GitHub Actions fold control
+# from https://github.com/actions/toolkit/blob/master/docs/commands.md#group-and-ungroup-log-lines
+
+def fold_start(tag, title):
+    open_folds[tag] = time.time()
+    if ci['service'] == 'travis':
+        print('travis_fold:start:{0}{1}{2}{3}'
+              .format(tag, ANSI_YELLOW, title, ANSI_RESET))
+    elif ci['service'] == 'github-actions':
+        print('::group::{0}{1}{2}'
+              .format(ANSI_YELLOW, title, ANSI_RESET))
+    elif ci['service'] == 'appveyor':
+        print('{0}===== \\/ \\/ \\/ ===== START: {1} ====={2}'
+              .format(ANSI_YELLOW, title, ANSI_RESET))
+    sys.stdout.flush()
+
+
+def fold_end(tag, title):
+    if tag in open_folds:
+        trace_event(title, 'fold', open_folds.pop(tag))
+    if ci['service'] == 'travis':
+        print('\ntravis_fold:end:{0}\r'
+              .format(tag), end='')
+    elif ci['service'] == 'github-actions':
+        print('::endgroup::'
+              .format(ANSI_YELLOW, title, ANSI_RESET))
+    elif ci['service'] == 'appveyor':
+        print('{0}----- /\\ /\\ /\\ -----   END: {1} -----{2}'
+              .format(ANSI_YELLOW, title, ANSI_RESET))
+    sys.stdout.flush()
+
+class Folded(object):
+    def __init__(self, tag, title):
+        self.tag, self.title = tag, title
+    def __enter__(self):
+        fold_start(self.tag, self.title)
+    def __exit__(self,A,B,C):
+        fold_end(self.tag, self.title)
+
+
+# Trace events
+#
+# With TRACE_FILE set, the folds, the child processes (git, make, ...) and the
+# checkouts and builds of the dependencies are recorded as trace events
+# and written to TRACE_FILE in the Chrome trace event format, to be opened
+# in a trace viewer (chrome://tracing, https://ui.perfetto.dev).
+# The events of all cue.py runs (prepare, build, test, ...) that use the same
+# TRACE_FILE are collected in that file, one process per run.
+# The configurations of cue.py matrix write their own trace files, which are
+# merged into TRACE_FILE when the matrix is done.
+trace_lock = threading.Lock()
+
+
+# trace_track(name)
+#
+# Return the trace thread id for the track name (default: the current thread)
+def trace_track(name=None):
+    if name is None:
+        name = threading.current_thread().name
+    with trace_lock:
+        if name not in trace_tracks:
+            trace_tracks[name] = len(trace_tracks) + 1
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                                 'tid': trace_tracks[name], 'args': {'name': name}})
+        return trace_tracks[name]
+
+
+# trace_event(name, cat, start, end=None, track=None, **args)
+#
+# Record an event that lasted from start to end (default: now) on a track
+def trace_event(name, cat, start, end=None, track=None, **args):
+    if not ci.get('trace_file'):
+        return
+    if end is None:
+        end = time.time()
+    event = {'name': name, 'cat': cat, 'ph': 'X', 'pid': os.getpid(), 'tid': trace_track(track),
+             'ts': int(start * 1e6), 'dur': int((end - start) * 1e6)}
+    if args:
+        event['args'] = args
+    with trace_lock:
+        trace_events.append(event)
+
+
+class Traced(object):
+    '''Record a trace event for the duration of a with block'''
+    def __init__(self, name, cat, track=None, **args):
+        self.name, self.cat, self.track, self.args = name, cat, track, args
+    def __enter__(self):
+        self.start = time.time()
+    def __exit__(self, A, B, C):
+        trace_event(self.name, self.cat, self.start, track=self.track, **self.args)
+
+
+def process_event_name(cmd):
+    return ' '.join([os.path.basename(cmd[0])] + [arg for arg in cmd[1:] if not arg.startswith('-')][:1])
+
+
+def read_trace(filename):
+    if not os.path.exists(filename):
+        return []
+    try:
+        with open(filename) as f:
+            return json.load(f)['traceEvents']
+    except (ValueError, KeyError):
+        print('{0}WARNING: Ignoring unreadable trace file {1}{2}'
+              .format(ANSI_RED, filename, ANSI_RESET))
+        return []
+
+
+def write_trace(title):
+    if not ci.get('trace_file') or not trace_events:
+        return
+    events = read_trace(ci['trace_file'])
+    events.append({'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'args': {'name': title}})
+    events.extend(trace_events)
+    with open(ci['trace_file'], 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    del trace_events[:]
+    trace_tracks.clear()
+
+
+# merge_trace(filename)
+#
+# Add the events of the trace file filename (written by another process) to TRACE_FILE,
+# then remove filename
+def merge_trace(filename):
+    if not ci.get('trace_file') or not os.path.exists(filename):
+        return
+    events = read_trace(ci['trace_file']) + read_trace(filename)
+    with open(ci['trace_file'], 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    os.remove(filename)
+
+homedir = curdir
+if 'HomeDrive' in os.environ:
+    homedir = os.path.join(os.getenv('HomeDrive'), os.getenv('HomePath'))
+elif 'HOME' in os.environ:
+    homedir = os.getenv('HOME')
+toolsdir = os.path.join(homedir, '.tools')
+
+
+vcvars_table = {
+    # https://en.wikipedia.org/wiki/Microsoft_Visual_Studio#History
+    'vs2022': [r'C:\Program Files\Microsoft Visual Studio\2022\Community\VC\Auxiliary\Build\vcvarsall.bat',
+               r'C:\Program Files\Microsoft Visual Studio\2022\Enterprise\VC\Auxiliary\Build\vcvarsall.bat'],
+    'vs2019': [r'C:\Program Files (x86)\Microsoft Visual Studio\2019\Community\VC\Auxiliary\Build\vcvarsall.bat',
+               r'C:\Program Files (x86)\Microsoft Visual Studio\2019\Enterprise\VC\Auxiliary\Build\vcvarsall.bat'],
+    'vs2017': [r'C:\Program Files (x86)\Microsoft Visual Studio\2017\Community\VC\Auxiliary\Build\vcvarsall.bat',
+               r'C:\Program Files (x86)\Microsoft Visual Studio\2017\Enterprise\VC\Auxiliary\Build\vcvarsall.bat',
+               r'C:\Program Files (x86)\Microsoft Visual Studio\2017\BuildTools\VC\Auxiliary\Build\vcvarsall.bat'],
+    'vs2015': [r'C:\Program Files (x86)\Microsoft Visual Studio 14.0\VC\vcvarsall.bat'],
+    'vs2013': [r'C:\Program Files (x86)\Microsoft Visual Studio 12.0\VC\vcvarsall.bat'],
+    'vs2012': [r'C:\Program Files (x86)\Microsoft Visual Studio 11.0\VC\vcvarsall.bat'],
+    'vs2010': [r'C:\Program Files (x86)\Microsoft Visual Studio 10.0\VC\vcvarsall.bat'],
+    'vs2008': [r'C:\Program Files (x86)\Microsoft Visual Studio 9.0\VC\vcvarsall.bat'],
+}
+
+vcvars_found = None
+
+
+# find_vcvars()
+#
+# Return the Visual Studio versions found on the runner as dict
+# version -> vcvarsall.bat (looking for them on first use)
+def find_vcvars():
+    global vcvars_found
+    if vcvars_found is None:
+        vcvars_found = {}
+        for key in vcvars_table:
+            for dir in vcvars_table[key]:
+                if os.path.exists(dir):
+                    vcvars_found[key] = dir
+    return vcvars_found
+
+
+def modlist():
+    if building_base:
+        ret = []
+    else:
+        for var in ['ADD_MODULES', 'MODULES']:
+            setup.setdefault(var, '')
+            if var in os.environ:
+                setup[var] = os.environ[var]
+                logger.debug('ENV assignment: %s = %s', var, setup[var])
+        ret = ['BASE'] + setup['ADD_MODULES'].upper().split() + setup['MODULES'].upper().split()
+    return ret
+
+
+def host_info():
+    print('{0}Build using {1} compiler on {2} ({3}) hosted by {4}{5}'
+          .format(ANSI_CYAN, ci['compiler'], ci['os'], ci['platform'], ci['service'], ANSI_RESET))
+
+    print('{0}Python setup{1}'.format(ANSI_CYAN, ANSI_RESET))
+    print(sys.version)
+    print('PYTHONPATH')
+    for dname in sys.path:
+        print(' ', dname)
+    print('platform =', sysconfig.get_platform())
+
+    print('{0}Build parallelism{1}'.format(ANSI_CYAN, ANSI_RESET))
+    print('{0} make jobs ({1})'.format(ci['parallel_make'], ci['parallel_make_reason']))
+    if ci['max_load']:
+        print('no new make jobs while the load average is above {0:g}'.format(ci['max_load']))
+
+    if ci['os'] == 'windows':
+        print('{0}Available Visual Studio versions{1}'.format(ANSI_CYAN, ANSI_RESET))
+        for comp in find_vcvars():
+            print(comp, 'in', vcvars_found[comp])
+
+    sys.stdout.flush()
+
+
+# Error-handler to make shutil.rmtree delete read-only files on Windows
+def remove_readonly(func, path, excinfo):
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
+
+
+# source_set(setup)
+#
+# Source a settings file (extension .set) found in the setup_dirs path
+# May be called recursively (from within a setup file)
+def source_set(name):
+    # allowed separators: colon or whitespace
+    setup_dirs = os.getenv('SETUP_PATH', "").replace(':', ' ').split()
+    if len(setup_dirs) == 0:
+        raise NameError("{0}Search path for setup files (SETUP_PATH) is empty{1}".format(ANSI_RED, ANSI_RESET))
+
+    for set_dir in setup_dirs:
+        set_file = os.path.join(set_dir, name) + ".set"
+
+        if set_file in seen_setups:
+            print("Ignoring already included setup file {0}".format(set_file))
+            return
+
+        if os.path.isfile(set_file):
+            seen_setups[set_file] = True
+            print("Opening setup file {0}".format(set_file))
+            sys.stdout.flush()
+            with open(set_file) as fp:
+                for line in fp:
+                    if not line.strip() or line.strip()[0] == '#':
+                        continue
+                    if line.startswith("include"):
+                        logger.debug('%s: Found include directive, reading %s next',
+                                     set_file, line.split()[1])
+                        source_set(line.split()[1])
+                        continue
+                    assign = line.replace('"', '').strip().split("=", 1)
+                    setup.setdefault(assign[0], os.getenv(assign[0], ""))
+                    if not setup[assign[0]].strip():
+                        logger.debug('%s: setup[%s] = %s', set_file, assign[0], assign[1])
+                        setup[assign[0]] = assign[1]
+            logger.debug('Done with setup file %s', set_file)
+            break
+    else:
+        raise NameError("{0}Setup file {1}.set does not exist in SETUP_PATH search path ({2}){3}"
+                        .format(ANSI_RED, name, setup_dirs, ANSI_RESET))
+
+
+# update_release_local(var, location)
+#   var       name of the variable to set in RELEASE.local
+#   location  location (absolute path) of where variable should point to
+#
+# Manipulate RELEASE.local in the cache location:
+# - replace "$var=$location" line if it exists and has changed
+# - otherwise add "$var=$location" line and possibly move EPICS_BASE=... line to the end
+# Set places[var] = location
+def update_release_local(var, location):
+    release_local = os.path.join(ci['cachedir'], 'RELEASE.local')
+    updated_line = '{0}={1}'.format(var, location.replace('\\', '/'))
+    places[var] = location
+
+    if not os.path.exists(release_local):
+        logger.debug('RELEASE.local does not exist, creating it')
+        try:
+            os.makedirs(ci['cachedir'])
+        except:
+            pass
+        touch = open(release_local, 'w')
+        touch.close()
+    base_line = ''
+    found = False
+    logger.debug("Opening RELEASE.local for adding '%s'", updated_line)
+    for line in fileinput.input(release_local, inplace=1):
+        output_line = line.strip()
+        if 'EPICS_BASE=' in line:
+            base_line = line.strip()
+            logger.debug("Found EPICS_BASE line '%s', not writing it", base_line)
+            continue
+        elif '{0}='.format(var) in line:
+            logger.debug("Found '%s=' line, replacing", var)
+            found = True
+            output_line = updated_line
+        logger.debug("Writing line to RELEASE.local: '%s'", output_line)
+        print(output_line)
+    fileinput.close()
+    release_local = open(release_local, "a")
+    if not found:
+        logger.debug("Adding new definition: '%s'", updated_line)
+        print(updated_line, file=release_local)
+    if base_line:
+        logger.debug("Writing EPICS_BASE line: '%s'", base_line)
+        print(base_line, file=release_local)
+    release_local.close()
+
+
+# settings of a dependency that can be overridden from the environment
+dependency_postfixes = ['', '_DIRNAME', '_REPONAME', '_REPOOWNER', '_REPOURL',
+                        '_VARNAME', '_RECURSIVE', '_DEPTH', '_HOOK', '_UPDATE',
+                        '_FILTER', '_SINGLE_BRANCH', '_SPARSE', '_SUBMODULE_JOBS', '_SUBMODULE_DEPTH']
+
+
+def set_setup_from_env(dep):
+    for postf in dependency_postfixes:
+        env = dep + postf
+        val = os.environ.get(env)
+        if val:
+            setup[env] = val
+            logger.debug('ENV assignment: %s = %s', env, setup[env])
+
+
+# Per-thread output buffering
+#
+# Worker threads (e.g. the parallel dependency checkout) set _thread_output.buffer
+# to a list that collects everything they print, including the output of child
+# processes started through call_child(). The collected output of each job
+# is printed en bloc when the job is done, so that the logs stay readable.
+_thread_output = threading.local()
+
+
+class ThreadOutput(object):
+    '''Replacement for sys.stdout that diverts output of buffering threads'''
+    def __init__(self, stream):
+        self.stream = stream
+    def write(self, data):
+        buf = getattr(_thread_output, 'buffer', None)
+        if buf is None:
+            self.stream.write(data)
+        else:
+            buf.append(data)
+    def flush(self):
+        if getattr(_thread_output, 'buffer', None) is None:
+            self.stream.flush()
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def call_child(cmd, **kws):
+    '''subprocess.call() that honors per-thread output buffering'''
+    buf = getattr(_thread_output, 'buffer', None)
+    with Traced(process_event_name(cmd), 'process', cmd=' '.join(cmd), cwd=kws.get('cwd', os.getcwd())):
+        if buf is None:
+            return sp.call(cmd, **kws)
+        kws.setdefault('stdout', sp.PIPE)
+        kws.setdefault('stderr', sp.STDOUT)
+        child = sp.Popen(cmd, **kws)
+        output = child.communicate()[0]
+    if output:
+        buf.append(output.decode('utf-8', 'replace'))
+    return child.returncode
+
+
+def check_call_child(cmd, **kws):
+    '''subprocess.check_call() that honors per-thread output buffering'''
+    exitcode = call_child(cmd, **kws)
+    if exitcode:
+        raise sp.CalledProcessError(exitcode, cmd)
+
+
+def call_git(args, **kws):
+    if 'cwd' in kws:
+        place = kws['cwd']
+    else:
+        place = os.getcwd()
+    logger.debug("EXEC '%s' in %s", ' '.join(['git'] + args), place)
+    sys.stdout.flush()
+    exitcode = call_child(['git'] + args, **kws)
+    logger.debug('EXEC DONE')
+    return exitcode
+
+
+# GNU make jobserver
+#
+# On POSIX systems, cue runs one jobserver with ci['parallel_make'] job slots
+# and hands it to every make it starts (instead of -jN), so that the total number
+# of jobs stays within that limit, no matter how many makes run side by side.
+# For every make it starts, cue takes one slot from the jobserver (covering
+# that make's implicit job slot) and returns it when the make is done.
+class JobServer(object):
+    def __init__(self, slots, nonblocking=True):
+        self.slots = slots
+        # tokens taken by acquire() and not released yet
+        self.held = 0
+        self.read_fd, self.write_fd = os.pipe()
+        if nonblocking and fcntl:
+            # a client make may take the token between select() and read()
+            # (make 3.81 fails on a non-blocking jobserver pipe)
+            flags = fcntl.fcntl(self.read_fd, fcntl.F_GETFL)
+            fcntl.fcntl(self.read_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        os.write(self.write_fd, b'+' * slots)
+    def take(self):
+        '''Read a token if there is one; return True if one was read'''
+        try:
+            return len(os.read(self.read_fd, 1)) == 1
+        except OSError as e:
+            if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                return False
+            raise
+    def acquire(self, block=True):
+        while True:
+            if not select.select([self.read_fd], [], [], None if block else 0)[0]:
+                return False
+            if self.take():
+                self.held += 1
+                return True
+            if not block:
+                return False
+    def release(self):
+        self.held -= 1
+        os.write(self.write_fd, b'+')
+    def refill(self):
+        '''Restore the tokens that killed clients did not return (no client may be running)'''
+        free = 0
+        while select.select([self.read_fd], [], [], 0)[0] and self.take():
+            free += 1
+        if free != self.slots - self.held:
+            logger.debug('Jobserver had %d free job slots, expected %d', free, self.slots - self.held)
+        os.write(self.write_fd, b'+' * (self.slots - self.held))
+    def client_kws(self, kws):
+        '''Add the settings that make a child make use this jobserver to the Popen() arguments'''
+        env = dict(kws.get('env') or os.environ)
+        env['MAKEFLAGS'] = '{0} -j --jobserver-fds={1},{2}'.format(env.get('MAKEFLAGS', ''),
+                                                                  self.read_fd, self.write_fd).strip()
+        kws['env'] = env
+        if sys.version_info[0] >= 3:
+            kws['pass_fds'] = (self.read_fd, self.write_fd)
+        else:
+            kws['close_fds'] = False
+        return kws
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+def get_jobserver():
+    global jobserver
+    # no parallel make for Base 3.14
+    if jobserver is None and os.name == 'posix' and not is_base314 and ci['parallel_make'] > 0:
+        logger.debug('Creating jobserver with %d job slots', ci['parallel_make'])
+        jobserver = JobServer(ci['parallel_make'], nonblocking=not is_make3)
+    return jobserver
+
+
+def make_options(parallel, silent=False, use_extra=False, jobserver=False, profile=False):
+    # no parallel make for Base 3.14
+    if parallel <= 0 or is_base314:
+        makeargs = []
+    else:
+        if jobserver:
+            makeargs = []
+        else:
+            makeargs = ['-j{0}'.format(parallel)]
+        # output sync would delay the directory messages the profile needs
+        if not is_make3 and not profile:
+            makeargs += ['-Otarget']
+    if parallel > 0 and not is_base314 and ci.get('max_load'):
+        makeargs += ['-l{0:g}'.format(ci['max_load'])]
+    if silent:
+        makeargs += ['-s']
+    # the directory messages are the output the idle watchdog sees from silent builds
+    if profile or (silent and idle_timeout):
+        makeargs += ['-w']
+    if use_extra:
+        makeargs += extra_makeargs
+    return makeargs
+
+
+# Build timing profile
+#
+# With BUILD_PROFILE set, the builds of the dependencies and of the main module
+# run make with -w, and the time stamped Entering/Leaving directory messages
+# give the wall time of every (sub-)make. The profile of each build is written
+# as JSON file <name>.json into the BUILD_PROFILE directory, and the directories
+# (the EPICS O.<arch> build directories, mostly) that took longest are shown.
+class MakeProfile(object):
+    line_re = re.compile(r"^\S*?make(?:\.exe)?(?:\[(\d+)\])?: (Entering|Leaving) directory [`'](.*)'\s*$")
+
+    def __init__(self, name, top):
+        self.name, self.top = name, os.path.abspath(top)
+        self.started = time.time()
+        self.finished = None
+        self.open = {}
+        self.dirs = {}
+    def feed(self, line, now=None):
+        if now is None:
+            now = time.time()
+        m = self.line_re.match(line)
+        if not m:
+            return
+        key = (m.group(1) or '0', m.group(3))
+        if m.group(2) == 'Entering':
+            self.open.setdefault(key, []).append(now)
+        elif self.open.get(key):
+            entry = self.dirs.setdefault(m.group(3), [0., 0])
+            entry[0] += now - self.open[key].pop()
+            entry[1] += 1
+    def result(self):
+        if self.finished is None:
+            self.finished = time.time()
+        directories = []
+        for path, (seconds, runs) in self.dirs.items():
+            rel = os.path.relpath(path, self.top).replace('\\', '/')
+            leaf = not any(other.startswith(path.rstrip('/\\') + os.sep) for other in self.dirs)
+            directories.append({'directory': rel, 'seconds': round(seconds, 3), 'runs': runs, 'leaf': leaf})
+        directories.sort(key=lambda d: (-d['seconds'], d['directory']))
+        # the sub-makes in O.<arch> directories build one target architecture (T_A)
+        targets = {}
+        for d in directories:
+            m = re.search(r'(?:^|/)O\.([^/]+)$', d['directory'])
+            if m and m.group(1) != 'Common':
+                targets[m.group(1)] = round(targets.get(m.group(1), 0.) + d['seconds'], 3)
+        return {'name': self.name, 'top': self.top,
+                'seconds': round(self.finished - self.started, 3),
+                'directories': directories, 'targets': targets}
+    def report(self):
+        result = self.result()
+        if not os.path.isdir(ci['build_profile']):
+            os.makedirs(ci['build_profile'])
+        fname = os.path.join(ci['build_profile'], self.name + '.json')
+        with open(fname, 'w') as f:
+            json.dump(result, f, indent=1, sort_keys=True)
+        print('{0}Build profile of {1}: {2:.1f} s total (written to {3}){4}'
+              .format(ANSI_CYAN, self.name, result['seconds'], fname, ANSI_RESET))
+        top = [d for d in result['directories'] if d['leaf']][:ci['build_profile_top']]
+        for d in top:
+            print('{0:10.1f} s  {1}'.format(d['seconds'], d['directory']))
+        sys.stdout.flush()
+        return result
+
+
+# copy_make_output(pipe, write, profile=None, watchdog=None)
+#
+# Pass the output of a make (until EOF) through write(), feeding every line
+# to profile and reporting it to watchdog
+def copy_make_output(pipe, write, profile=None, watchdog=None):
+    for line in iter(pipe.readline, b''):
+        if profile:
+            profile.feed(line.decode('utf-8', 'replace'))
+        if watchdog:
+            watchdog.touch()
+        write(line)
+    pipe.close()
+
+
+# kill_process_tree(child, force=False)
+#
+# Stop child and all its children. On POSIX systems, the children are only
+# reached if child was started in its own process group (preexec_fn=os.setsid).
+def kill_process_tree(child, force=False):
+    if os.name == 'posix':
+        try:
+            os.killpg(child.pid, signal.SIGKILL if force else signal.SIGTERM)
+        except OSError:
+            # not a process group leader
+            try:
+                if force:
+                    child.kill()
+                else:
+                    child.terminate()
+            except OSError:
+                pass
+    else:
+        sp.call(['taskkill', '/F', '/T', '/PID', str(child.pid)])
+
+
+# dump_process_tree(pid)
+#
+# Print the processes started by pid and the other members of its
+# process group (POSIX only)
+def dump_process_tree(pid):
+    if os.name != 'posix':
+        return
+    try:
+        output = sp.check_output(['ps', '-A', '-o', 'pid=,ppid=,pgid=,etime=,args=']).decode('utf-8', 'replace')
+    except (OSError, sp.CalledProcessError):
+        return
+    procs = {}
+    children = {}
+    for line in output.splitlines():
+        fields = line.split(None, 4)
+        if len(fields) < 4:
+            continue
+        procs[int(fields[0])] = (int(fields[2]), fields[3], fields[4] if len(fields) > 4 else '')
+        children.setdefault(int(fields[1]), []).append(int(fields[0]))
+    shown = set()
+    def show(proc, depth):
+        shown.add(proc)
+        print('{0:>7} {1:>11}  {2}{3}'.format(proc, procs[proc][1], '  ' * depth, procs[proc][2]))
+        for child in sorted(children.get(proc, [])):
+            if child in procs and child not in shown:
+                show(child, depth + 1)
+    print('{0}Processes still running:{1}'.format(ANSI_RED, ANSI_RESET))
+    print('{0:>7} {1:>11}  {2}'.format('PID', 'ELAPSED', 'COMMAND'))
+    if pid in procs:
+        show(pid, 0)
+    # children left behind by processes that have already exited
+    for proc in sorted(procs):
+        if procs[proc][0] == pid and proc not in shown:
+            show(proc, 0)
+    sys.stdout.flush()
+
+
+# Output inactivity watchdog (--idle-timeout)
+#
+# A make (build, test, dependency build) or test run that does not produce
+# any output for idle_timeout seconds is stopped: the processes that are still
+# running are shown, then the whole process group is terminated (and killed
+# if it is still there after kill_delay seconds).
+# The watchdog is told about output through touch(), or checks the sizes of
+# the files the output goes to (open files or file names).
+# Children stopped for other reasons (timeouts) are stopped through stop(),
+# so that check() kills them as well if they do not go away.
+kill_delay = 10.
+
+
+# Watchdogs of the running children, which get the SIGINT/SIGTERM that cue.py receives
+# (children in their own process group do not see the signals sent to the group of cue.py)
+watchdogs = set()
+forwarded_signals = {}
+
+
+class OutputWatchdog(object):
+    def __init__(self, child, what, outputs=[]):
+        self.child, self.what, self.outputs = child, what, outputs
+        for other in list(watchdogs):
+            if other.child.returncode is not None:
+                watchdogs.discard(other)
+        watchdogs.add(self)
+        self.last_output = time.time()
+        self.size = 0
+        self.fired = None
+        self.killed = False
+    def touch(self):
+        self.last_output = time.time()
+    def output_size(self):
+        size = 0
+        for output in self.outputs:
+            if hasattr(output, 'fileno'):
+                size += os.fstat(output.fileno()).st_size
+            elif os.path.exists(output):
+                size += os.path.getsize(output)
+        return size
+    def stop(self):
+        '''Terminate the child and its children (killed by later check() calls if needed)'''
+        self.fired = time.time()
+        kill_process_tree(self.child)
+    def check(self):
+        '''Stop the child if it is idle for too long; return True if it was stopped'''
+        now = time.time()
+        if self.fired is not None:
+            if now - self.fired > kill_delay and not self.killed:
+                self.killed = True
+                print('{0}{1} still running {2:.0f} seconds after being stopped, killing it{3}'
+                      .format(ANSI_RED, self.what, now - self.fired, ANSI_RESET))
+                sys.stdout.flush()
+                kill_process_tree(self.child, force=True)
+            return True
+        if not idle_timeout:
+            return False
+        size = self.output_size()
+        if size != self.size:
+            self.size = size
+            self.last_output = now
+        if now - self.last_output <= idle_timeout:
+            return False
+        self.fired = now
+        print('{0}No output from {1} for {2:.0f} seconds, stopping it{3}'
+              .format(ANSI_RED, self.what, now - self.last_output, ANSI_RESET))
+        dump_process_tree(self.child.pid)
+        self.stop()
+        return True
+
+
+# forward_signal(signum, frame)
+#
+# Signal handler: send the signal to the process groups of the watched children,
+# then handle it as before
+def forward_signal(signum, frame):
+    for watchdog in list(watchdogs):
+        if watchdog.child.returncode is None and os.name == 'posix':
+            try:
+                os.killpg(watchdog.child.pid, signum)
+            except OSError:
+                # not a process group leader
+                pass
+    previous = forwarded_signals.get(signum)
+    if callable(previous):
+        previous(signum, frame)
+    elif previous == signal.SIG_DFL:
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+
+# forward_signals()
+#
+# Install forward_signal() as handler of SIGINT and SIGTERM
+def forward_signals():
+    if os.name != 'posix':
+        return
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        previous = signal.getsignal(signum)
+        if previous in [signal.SIG_IGN, None] or previous == forward_signal:
+            continue
+        try:
+            signal.signal(signum, forward_signal)
+        except ValueError:
+            # not in the main thread
+            return
+        forwarded_signals[signum] = previous
+
+
+# child_kws(kws)
+#
+# Add the Popen() arguments for children that the watchdog may have to stop
+def child_kws(kws):
+    if idle_timeout and os.name == 'posix':
+        # own process group, so that the child can be stopped with all its children
+        kws['preexec_fn'] = os.setsid
+    return kws
+
+
+def write_stdout(data):
+    sys.stdout.write(data.decode('utf-8', 'replace'))
+    sys.stdout.flush()
+
+
+def call_make(args=None, **kws):
+    global make_timeout
+    if args is None:
+        args = []
+    place = kws.get('cwd', os.getcwd())
+    parallel = kws.pop('parallel', ci['parallel_make'])
+    silent = kws.pop('silent', False)
+    use_extra = kws.pop('use_extra', False)
+    profile = kws.pop('profile', None)
+    if not ci.get('build_profile'):
+        profile = None
+    js = None
+    if parallel > 0:
+        js = get_jobserver()
+    makeargs = make_options(parallel, silent, use_extra, jobserver=js is not None, profile=bool(profile))
+    logger.debug("EXEC '%s' in %s", ' '.join(['make'] + makeargs + args), place)
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    if js:
+        js.acquire()
+        js.client_kws(kws)
+    make_profile = None
+    if profile:
+        make_profile = MakeProfile(profile, place)
+    if profile or idle_timeout:
+        kws['stdout'] = sp.PIPE
+        kws['stderr'] = sp.STDOUT
+    child_kws(kws)
+    started = time.time()
+    child = sp.Popen(['make'] + makeargs + args, **kws)
+    if make_timeout:
+        def expire(child):
+            logger.error('Timeout')
+            if 'preexec_fn' in kws:
+                kill_process_tree(child)
+            else:
+                child.terminate()
+        timer = threading.Timer(make_timeout, expire, args=(child,))
+        timer.start()
+
+    if profile or idle_timeout:
+        watchdog = OutputWatchdog(child, 'make in {0}'.format(place))
+        reader = threading.Thread(target=copy_make_output,
+                                  args=(child.stdout, write_stdout, make_profile, watchdog))
+        reader.daemon = True
+        reader.start()
+        # children left behind may keep the output open after make is done
+        while child.poll() is None or reader.is_alive():
+            reader.join(0.2)
+            watchdog.check()
+    exitcode = child.wait()
+    trace_event(process_event_name(['make'] + args), 'process', started,
+                cmd=' '.join(['make'] + makeargs + args), cwd=place, exitcode=exitcode)
+    if make_timeout:
+        timer.cancel()
+    if js:
+        js.release()
+        if exitcode != 0:
+            # a killed make does not return the job slots it took
+            js.refill()
+    logger.debug('EXEC DONE')
+    if profile:
+        make_profile.report()
+    if exitcode != 0:
+        sys.exit(exitcode)
+
+
+def apply_patch(file, **kws):
+    place = kws.get('cwd', os.getcwd())
+    print('Applying patch {0} in {1}'.format(file, place))
+    logger.debug("EXEC '%s' in %s", ' '.join(['patch', '-p1', '-i', file]), place)
+    sys.stdout.flush()
+    check_call_child(['patch', '-p1', '-i', file], cwd=place)
+    logger.debug('EXEC DONE')
+
+
+def extract_archive(file, **kws):
+    place = kws.get('cwd', os.getcwd())
+    print('Extracting archive {0} in {1}'.format(file, place))
+    logger.debug("EXEC '%s' in %s", ' '.join(['7z', 'x', '-aoa', '-bd', file]), place)
+    sys.stdout.flush()
+    check_call_child(['7z', 'x', '-aoa', '-bd', file], cwd=place)
+    logger.debug('EXEC DONE')
+
+
+def get_remote_hash(url, tag):
+    logger.debug("EXEC 'git ls-remote --quiet %s %s'", url, tag)
+    sys.stdout.flush()
+    with Traced('git ls-remote', 'process', cmd='git ls-remote --quiet {0} {1}'.format(url, tag)):
+        child = sp.Popen(['git', 'ls-remote', '--quiet', url, tag], stdout=sp.PIPE)
+        output = child.communicate()[0].decode()
+    logger.debug('EXEC DONE')
+    refs = {}
+    for line in output.splitlines():
+        commit, ref = line.split()
+        refs[ref] = commit
+    # same precedence as 'git clone --branch'; use the commit that an annotated tag points to
+    for ref in ['refs/heads/{0}', 'refs/tags/{0}^{{}}', 'refs/tags/{0}']:
+        if ref.format(tag) in refs:
+            return refs[ref.format(tag)]
+    return None
+
+
+def get_git_hash(place):
+    if compacted_info(place) is not None:
+        # no git repository left, use the marker file
+        with open(os.path.join(place, 'checked_out')) as f:
+            return f.read().strip()
+    logger.debug("EXEC 'git log -n1 --pretty=format:%%H' in %s", place)
+    sys.stdout.flush()
+    head = sp.check_output(['git', 'log', '-n1', '--pretty=format:%H'], cwd=place).decode()
+    logger.debug('EXEC DONE')
+    return head
+
+
+def complete_setup(dep):
+    set_setup_from_env(dep)
+    setup.setdefault(dep, 'master')
+    setup.setdefault(dep + "_DIRNAME", dep.lower())
+    setup.setdefault(dep + "_REPONAME", dep.lower())
+    setup.setdefault('REPOOWNER', 'epics-modules')
+    setup.setdefault(dep + "_REPOOWNER", setup['REPOOWNER'])
+    setup.setdefault(dep + "_REPOURL", 'https://github.com/{0}/{1}.git'
+                     .format(setup[dep + '_REPOOWNER'], setup[dep + '_REPONAME']))
+    setup.setdefault(dep + "_VARNAME", dep)
+    setup.setdefault(dep + "_RECURSIVE", 'YES')
+    setup.setdefault(dep + "_SUBMODULE_JOBS", 4)
+    setup.setdefault(dep + "_SUBMODULE_DEPTH", 1)
+    setup.setdefault(dep + "_DEPTH", -1)
+    setup.setdefault(dep + "_UPDATE", 'NO')
+    setup.setdefault(dep + "_FILTER", '')
+    setup.setdefault(dep + "_SINGLE_BRANCH", 'NO')
+    setup.setdefault(dep + "_SPARSE", '')
+
+
+# Local mirrors
+#
+# With MIRROR_PATH set, dependencies are cloned from local bare mirrors
+# instead of their remote repositories, if a mirror exists.
+# The mirror of a repository URL is found under MIRROR_PATH
+# using the host and path of the URL, e.g. the mirror of
+# https://github.com/epics-base/epics-base.git is expected in
+# $MIRROR_PATH/github.com/epics-base/epics-base.git
+# Submodules are mirrored the same way; their checkouts are redirected to the
+# mirrors through url.<mirror>.insteadOf settings.
+def mirror_location(url):
+    path = re.sub(r'^[A-Za-z][A-Za-z0-9+.-]*://', '', url)
+    path = re.sub(r'^[^/@]*@', '', path)
+    # scp-like syntax (host:path)
+    path = re.sub(r'^([^/:]+):', r'\1/', path)
+    path = path.strip('/')
+    if not path.endswith('.git'):
+        path += '.git'
+    return os.path.join(ci['mirror_path'], *path.split('/'))
+
+
+def file_url(path):
+    path = os.path.abspath(path).replace('\\', '/')
+    if not path.startswith('/'):
+        path = '/' + path
+    return 'file://' + path
+
+
+def repo_url(dep):
+    url = setup[dep + '_REPOURL']
+    if ci['mirror_path']:
+        mirror = mirror_location(url)
+        if os.path.isdir(mirror):
+            logger.debug('Using mirror %s for %s', mirror, url)
+            return file_url(mirror)
+        print('{0}WARNING: No mirror of {1} in {2}, using the remote repository{3}'
+              .format(ANSI_RED, url, mirror, ANSI_RESET))
+    return url
+
+
+# resolve_submodule_url(base, url)
+#
+# Return the URL of a submodule configured as url in the repository at base
+# (resolving relative URLs like git does)
+def resolve_submodule_url(base, url):
+    if not (url.startswith('./') or url.startswith('../')):
+        return url
+    base = base.rstrip('/')
+    while True:
+        if url.startswith('./'):
+            url = url[2:]
+        elif url.startswith('../'):
+            url = url[3:]
+            base = base.rsplit('/', 1)[0]
+        else:
+            break
+    return base + '/' + url
+
+
+# submodule_urls(git_dir, ref, url, sync=None)
+#
+# Return the URLs of the submodules of the repository in git_dir (cloned from url)
+# at ref, including the submodules of submodules that are found in their mirrors.
+# sync(url) is called for every submodule before its mirror is looked at.
+def submodule_urls(git_dir, ref, url, sync=None):
+    urls = []
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = sp.check_output(['git', '--git-dir=' + git_dir, 'config', '--blob', ref + ':.gitmodules',
+                                      '--get-regexp', r'^submodule\..*\.(path|url)$'],
+                                     stderr=devnull).decode()
+    except (sp.CalledProcessError, OSError):
+        return urls
+    submodules = {}
+    for line in output.splitlines():
+        (key, value) = line.split(' ', 1)
+        (name, attr) = key[len('submodule.'):].rsplit('.', 1)
+        submodules.setdefault(name, {})[attr] = value
+    for name, submodule in sorted(submodules.items()):
+        if 'url' not in submodule or 'path' not in submodule:
+            continue
+        suburl = resolve_submodule_url(url, submodule['url'])
+        if suburl in urls:
+            continue
+        urls.append(suburl)
+        if sync:
+            sync(suburl)
+        mirror = mirror_location(suburl)
+        if os.path.isdir(mirror):
+            tree = sp.check_output(['git', '--git-dir=' + git_dir, 'ls-tree', ref, '--',
+                                    submodule['path']]).decode().split()
+            if len(tree) > 2 and tree[1] == 'commit':
+                urls += [u for u in submodule_urls(mirror, tree[2], suburl, sync) if u not in urls]
+    return urls
+
+
+# submodule_mirror_args(dep, place)
+#
+# Return the git options that redirect the submodules of the checkout
+# of dep in place to their mirrors
+def submodule_mirror_args(dep, place):
+    args = []
+    if not ci['mirror_path']:
+        return args
+    for url in submodule_urls(os.path.join(place, '.git'), 'HEAD', setup[dep + '_REPOURL']):
+        mirror = mirror_location(url)
+        if os.path.isdir(mirror):
+            logger.debug('Using mirror %s for submodule %s', mirror, url)
+            args += ['-c', 'url.{0}.insteadOf={1}'.format(file_url(mirror), url)]
+        else:
+            print('{0}WARNING: No mirror of submodule {1} in {2}, using the remote repository{3}'
+                  .format(ANSI_RED, url, mirror, ANSI_RESET))
+    return args
+
+
+# Lock files
+#
+# A lock file (written by 'cue.py lock') records the commit that each
+# dependency version resolved to, in setup file syntax:
+#   FOO=<version>
+#   FOO_REPOURL=<url>
+#   FOO_COMMIT=<hash>
+# With LOCKFILE set, these commits are fetched directly (at depth 1) instead
+# of asking the remote repository where the versions point to.
+def load_lockfile(name):
+    logger.debug('Loading lock file %s', name)
+    with open(name) as f:
+        for line in f:
+            if not line.strip() or line.strip()[0] == '#':
+                continue
+            (var, value) = line.strip().split('=', 1)
+            locked[var] = value
+
+
+def locked_commit(dep):
+    if dep + '_COMMIT' not in locked:
+        return None
+    if locked.get(dep) != setup[dep] or locked.get(dep + '_REPOURL') != setup[dep + '_REPOURL']:
+        print('{0}WARNING: Lock file entry for {1} does not match its setup, ignoring it{2}'
+              .format(ANSI_RED, dep, ANSI_RESET))
+        return None
+    return locked[dep + '_COMMIT']
+
+
+def sparse_paths(dep):
+    paths = setup[dep + '_SPARSE'].split()
+    if paths and 'configure' not in paths:
+        # the EPICS build system needs configure
+        paths.insert(0, 'configure')
+    return paths
+
+
+# add_dependency(dep, tag)
+#
+# Add a dependency to the cache area:
+# - check out (recursive if configured) in the CACHE area unless it already exists and the
+#   required commit has been built
+# - Defaults:
+#   $dep_DIRNAME = lower case ($dep)
+#   $dep_REPONAME = lower case ($dep)
+#   $dep_REPOURL = GitHub / $dep_REPOOWNER (or $REPOOWNER or epics-modules) / $dep_REPONAME .git
+#   $dep_VARNAME = $dep
+#   $dep_DEPTH = 5
+#   $dep_RECURSIVE = 1/YES (0/NO to for a flat clone)
+#   $dep_SUBMODULE_JOBS = 4 (number of submodules fetched in parallel)
+#   $dep_SUBMODULE_DEPTH = 1 (history depth of submodules, 0 for full history)
+#   $dep_UPDATE = 0/NO (1/YES to update an outdated clone in place instead of re-cloning)
+#   $dep_FILTER = <empty> (git partial clone filter spec, e.g. blob:none)
+#   $dep_SINGLE_BRANCH = 0/NO (1/YES to fetch only the configured branch/tag and no other tags)
+#   $dep_SPARSE = <empty> (list of directories to check out, configure is always added)
+# - Add $dep_VARNAME line to the RELEASE.local file in the cache area (unless already there)
+# - Add dep to $modules_to_compile if it was checked out fresh or depends on a module that will be compiled
+def add_dependency(dep):
+    with Traced('checkout ' + dep, 'dependency'):
+        fresh = checkout_dependency(dep)
+    if fresh:
+        fresh_checkouts.add(dep)
+    register_dependency(dep)
+
+
+# add_dependencies(deps)
+#
+# Add a list of dependencies to the cache area, checking out up to
+# ci['clone_jobs'] of them concurrently.
+# The output of each checkout is buffered and printed when it is done,
+# in the order of the list.
+# Registering the dependencies (RELEASE.local, $modules_to_compile) is done
+# afterwards in the order of the list, so the results do not depend on
+# the order in which the checkouts finish.
+def add_dependencies(deps):
+    jobs = min(ci['clone_jobs'], len(deps))
+    if jobs <= 1:
+        [add_dependency(dep) for dep in deps]
+        return
+
+    def checkout_job(dep):
+        _thread_output.buffer = []
+        try:
+            with Traced('checkout ' + dep, 'dependency'):
+                fresh = checkout_dependency(dep)
+            return fresh, None, _thread_output.buffer
+        except Exception as e:
+            return None, e, _thread_output.buffer
+        finally:
+            _thread_output.buffer = None
+
+    print('Checking out {0} dependencies using {1} parallel jobs'.format(len(deps), jobs))
+    sys.stdout.flush()
+    if not os.path.isdir(ci['cachedir']):
+        os.makedirs(ci['cachedir'])
+
+    cloned = []
+    error = None
+    stdout = sys.stdout
+    sys.stdout = ThreadOutput(stdout)
+    pool = ThreadPool(jobs)
+    try:
+        for dep, (fresh, exc, output) in zip(deps, pool.imap(checkout_job, deps)):
+            stdout.write(''.join(output))
+            stdout.flush()
+            if exc is not None and error is None:
+                error = exc
+            cloned.append(fresh)
+    finally:
+        sys.stdout = stdout
+        pool.close()
+        pool.join()
+    if error is not None:
+        raise error
+
+    for dep, fresh in zip(deps, cloned):
+        if fresh:
+            fresh_checkouts.add(dep)
+        register_dependency(dep)
+
+
+def dependency_dirname(dep):
+    return setup[dep + '_DIRNAME'] + '-{0}'.format(setup[dep])
+
+
+# register_dependency(dep)
+#
+# Add dep to RELEASE.local and decide whether it needs to be compiled:
+# if it was checked out fresh, or if any of the (earlier) modules it depends on
+# will be compiled. As the modules are registered in modlist order, this
+# covers the transitive dependencies.
+def register_dependency(dep):
+    update_release_local(setup[dep + "_VARNAME"], os.path.join(ci['cachedir'], dependency_dirname(dep)))
+    if dep in fresh_checkouts:
+        logger.debug('Dependency %s was checked out fresh, will be compiled', dep)
+        modules_to_compile.append(dep)
+    elif modules_to_compile:
+        rebuilt = dependency_graph([dep])[dep] & set(modules_to_compile)
+        if rebuilt:
+            logger.debug('Dependency %s depends on %s, will be compiled', dep, ', '.join(sorted(rebuilt)))
+            modules_to_compile.append(dep)
+
+
+# checkout_dependency(dep)
+#
+# Make sure the configured version of a dependency is checked out in the cache area.
+# Returns True if a fresh clone was made, False if an up-to-date clone was found.
+# Only works inside the dependency's own directory, so that it can run
+# concurrently for different dependencies.
+def checkout_dependency(dep):
+    recurse = setup[dep + '_RECURSIVE'].lower()
+    if recurse not in ['0', 'no']:
+        recursive = True
+    elif recurse not in ['1', 'yes']:
+        recursive = False
+    else:
+        raise RuntimeError("Invalid value for {}_RECURSIVE='{}' not 0/NO/1/YES".format(dep, recurse))
+    deptharg = {
+        '-1': ['--depth', '5'],
+        '0': [],
+    }.get(str(setup[dep + '_DEPTH']), ['--depth', str(setup[dep + '_DEPTH'])])
+    filterarg = []
+    if setup[dep + '_FILTER']:
+        filterarg = ['--filter=' + setup[dep + '_FILTER']]
+    tagsarg = []
+    if setup[dep + '_SINGLE_BRANCH'].lower() in ['1', 'yes']:
+        tagsarg = ['--no-tags']
+    sparse = sparse_paths(dep)
+
+    tag = setup[dep]
+    url = repo_url(dep)
+
+    logger.debug('Adding dependency %s with tag %s', dep, setup[dep])
+
+    update = setup[dep + '_UPDATE'].lower() in ['1', 'yes']
+    remote_head = locked_commit(dep)
+
+    if remote_head:
+        # fetch exactly the locked commit, no need to ask the remote
+        logger.debug('Using locked commit %s of %s', remote_head, dep)
+        fetchref = remote_head
+        if deptharg:
+            deptharg = ['--depth', '1']
+    else:
+        fetchref = tag
+        # determine if dep points to a valid release or branch
+        if update:
+            remote_head = get_remote_hash(url, tag)
+            invalid = remote_head is None
+        else:
+            invalid = call_git(['ls-remote', '--quiet', '--exit-code', '--refs', url, tag])
+        if invalid:
+            raise RuntimeError("{0}{1} is neither a tag nor a branch name for {2} ({3}){4}"
+                               .format(ANSI_RED, tag, dep, url, ANSI_RESET))
+
+    dirname = dependency_dirname(dep)
+    place = os.path.join(ci['cachedir'], dirname)
+    checked_file = os.path.join(place, "checked_out")
+
+    if os.path.isdir(place):
+        logger.debug('Dependency %s: directory %s exists, comparing checked-out commit', dep, place)
+        # check HEAD commit against the hash in marker file
+        if os.path.exists(checked_file):
+            with open(checked_file, 'r') as bfile:
+                checked_out = bfile.read().strip()
+            bfile.close()
+        else:
+            checked_out = 'never'
+        head = get_git_hash(place)
+        logger.debug('Found checked_out commit %s, git head is %s', checked_out, head)
+        if head != checked_out:
+            logger.debug('Dependency %s out of date - removing', dep)
+            shutil.rmtree(place, onerror=remove_readonly)
+        elif remote_head and remote_head != head and compacted_info(place) is not None:
+            print('Found compacted {0} of dependency {1} in {2} at {3}, current commit is {4} - removing'
+                  .format(tag, dep, place, head[:10], remote_head[:10]))
+            sys.stdout.flush()
+            shutil.rmtree(place, onerror=remove_readonly)
+        elif remote_head and remote_head != head and update:
+            # update the existing clone in place, keeping the build products
+            print('Updating {0} of dependency {1} in {2} from {3} to {4}'
+                  .format(tag, dep, place, head[:10], remote_head[:10]))
+            sys.stdout.flush()
+            call_git(['reset', '--quiet', '--hard'], cwd=place)
+            call_git(['clean', '--quiet', '-fd'], cwd=place)
+            if ci['shared_objects']:
+                store, commit = fetch_into_store(dep, url, fetchref, deptharg + tagsarg)
+                fetchargs = ['--update-shallow', store, 'refs/cue/' + tag]
+                if not tagsarg:
+                    fetchargs += ['+refs/tags/*:refs/tags/*']
+            else:
+                commit = 'FETCH_HEAD'
+                fetchargs = deptharg + tagsarg + ['origin', fetchref]
+            if call_git(['fetch', '--quiet'] + fetchargs, cwd=place):
+                raise RuntimeError("{0}Fetching {1} of dependency {2} failed{3}"
+                                   .format(ANSI_RED, tag, dep, ANSI_RESET))
+            call_git(['checkout', '--quiet', '--force', commit], cwd=place)
+            if recursive:
+                update_submodules(dep, place)
+            finish_checkout(dep, place)
+            return True
+        elif remote_head and remote_head != head:
+            print('Found {0} of dependency {1} in {2} at {3}, locked commit is {4} - removing'
+                  .format(tag, dep, place, head[:10], remote_head[:10]))
+            sys.stdout.flush()
+            shutil.rmtree(place, onerror=remove_readonly)
+        else:
+            print('Found {0} of dependency {1} up-to-date in {2}'.format(tag, dep, place))
+            sys.stdout.flush()
+            return False
+
+    try:
+        os.makedirs(ci['cachedir'])
+    except OSError:
+        if not os.path.isdir(ci['cachedir']):
+            raise
+    # clone dependency
+    if ci['shared_objects']:
+        if filterarg:
+            print('{0}WARNING: {1}_FILTER is not supported with SHARED_OBJECTS, fetching all blobs{2}'
+                  .format(ANSI_RED, dep, ANSI_RESET))
+        store, commit = fetch_into_store(dep, url, fetchref, deptharg + tagsarg)
+        print('Checking out {0} of dependency {1} into {2} using shared objects'
+              .format(tag, dep, place))
+        sys.stdout.flush()
+        checkout_from_store(place, url, store, commit, tags=not tagsarg, sparse=sparse)
+    elif fetchref != tag:
+        print('Fetching locked commit {0} ({1}) of dependency {2} into {3}'
+              .format(fetchref[:10], tag, dep, place))
+        sys.stdout.flush()
+        call_git(['init', '--quiet', place])
+        call_git(['remote', 'add', 'origin', url], cwd=place)
+        if call_git(['fetch', '--quiet'] + deptharg + filterarg + tagsarg + ['origin', fetchref], cwd=place):
+            raise RuntimeError("{0}Fetching locked commit {1} of dependency {2} failed{3}"
+                               .format(ANSI_RED, fetchref, dep, ANSI_RESET))
+        # as in checkout_from_store(): sparse-checkout needs a fetched repository
+        if sparse:
+            call_git(['sparse-checkout', 'set'] + sparse, cwd=place)
+        call_git(['checkout', '--quiet', 'FETCH_HEAD'], cwd=place)
+    else:
+        print('Cloning {0} of dependency {1} into {2}'
+              .format(tag, dep, place))
+        sys.stdout.flush()
+        clonearg = deptharg + filterarg
+        if tagsarg:
+            clonearg += ['--single-branch'] + tagsarg
+        if sparse:
+            clonearg += ['--sparse']
+        call_git(['clone', '--quiet'] + clonearg + ['--branch', tag, url, dirname],
+                 cwd=ci['cachedir'])
+        if sparse:
+            call_git(['sparse-checkout', 'set'] + sparse, cwd=place)
+    if recursive:
+        update_submodules(dep, place)
+
+    finish_checkout(dep, place)
+    return True
+
+
+# update_submodules(dep, place)
+#
+# Check out the submodules of dep (recursively), fetching up to $dep_SUBMODULE_JOBS
+# submodules in parallel, with a history depth of $dep_SUBMODULE_DEPTH (0 = full).
+# If the shallow fetch fails (e.g. the recorded commit is not close to a branch tip
+# and the server does not allow fetching it directly), the full history is fetched.
+def update_submodules(dep, place):
+    args = submodule_mirror_args(dep, place) + ['submodule', 'update', '--quiet', '--init', '--recursive']
+    jobs = int(setup[dep + '_SUBMODULE_JOBS'])
+    if jobs > 1:
+        args += ['--jobs', str(jobs)]
+    depth = int(setup[dep + '_SUBMODULE_DEPTH'])
+    if depth > 0:
+        if not call_git(args + ['--depth', str(depth)], cwd=place):
+            return
+        print('{0}Shallow checkout of submodules of {1} failed, fetching full history{2}'
+              .format(ANSI_YELLOW, dep, ANSI_RESET))
+    if call_git(args, cwd=place):
+        raise RuntimeError("{0}Checking out submodules of {1} in {2} failed{3}"
+                           .format(ANSI_RED, dep, place, ANSI_RESET))
+
+
+# Shared object stores
+#
+# With SHARED_OBJECTS=YES, the git objects of all checked-out versions of a
+# dependency are kept in one bare repository per repository URL under
+# $CACHEDIR/git-objects (or SHARED_OBJECTS_DIR), which the checkouts use through
+# git's alternates mechanism. Adding another version of a repository that is
+# already in the cache only transfers the missing objects.
+# Fetches into a store are serialized between threads, and (on POSIX systems)
+# between processes sharing the stores.
+_store_locks = {}
+_store_locks_guard = threading.Lock()
+
+
+def object_store(url):
+    name = re.sub(r'\.git$', '', url.rstrip('/').split('/')[-1])
+    return os.path.join(ci['objects_dir'],
+                        '{0}-{1}.git'.format(name, hashlib.sha1(url.encode()).hexdigest()[:8]))
+
+
+class FileLock(object):
+    '''Exclusive lock on a lock file, shared with other processes (no-op where fcntl is missing)'''
+    def __init__(self, fname):
+        self.fname = fname
+        self.fd = None
+    def __enter__(self):
+        if fcntl is None:
+            return
+        if not os.path.isdir(os.path.dirname(self.fname)):
+            os.makedirs(os.path.dirname(self.fname))
+        self.fd = os.open(self.fname, os.O_CREAT | os.O_RDWR)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+    def __exit__(self, A, B, C):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+
+# fetch_into_store(dep, url, ref, fetchargs)
+#
+# Fetch ref (the configured version or a locked commit of dep) from url into
+# its shared object store (as refs/cue/<version>), creating the store if needed.
+# Returns the store location and the fetched commit.
+def fetch_into_store(dep, url, ref, fetchargs):
+    tag = setup[dep]
+    store = object_store(setup[dep + '_REPOURL'])
+    with _store_locks_guard:
+        lock = _store_locks.setdefault(store, threading.Lock())
+    with lock, FileLock(store + '.lock'):
+        if not os.path.isdir(store):
+            call_git(['init', '--quiet', '--bare', store])
+        if '--depth' not in fetchargs and os.path.exists(os.path.join(store, 'shallow')):
+            fetchargs = fetchargs + ['--unshallow']
+        print('Fetching {0} of dependency {1} into {2}'.format(ref, dep, store))
+        sys.stdout.flush()
+        if call_git(['--git-dir=' + store, 'fetch', '--quiet'] + fetchargs
+                    + [url, '+{0}:refs/cue/{1}'.format(ref, tag)]):
+            raise RuntimeError("{0}Fetching {1} of dependency {2} into {3} failed{4}"
+                               .format(ANSI_RED, tag, dep, store, ANSI_RESET))
+        commit = sp.check_output(['git', '--git-dir=' + store, 'rev-parse', 'refs/cue/{0}^{{commit}}'.format(tag)])\
+            .decode().strip()
+    return store, commit
+
+
+# checkout_from_store(place, url, store, commit, tags, sparse)
+#
+# Create a checkout of commit in place (with origin url) that borrows all
+# objects from store, copying the tags of the store if tags is True and
+# limiting the working tree to the sparse paths (if any)
+def checkout_from_store(place, url, store, commit, tags=True, sparse=None):
+    call_git(['init', '--quiet', place])
+    objects = os.path.join(place, '.git', 'objects')
+    with open(os.path.join(objects, 'info', 'alternates'), 'w') as f:
+        # relative path keeps the cache relocatable
+        print(os.path.relpath(os.path.join(store, 'objects'), objects).replace('\\', '/'), file=f)
+    if os.path.exists(os.path.join(store, 'shallow')):
+        shutil.copy(os.path.join(store, 'shallow'), os.path.join(place, '.git', 'shallow'))
+    call_git(['remote', 'add', 'origin', url], cwd=place)
+    if tags:
+        call_git(['fetch', '--quiet', store, '+refs/tags/*:refs/tags/*'], cwd=place)
+    if sparse:
+        call_git(['sparse-checkout', 'set'] + sparse, cwd=place)
+    call_git(['checkout', '--quiet', commit], cwd=place)
+
+
+# finish_checkout(dep, place)
+#
+# Prepare a freshly checked-out dependency for building:
+# apply the fixes for Base 3.14, make modules include the common RELEASE.local,
+# apply the hook and write the hash of the checked-out commit to the marker file
+def finish_checkout(dep, place):
+    checked_file = os.path.join(place, "checked_out")
+
+    check_call_child(['git', 'log', '-n1'], cwd=place)
+
+    if dep == 'BASE':
+        # add MSI 1.7 to Base 3.14
+        versionfile = os.path.join(place, 'configure', 'CONFIG_BASE_VERSION')
+        if os.path.exists(versionfile):
+            with open(versionfile) as f:
+                if 'BASE_3_14=YES' in f.read():
+                    print('Adding MSI 1.7 to {0}'.format(place))
+                    sys.stdout.flush()
+                    check_call_child(['patch', '-p1', '-i', os.path.join(ci['scriptsdir'], 'add-msi-to-314.patch')],
+                                     cwd=place)
+
+                    # Post 3.14 we have checks for readline.h
+                    print('Patching COMMANDLINE_LIBRARY to EPICS')
+                    sys.stdout.flush()
+                    check_call_child(['patch', '-p1', '-i', os.path.join(ci['scriptsdir'], 'dont_use_readline_314.patch')],
+                                     cwd=place)
+
+    else:
+        # force including RELEASE.local for non-base modules by overwriting their configure/RELEASE
+        release = os.path.join(place, "configure", "RELEASE")
+        if os.path.exists(release):
+            with open(release, 'w') as fout:
+                print('-include $(TOP)/../RELEASE.local', file=fout)
+
+    # Apply HOOK
+    if dep + '_HOOK' in setup:
+        hook = setup[dep + '_HOOK']
+        hook_file = os.path.join(curdir, hook)
+        hook_ext = os.path.splitext(hook_file)[1]
+        if os.path.exists(hook_file):
+            if hook_ext == '.patch':
+                apply_patch(hook_file, cwd=place)
+            elif hook_ext in ('.zip', '.7z'):
+                extract_archive(hook_file, cwd=place)
+            elif hook_ext == '.py':
+                print('Running py hook {0} in {1}'.format(hook, place))
+                check_call_child([sys.executable, hook_file], cwd=place)
+            else:
+                print('Running hook {0} in {1}'.format(hook, place))
+                sys.stdout.flush()
+                check_call_child(hook_file, shell=True, cwd=place)
+        else:
+            print('Skipping invalid hook {0} in {1}'.format(hook, place))
+
+    # write checked out commit hash to marker file
+    head = get_git_hash(place)
+    logger.debug('Writing hash of checked-out dependency (%s) to marker file', head)
+    with open(checked_file, "w") as fout:
+        print(head, file=fout)
+    fout.close()
+
+
+def detect_epics_host_arch():
+    if ci['os'] == 'windows':
+        if re.match(r'^vs', ci['compiler']):
+            # there is no combined static and debug EPICS_HOST_ARCH target,
+            # so a combined debug and static target will appear to be just static
+            # but debug will have been specified in CONFIG_SITE by prepare()
+            hostarchsuffix = ''
+            if ci['debug']:
+                hostarchsuffix = '-debug'
+            if ci['static']:
+                hostarchsuffix = '-static'
+
+            if ci['platform'] == 'x86':
+                os.environ['EPICS_HOST_ARCH'] = 'win32-x86' + hostarchsuffix
+            elif ci['platform'] == 'x64':
+                os.environ['EPICS_HOST_ARCH'] = 'windows-x64' + hostarchsuffix
+
+        elif ci['compiler'] == 'gcc':
+            if ci['platform'] == 'x86':
+                os.environ['EPICS_HOST_ARCH'] = 'win32-x86-mingw'
+            elif ci['platform'] == 'x64':
+                os.environ['EPICS_HOST_ARCH'] = 'windows-x64-mingw'
+
+    if 'EPICS_HOST_ARCH' not in os.environ:
+        logger.debug('Running script to detect EPICS host architecture in %s', places['EPICS_BASE'])
+        os.environ['EPICS_HOST_ARCH'] = 'unknown'
+        eha_scripts = [
+            os.path.join(places['EPICS_BASE'], 'src', 'tools', 'EpicsHostArch.pl'),
+            os.path.join(places['EPICS_BASE'], 'startup', 'EpicsHostArch.pl'),
+            # installed copy (compacted Base)
+            os.path.join(places['EPICS_BASE'], 'lib', 'perl', 'EpicsHostArch.pl'),
+        ]
+        for eha in eha_scripts:
+            if os.path.exists(eha):
+                os.environ['EPICS_HOST_ARCH'] = sp.check_output(['perl', eha]).decode('ascii').strip()
+                logger.debug('%s returned: %s',
+                             eha, os.environ['EPICS_HOST_ARCH'])
+                break
+
+
+def setup_for_build(args):
+    global is_base314, has_test_results, is_make3
+    dllpaths = []
+
+    logger.debug('Setting up the build environment')
+
+    if ci['os'] == 'windows':
+        if os.path.exists(r'C:\Strawberry\perl\bin'):
+            # Put strawberry perl in front of the PATH (so that Git Perl is further behind)
+            # Put Chocolatey\bin ahead to select correct make.exe
+            logger.debug('Adding Strawberry Perl in front of the PATH')
+            os.environ['PATH'] = os.pathsep.join([r'C:\ProgramData\Chocolatey\bin',
+                                                  r'C:\Strawberry\c\bin',
+                                                  r'C:\Strawberry\perl\site\bin',
+                                                  r'C:\Strawberry\perl\bin',
+                                                  os.environ['PATH']])
+
+        if ci['service'] == 'appveyor' and ci['compiler'] == 'gcc':
+            logger.debug('Adding AppVeyor MSYS2/MinGW installation to PATH and INCLUDE')
+            if 'INCLUDE' not in os.environ:
+                os.environ['INCLUDE'] = ''
+            if ci['platform'] == 'x86':
+                os.environ['INCLUDE'] = os.pathsep.join(
+                    [r'C:\msys64\mingw32\include',
+                     os.environ['INCLUDE']])
+                os.environ['PATH'] = os.pathsep.join([r'C:\msys64\mingw32\bin',
+                                                      os.environ['PATH']])
+            elif ci['platform'] == 'x64':
+                os.environ['INCLUDE'] = os.pathsep.join(
+                    [r'C:\msys64\mingw64\include',
+                     os.environ['INCLUDE']])
+                os.environ['PATH'] = os.pathsep.join([r'C:\msys64\mingw64\bin',
+                                                      os.environ['PATH']])
+
+    # Find BASE location
+    if not building_base:
+        with open(os.path.join(ci['cachedir'], 'RELEASE.local'), 'r') as f:
+            lines = f.readlines()
+            for line in lines:
+                (mod, place) = line.strip().split('=')
+                if mod == 'EPICS_BASE':
+                    places['EPICS_BASE'] = place
+    else:
+        places['EPICS_BASE'] = '.'
+
+    logger.debug('Using EPICS Base at %s', places['EPICS_BASE'])
+
+    detect_epics_host_arch()
+
+    if ci['os'] == 'windows':
+        if not building_base:
+            with open(os.path.join(ci['cachedir'], 'RELEASE.local'), 'r') as f:
+                lines = f.readlines()
+                for line in lines:
+                    (mod, place) = line.strip().split('=')
+                    bin_dir = os.path.join(place, 'bin', os.environ['EPICS_HOST_ARCH'])
+                    if os.path.isdir(bin_dir):
+                        dllpaths.append(bin_dir)
+        # Add DLL location to PATH
+        bin_dir = os.path.join(os.getcwd(), 'bin', os.environ['EPICS_HOST_ARCH'])
+        if os.path.isdir(bin_dir):
+            dllpaths.append(bin_dir)
+        os.environ['PATH'] = os.pathsep.join(dllpaths + [os.environ['PATH']])
+        logger.debug('DLL paths added to PATH: %s', os.pathsep.join(dllpaths))
+
+    cfg_base_version = os.path.join(places['EPICS_BASE'], 'configure', 'CONFIG_BASE_VERSION')
+    if os.path.exists(cfg_base_version):
+        with open(cfg_base_version) as myfile:
+            if 'BASE_3_14=YES' in myfile.read():
+                is_base314 = True
+    logger.debug('Check if EPICS Base is a 3.14 series: %s', is_base314)
+
+    if not is_base314:
+        rules_build = os.path.join(places['EPICS_BASE'], 'configure', 'RULES_BUILD')
+        if os.path.exists(rules_build):
+            with open(rules_build) as myfile:
+                for line in myfile:
+                    if re.match('^test-results:', line):
+                        has_test_results = True
+
+    # apparently %CD% is handled automagically, so use getcwd() instead
+    os.environ['TOP'] = os.getcwd()
+    os.environ['MAKE'] = 'make'
+    os.environ['EPICS_BASE'] = places['EPICS_BASE']
+
+    changed_vars = set()
+
+    for extra_env_var in args.extra_env_vars:
+        try:
+            key_value = extra_env_var.split('=')
+            key = key_value[0]
+            value = key_value[1]
+            expanded_value = value.format(**os.environ)
+
+            # Update the environment right now so later variables have access
+            if key in os.environ:
+                old_value = [os.environ[key]]
+            else:
+                old_value = []
+
+            os.environ[key] = os.pathsep.join(old_value + [expanded_value])
+            changed_vars.add(key)
+        except KeyError:
+            print('Environment')
+            [print('  ', K, '=', repr(V)) for K, V in os.environ.items()]
+            raise
+
+    for key in changed_vars:
+        print("{0}{2} = {3}{1}".format(ANSI_CYAN, ANSI_RESET, key, os.environ[key]))
+
+    # os.environ completely updated at this point
+
+    logger.debug('Final PATH')
+    for loc in os.environ['PATH'].split(os.pathsep):
+        logger.debug('  %r', loc)
+
+    # Check make version
+    if re.match(r'^GNU Make 3', sp.check_output(['make', '-v']).decode('ascii')):
+        is_make3 = True
+    logger.debug('Check if make is a 3.x series: %s', is_make3)
+
+    if ci['compiler_cache']:
+        setup_compiler_cache()
+
+    # Add EXTRA make arguments
+    for tag in ['EXTRA', 'EXTRA1', 'EXTRA2', 'EXTRA3', 'EXTRA4', 'EXTRA5']:
+        val = os.environ.get(tag, "")
+        if len(val)>0:
+            extra_makeargs.extend(shlex.split(val))
+
+
+# Compiler cache
+#
+# With COMPILER_CACHE set to ccache or sccache, all compilers (host and cross)
+# are wrapped with the compiler cache, which keeps its data under $CACHEDIR.
+# The wrapping is done by the block below (appended to Base's configure/CONFIG,
+# so that it also applies to the dependencies and the main module),
+# which is activated by setting CUE_COMPILER_CACHE in the environment.
+compiler_cache_config = '''
+# wrap the compilers with the compiler cache set up by cue
+ifdef T_A
+ifneq ($(CUE_COMPILER_CACHE),)
+ifeq ($(findstring $(CUE_COMPILER_CACHE),$(CC)),)
+  CC := $(CUE_COMPILER_CACHE) $(CC)
+  CCC := $(CUE_COMPILER_CACHE) $(CCC)
+endif
+endif
+endif'''
+compiler_cache_dirvars = {
+    'ccache': 'CCACHE_DIR',
+    'sccache': 'SCCACHE_DIR',
+}
+
+
+def setup_compiler_cache():
+    tool = ci['compiler_cache']
+    if tool not in compiler_cache_dirvars:
+        raise ValueError('Unknown compiler cache {0}. valid values are: {1}'
+                         .format(tool, ', '.join(sorted(compiler_cache_dirvars))))
+    if re.match(r'^vs', ci['compiler']):
+        print('{0}WARNING: COMPILER_CACHE is not supported with Visual Studio, ignoring it{1}'
+              .format(ANSI_RED, ANSI_RESET))
+        ci['compiler_cache'] = ''
+        return
+    try:
+        with open(os.devnull, 'w') as devnull:
+            sp.check_call([tool, '--version'], stdout=devnull, stderr=devnull)
+    except (sp.CalledProcessError, OSError):
+        print('{0}WARNING: Compiler cache {1} not found, building without it{2}'
+              .format(ANSI_RED, tool, ANSI_RESET))
+        ci['compiler_cache'] = ''
+        return
+    os.environ.setdefault(compiler_cache_dirvars[tool], os.path.join(ci['cachedir'], tool))
+    os.environ['CUE_COMPILER_CACHE'] = tool
+    logger.debug('Using compiler cache %s in %s', tool, os.environ[compiler_cache_dirvars[tool]])
+
+
+# compiler_cache_stats(zero)
+#
+# Print the hit/miss statistics of the compiler cache (or reset them if zero is True)
+def compiler_cache_stats(zero=False):
+    if zero:
+        sp.call([ci['compiler_cache'], '--zero-stats'])
+    else:
+        print('{0}$ {1} --show-stats{2}'.format(ANSI_CYAN, ci['compiler_cache'], ANSI_RESET))
+        sys.stdout.flush()
+        sp.call([ci['compiler_cache'], '--show-stats'])
+
+
+def fix_etc_hosts():
+    # Several travis-ci images throw us a curveball in /etc/hosts
+    # by including two entries for localhost.  The first for 127.0.1.1
+    # causes epicsSockResolveTest to fail.
+    #  cat /etc/hosts
+    #  ...
+    #  127.0.1.1 localhost localhost ip4-loopback
+    #  127.0.0.1 localhost nettuno travis vagrant travis-job-....
+
+    logger.debug("EXEC sudo sed -ie '/^127\\.0\\.1\\.1/ s|localhost\\s*||g' /etc/hosts")
+    sys.stdout.flush()
+    sp.call(['sudo', 'sed', '-ie', '/^127\\.0\\.1\\.1/ s|localhost\\s*||g', '/etc/hosts'])
+    logger.debug('EXEC DONE')
+
+
+def edit_make_file(mode, path, values):
+    """Edit an EPICS Make file.
+
+    mode should be either "a" or "w", as for the open function.
+
+    path should be a list, e.g. ["configure", "CONFIG_SITE"]
+
+    values should be a dictionary of values to edit. If the value starts with
+    a "+" the value will be appended.
+
+    Example usage:
+
+        edit_make_file("a", ["configure", "CONFIG_SITE"], {
+            "VARIABLE": "value",
+            "APPENDED_VARIABLE": "+value",
+        })
+    """
+    with open(os.path.join(places["EPICS_BASE"], *path), mode) as f:
+        for variable, value in values.items():
+            if value.startswith("+"):
+                op = "+="
+                value = value[1:]
+            else:
+                op = "="
+
+            f.write(variable + op + value + "\n")
+
+
+def handle_old_cross_variables():
+    if "CI_CROSS_TARGETS" not in os.environ:
+        os.environ["CI_CROSS_TARGETS"] = ""
+
+    if "RTEMS" in os.environ:
+        rtems_target = os.environ.get('RTEMS_TARGET')
+        if not rtems_target:
+            if os.environ['RTEMS'] == '5':
+                rtems_target = 'RTEMS-pc686-qemu'
+            else:
+                rtems_target = 'RTEMS-pc386'
+                if os.path.exists(os.path.join(places['EPICS_BASE'], 'configure', 'os',
+                                         'CONFIG.Common.RTEMS-pc386-qemu')):
+                    # Base 3.15 doesn't have -qemu target architecture
+                    rtems_target = 'RTEMS-pc386-qemu'
+
+        new_cross_target = ":" + rtems_target + "@" + os.environ["RTEMS"]
+        os.environ["CI_CROSS_TARGETS"] += new_cross_target
+
+        print(
+            "{0}WARNING: deprecated RTEMS environment variable was specified." \
+            " Please add '{1}' to CI_CROSS_TARGETS instead.{2}".format(
+                ANSI_RED, new_cross_target, ANSI_RESET
+            )
+        )
+        logger.debug('Replaced deprecated RTEMS target with new entry in CI_CROSS_TARGETS: %s', new_cross_target)
+
+    if "WINE" in os.environ:
+        if os.environ['WINE'] == '32':
+            new_cross_target = ":win32-x86-mingw"
+        elif os.environ['WINE'] == '64':
+            new_cross_target = ":windows-x64-mingw"
+        else:
+            raise RuntimeError("Invalid $WINE, must be 32/64")
+        os.environ["CI_CROSS_TARGETS"] += new_cross_target
+
+        print(
+            "{0}WARNING: deprecated WINE environment variable was specified." \
+            " Please add '{1}' to CI_CROSS_TARGETS instead.{2}".format(
+                ANSI_RED, new_cross_target, ANSI_RESET
+            )
+        )
+        logger.debug('Replaced deprecated WINE target with new entry in CI_CROSS_TARGETS: %s', new_cross_target)
+
+
+def prepare_cross_compilation(cross_target_info):
+    """Prepare the configuration for a single value of the CI_CROSS_TARGETS
+    variable.
+
+    See the README.md file for more information on this variable."""
+    cross_target_info = cross_target_info.split("@")
+    if len(cross_target_info) == 2:
+        target_param = cross_target_info[1]
+    else:
+        target_param = None
+
+    target = cross_target_info[0]
+
+    if target.startswith("RTEMS-"):
+        prepare_rtems_cross(target, target_param)
+    elif target.endswith("-mingw"):
+        prepare_wine_cross(target)
+    elif target.startswith("linux-"):
+        prepare_linux_cross(target, target_param)
+    else:
+        raise ValueError(
+            "Unknown CI_CROSS_TARGETS {0}. "
+            "Please see the ci-scripts README for available values.".format(target)
+        )
+
+
+def prepare_rtems_cross(epics_arch, version):
+    """Prepare the configuration for RTEMS cross-compilation for the given
+    RTEMS version.
+
+    If version is None, it defaults to version 5 for RTEMS-pc686-*, 4.10
+    otherwise."""
+    if version is None:
+        if epics_arch.startswith("RTEMS-pc686"):
+            version = "5"
+        else:
+            version = "4.10"
+
+    # eg. "RTEMS-pc386" or "RTEMS-pc386-qemu" -> "pc386"
+    rtems_bsp = re.match("^RTEMS-([^-]*)(?:-qemu)?$", epics_arch).group(1)
+
+    print("Cross compiler RTEMS{0} @ {1}".format(version, epics_arch))
+
+    if ci["os"] == "linux":
+        download_rtems(version, rtems_bsp)
+
+    edit_make_file(
+        "a",
+        ["configure", "os", "CONFIG_SITE.Common.RTEMS"],
+        {
+            "RTEMS_VERSION": version,
+            "RTEMS_BASE": "/opt/rtems/" + version,
+        },
+    )
+
+    edit_make_file(
+        "a",
+        ["configure", "CONFIG_SITE"],
+        {"CROSS_COMPILER_TARGET_ARCHS": epics_arch},
+    )
+
+    ci["apt"].extend(
+        ["re2c", "g++-mingw-w64-i686", "g++-mingw-w64-x86-64", "qemu-system-x86"]
+    )
+
+def download_rtems(version, rtems_bsp):
+    rsb_release = os.environ.get("RSB_BUILD", "20210306")
+    tar_name = "{0}-rtems{1}.tar.xz".format(rtems_bsp, version)
+    print("Downloading RTEMS {0} cross compiler: {1}".format(version, tar_name))
+    sys.stdout.flush()
+    sp.check_call(
+        [
+            "curl",
+            "-fsSL",
+            "--retry",
+            "3",
+            "-o",
+            tar_name,
+            "https://github.com/mdavidsaver/rsb/releases/download/{0}%2F{1}/{2}".format(
+                version, rsb_release, tar_name
+            ),
+        ],
+        cwd=toolsdir,
+    )
+    sudo_prefix = []
+    if ci["service"] == "github-actions":
+        sudo_prefix = ["sudo"]
+    sp.check_call(
+        sudo_prefix + ["tar", "-C", "/", "-xmJ", "-f", os.path.join(toolsdir, tar_name)]
+    )
+    os.remove(os.path.join(toolsdir, tar_name))
+    for rtems_cc in glob("/opt/rtems/*/bin/*-gcc"):
+        print("{0}{1} --version{2}".format(ANSI_CYAN, rtems_cc, ANSI_RESET))
+        sys.stdout.flush()
+        sp.check_call([rtems_cc, "--version"])
+
+
+def prepare_wine_cross(epics_arch):
+    """Prepare the configuration for Wine cross-compilation for the given mingw
+    architecture."""
+
+    if epics_arch == "win32-x86-mingw":
+        gnu_arch = "i686-w64-mingw32"
+        deb_arch = "mingw-w64-i686"
+        bits = "32"
+    elif epics_arch == "windows-x64-mingw":
+        gnu_arch = "x86_64-w64-mingw32"
+        deb_arch = "mingw-w64-x86-64"
+        bits = "64"
+    else:
+        raise ValueError(
+            "Unknown architecture '{0}' for WINE target. "
+            "Please see the ci-scripts README for available values.".format(epics_arch)
+        )
+
+    print("Cross compiler mingw{} / Wine".format(bits))
+
+    edit_make_file(
+        "a",
+        ["configure", "os", "CONFIG.linux-x86." + epics_arch],
+        {"CMPLR_PREFIX": gnu_arch + "-"},
+    )
+
+    edit_make_file(
+        "a",
+        ["configure", "CONFIG_SITE"],
+        {"CROSS_COMPILER_TARGET_ARCHS": "+" + epics_arch},
+    )
+
+    ci['apt'].extend(["re2c", "g++-" + deb_arch])
+
+
+def prepare_linux_cross(epics_arch, gnu_arch):
+    """Prepare the configuration for Linux cross-compilation for the given
+    architecture.
+
+    If gnu_arch is None, this function will try to guess it using the
+    epics_arch value.
+
+    linux-arm architecture defaults to arm-linux-gnueabi (soft floats)."""
+    # This list is kind of an intersection between the set of cross-compilers
+    # provided by Ubuntu[1] and the list of architectures found in
+    # `epics-base/configure/os`
+    #
+    # [1]: https://packages.ubuntu.com/source/focal/gcc-10-cross
+    if gnu_arch is None:
+        if epics_arch == "linux-x86":
+            gnu_arch = "i686-linux-gnu"
+        elif epics_arch == "linux-arm":
+            gnu_arch = "arm-linux-gnueabi"
+        elif epics_arch == "linux-aarch64":
+            gnu_arch = "aarch64-linux-gnu"
+        elif epics_arch == "linux-ppc":
+            gnu_arch = "powerpc-linux-gnu"
+        elif epics_arch == "linux-ppc64":
+            gnu_arch = "powerpc64le-linux-gnu"
+        else:
+            raise ValueError(
+                "Could not guess the GNU architecture for EPICS arch: {}. "
+                "Please use the '@' syntax of the 'CI_CROSS_TARGETS' variable".format(
+                    epics_arch
+                )
+            )
+
+    print(
+        "Setting up Linux cross-compiling arch {0} with GNU arch {1}".format(
+            epics_arch, gnu_arch
+        )
+    )
+
+    edit_make_file(
+        "w",
+        ["configure", "os", "CONFIG_SITE.linux-x86_64." + epics_arch],
+        {
+            "GNU_TARGET": gnu_arch,
+            "COMMANDLINE_LIBRARY": "EPICS",
+        },
+    )
+
+    edit_make_file(
+        "a",
+        ["configure", "CONFIG_SITE"],
+        {"CROSS_COMPILER_TARGET_ARCHS": "+" + epics_arch},
+    )
+
+    ci["apt"].extend(["re2c", "g++-" + gnu_arch])
+
+
+# Resolved setup cache
+#
+# Resolving a setup (reading the include chain of setup files, applying the
+# environment overrides and the defaults of complete_setup()) is cached
+# in $CACHEDIR/setups, with one entry per setup name and search path.
+# An entry is used if the setup files it was resolved from still are the ones
+# found in the search path, with the same contents, and all environment
+# variables that the resolved setup depends on have the same values.
+setup_cache_dir = 'setups'
+
+
+# resolve_file(name, setup_dirs)
+#
+# Return the setup file that source_set() reads for name (or None)
+def resolve_file(name, setup_dirs):
+    for set_dir in setup_dirs:
+        set_file = os.path.join(set_dir, name) + ".set"
+        if os.path.isfile(set_file):
+            return set_file
+    return None
+
+
+# setup_digest(files, env)
+#
+# Return a digest over the contents of the setup files and the environment values
+def setup_digest(files, env):
+    sha = hashlib.sha1()
+    for set_file in sorted(files):
+        if not os.path.isfile(set_file):
+            return None
+        sha.update(set_file.encode())
+        with open(set_file, 'rb') as f:
+            sha.update(f.read())
+    sha.update(json.dumps(sorted(env.items())).encode())
+    return sha.hexdigest()
+
+
+def setup_cache_file(name):
+    setup_dirs = os.getenv('SETUP_PATH', "").replace(':', ' ').split()
+    key = json.dumps([name, setup_dirs, building_base])
+    return os.path.join(ci['cachedir'], setup_cache_dir,
+                        hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+
+# load_cached_setup(name)
+#
+# Return the cached resolved setup for name if it is still valid, else None
+def load_cached_setup(name):
+    cache_file = setup_cache_file(name)
+    try:
+        with open(cache_file) as f:
+            entry = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    setup_dirs = os.getenv('SETUP_PATH', "").replace(':', ' ').split()
+    for set_file in entry['files']:
+        if resolve_file(os.path.basename(set_file)[:-4], setup_dirs) != set_file:
+            return None
+    env = dict((var, os.environ.get(var)) for var in entry['env'])
+    if setup_digest(entry['files'], env) != entry['digest']:
+        return None
+    logger.debug('Using resolved setup from %s', cache_file)
+    return entry
+
+
+# setup_env_vars()
+#
+# Return the names of all environment variables that resolving the setup
+# consulted: the module lists, the settings in the setup files and
+# the overridable settings of all modules (whether set or not)
+def setup_env_vars():
+    names = set(setup)
+    names.update(['ADD_MODULES', 'MODULES'])
+    for mod in modlist():
+        names.update(mod + postf for postf in dependency_postfixes)
+    return sorted(names)
+
+
+def save_cached_setup(name):
+    cache_file = setup_cache_file(name)
+    env = dict((var, os.environ.get(var)) for var in setup_env_vars())
+    entry = {
+        'files': list(seen_setups),
+        'env': sorted(env),
+        'digest': setup_digest(seen_setups, env),
+        'setup': setup,
+    }
+    try:
+        if not os.path.isdir(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+        tmp = cache_file + '.tmp{0}'.format(os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(entry, f, indent=1, sort_keys=True)
+        os.rename(tmp, cache_file)
+    except (IOError, OSError) as e:
+        logger.debug('Could not write setup cache %s: %s', cache_file, e)
+
+
+# load_setup(name)
+#
+# Load the setup file name (if not None) and the defaults,
+# then complete the setup of all modules in the module list
+# (using the resolved setup cache if possible)
+def load_setup(name):
+    entry = None
+    if ci['cachedir'] and not seen_setups:
+        entry = load_cached_setup(name)
+    if entry:
+        for set_file in entry['files']:
+            print("Using setup file {0} (resolved setup cached)".format(set_file))
+        for set_file in entry['files']:
+            seen_setups[set_file] = True
+        setup.update(entry['setup'])
+        return
+
+    if name:
+        source_set(name)
+    source_set('defaults')
+
+    [complete_setup(mod) for mod in modlist()]
+
+    if ci['cachedir']:
+        save_cached_setup(name)
+
+
+def prepare(args):
+    host_info()
+
+    fold_start('load.setup', 'Loading setup files')
+
+    load_setup(os.environ.get('SET'))
+    if ci['lockfile']:
+        load_lockfile(ci['lockfile'])
+
+    fold_end('load.setup', 'Loading setup files')
+
+    logger.debug('Loaded setup')
+    kvs = list(setup.items())
+    kvs.sort()
+    [logger.debug(' %s = "%s"', *kv) for kv in kvs]
+
+    logger.debug('Effective module list: %s', modlist())
+
+    if ci['service'] == 'travis' and ci['os'] == 'linux':
+        fix_etc_hosts()
+
+    # we're working with tags (detached heads) a lot: suppress advice
+    call_git(['config', '--global', 'advice.detachedHead', 'false'])
+
+    fold_start('check.out.dependencies', 'Checking/cloning dependencies')
+
+    add_dependencies(modlist())
+
+    if not building_base:
+        if os.path.isdir('configure'):
+            targetdir = 'configure'
+        else:
+            targetdir = '.'
+        shutil.copy(os.path.join(ci['cachedir'], 'RELEASE.local'), targetdir)
+
+    fold_end('check.out.dependencies', 'Checking/cloning dependencies')
+
+    cxx = None
+    if ci['compiler'].startswith('clang'):
+        cxx = re.sub(r'clang', r'clang++', ci['compiler'])
+    elif ci['compiler'].startswith('gcc'):
+        cxx = re.sub(r'gcc', r'g++', ci['compiler'])
+
+    if not os.path.isdir(toolsdir):
+        os.makedirs(toolsdir)
+
+    if 'BASE' in modules_to_compile or building_base:
+        fold_start('set.up.epics_build', 'Configuring EPICS build system')
+
+        detect_epics_host_arch()
+
+        # Set static/debug in CONFIG_SITE
+        with open(os.path.join(places['EPICS_BASE'], 'configure', 'CONFIG_SITE'), 'a') as f:
+            if ci['static']:
+                f.write('SHARED_LIBRARIES=NO\n')
+                f.write('STATIC_BUILD=YES\n')
+                linktype = 'static'
+            else:
+                linktype = 'shared (DLL)'
+            if ci['debug']:
+                f.write('HOST_OPT=NO\n')
+                optitype = 'debug'
+            else:
+                optitype = 'optimized'
+
+        print('EPICS Base build system set up for {0} build with {1} linking'
+                  .format(optitype, linktype))
+
+        # Enable/fix parallel build for VisualStudio compiler on older Base versions
+        if ci['os'] == 'windows' and re.match(r'^vs', ci['compiler']):
+            add_vs_fix = True
+            config_win = os.path.join(places['EPICS_BASE'], 'configure', 'os', 'CONFIG.win32-x86.win32-x86')
+            with open(config_win) as f:
+                for line in f:
+                    if re.match(r'^ifneq \(\$\(VisualStudioVersion\),11\.0\)', line):
+                        add_vs_fix = False
+            if add_vs_fix:
+                logger.debug('Adding parallel build fix for VisualStudio to %s', config_win)
+                with open(config_win, 'a') as f:
+                    f.write('''
+# Fix parallel build for some VisualStudio versions
+ifneq ($(VisualStudioVersion),)
+ifneq ($(VisualStudioVersion),11.0)
+ifeq ($(findstring -FS,$(OPT_CXXFLAGS_NO)),)
+  OPT_CXXFLAGS_NO += -FS
+  OPT_CFLAGS_NO += -FS
+endif
+else
+  OPT_CXXFLAGS_NO := $(filter-out -FS,$(OPT_CXXFLAGS_NO))
+  OPT_CFLAGS_NO := $(filter-out -FS,$(OPT_CFLAGS_NO))
+endif
+endif''')
+
+        # Cross-compilations from Linux platform
+        if ci['os'] == 'linux':
+            handle_old_cross_variables()
+
+            for cross_target_info in os.environ.get("CI_CROSS_TARGETS", "").split(":"):
+                if cross_target_info == "":
+                    continue
+                prepare_cross_compilation(cross_target_info)
+
+        print('Host compiler', ci['compiler'])
+
+        if ci['compiler'].startswith('clang'):
+            with open(os.path.join(places['EPICS_BASE'], 'configure', 'os',
+                                   'CONFIG_SITE.Common.'+os.environ['EPICS_HOST_ARCH']), 'a') as f:
+                f.write('''
+GNU         = NO
+CMPLR_CLASS = clang
+CC          = {0}
+CCC         = {1}'''.format(ci['compiler'], cxx))
+
+            # hack
+            with open(os.path.join(places['EPICS_BASE'], 'configure', 'CONFIG.gnuCommon'), 'a') as f:
+                f.write('''
+CMPLR_CLASS = clang''')
+
+        elif ci['compiler'].startswith('gcc'):
+            with open(os.path.join(places['EPICS_BASE'], 'configure', 'os',
+                                   'CONFIG_SITE.Common.' + os.environ['EPICS_HOST_ARCH']), 'a') as f:
+                f.write('''
+CC          = {0}
+CCC         = {1}'''.format(ci['compiler'], cxx))
+
+        elif ci['compiler'].startswith('vs'):
+            pass # nothing special
+
+        else:
+            raise ValueError('Unknown compiler name {0}.  valid forms include: gcc, gcc-4.8, clang, vs2019'.format(ci['compiler']))
+
+        # Add additional settings to CONFIG_SITE
+        extra_config = ''
+        if 'USR_CPPFLAGS' in os.environ:
+            extra_config += '''
+USR_CPPFLAGS += {0}'''.format(os.environ['USR_CPPFLAGS'])
+        if 'USR_CFLAGS' in os.environ:
+            extra_config += '''
+USR_CFLAGS += {0}'''.format(os.environ['USR_CFLAGS'])
+        if 'USR_CXXFLAGS' in os.environ:
+            extra_config += '''
+USR_CXXFLAGS += {0}'''.format(os.environ['USR_CXXFLAGS'])
+        if ci['service'] == 'github-actions' and ci['os'] == 'windows':
+            extra_config += '''
+PERL = C:/Strawberry/perl/bin/perl -CSD'''
+
+        if extra_config:
+            with open(os.path.join(places['EPICS_BASE'], 'configure', 'CONFIG_SITE'), 'a') as f:
+                f.write(extra_config)
+
+        # enable color in error and warning messages if the (cross) compiler supports it
+        # and add the (inactive unless enabled) compiler cache wrapper
+        with open(os.path.join(places['EPICS_BASE'], 'configure', 'CONFIG'), 'a') as f:
+            f.write('''
+ifdef T_A
+  COLOR_FLAG_$(T_A) := $(shell $(CPP) -fdiagnostics-color -E - </dev/null >/dev/null 2>/dev/null && echo -fdiagnostics-color)
+  USR_CPPFLAGS += $(COLOR_FLAG_$(T_A))
+endif''')
+            f.write(compiler_cache_config)
+
+        fold_end('set.up.epics_build', 'Configuring EPICS build system')
+
+    if ci['os'] == 'windows' and ci['choco']:
+        fold_start('install.choco', 'Installing CHOCO packages')
+        for i in range(0,3):
+            try:
+                sp.check_call(['choco', 'install'] + ci['choco'] + ['-y', '--limitoutput', '--no-progress'])
+            except Exception as e:
+                print(e)
+                print("Retrying choco install attempt {} after 30 seconds".format(i+1))
+                time.sleep(30)
+            else:
+                break
+        fold_end('install.choco', 'Installing CHOCO packages')
+
+    if ci['os'] == 'linux' and ci['apt']:
+        fold_start('install.apt', 'Installing APT packages')
+        sp.check_call(ci['sudo'] + ['apt-get', '-y', 'update'])
+        sp.check_call(ci['sudo'] + ['apt-get', 'install', '-y', '-qq'] + ci['apt'])
+        fold_end('install.apt', 'Installing APT packages')
+
+    if ci['os'] == 'osx' and ci['homebrew']:
+        fold_start('install.homebrew', 'Installing Homebrew packages')
+        sp.check_call(['brew', 'install'] + ci['homebrew'])
+        fold_end('install.homebrew', 'Installing Homebrew packages')
+
+    setup_for_build(args)
+
+    if ci['compiler_cache']:
+        compiler_cache_stats(zero=True)
+
+    print('{0}EPICS_HOST_ARCH = {1}{2}'.format(ANSI_CYAN, os.environ['EPICS_HOST_ARCH'], ANSI_RESET))
+    whereis('make')
+    print('{0}$ make --version{1}'.format(ANSI_CYAN, ANSI_RESET))
+    sys.stdout.flush()
+    call_make(['--version'], parallel=0)
+    whereis('perl')
+    print('{0}$ perl --version{1}'.format(ANSI_CYAN, ANSI_RESET))
+    sys.stdout.flush()
+    sp.check_call(['perl', '--version'])
+
+    if re.match(r'^vs', ci['compiler']):
+        whereis('cl')
+        print('{0}$ cl{1}'.format(ANSI_CYAN, ANSI_RESET))
+        sys.stdout.flush()
+        sp.check_call(['cl'])
+    else:
+        cc = ci['compiler']
+        whereis(cc)
+        print('{0}$ {1} --version{2}'.format(ANSI_CYAN, cc, ANSI_RESET))
+        sys.stdout.flush()
+        sp.check_call([cc, '--version'])
+        if cxx:
+            whereis(cxx)
+            print('{0}$ {1} --version{2}'.format(ANSI_CYAN, cxx, ANSI_RESET))
+            sys.stdout.flush()
+            sp.check_call([cxx, '--version'])
+
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        log_modified()
+
+    if not skip_dep_builds:
+        fold_start('build.dependencies', 'Build missing/outdated dependencies')
+        cache_keys = None
+        if ci['binary_cache'] and modules_to_compile:
+            cache_keys = binary_cache_keys()
+        build_dependencies(modules_to_compile, cache_keys)
+        fold_end('build.dependencies', 'Build missing/outdated dependencies')
+
+        print('{0}Dependency module information{1}'.format(ANSI_CYAN, ANSI_RESET))
+        print('Module     Tag          Binaries    Commit')
+        print(100 * '-')
+        for mod in modlist():
+            if mod in modules_restored:
+                stat = 'restored'
+            elif mod in modules_to_compile:
+                stat = 'rebuilt'
+            else:
+                stat = 'from cache'
+            place = places[setup[mod + "_VARNAME"]]
+            if compacted_info(place) is not None:
+                commit = '{0} (compacted)'.format(get_git_hash(place)[:10])
+            else:
+                commit = sp.check_output(['git', 'log', '-n1', '--oneline'], cwd=place).decode('ascii').strip()
+            print("%-10s %-12s %-11s %s" % (mod, setup[mod], stat, commit))
+
+        print('{0}Contents of RELEASE.local{1}'.format(ANSI_CYAN, ANSI_RESET))
+        with open(os.path.join(ci['cachedir'], 'RELEASE.local'), 'r') as f:
+            print(f.read().strip())
+
+    record_cache_use(referenced_cache_entries())
+    if ci['cache_max_size'] is not None:
+        fold_start('prune.cache', 'Pruning the cache')
+        prune_cache(ci['cache_max_size'])
+        fold_end('prune.cache', 'Pruning the cache')
+
+# sync_mirror(url)
+#
+# Create or update the mirror of the repository at url
+def sync_mirror(url):
+    mirror = mirror_location(url)
+    if os.path.isdir(mirror):
+        print('Updating mirror of {0} in {1}'.format(url, mirror))
+        sys.stdout.flush()
+        failed = call_git(['--git-dir=' + mirror, 'remote', 'update', '--prune'])
+    else:
+        print('Creating mirror of {0} in {1}'.format(url, mirror))
+        sys.stdout.flush()
+        failed = call_git(['clone', '--quiet', '--mirror', url, mirror])
+        if not failed:
+            # allow partial clones (FOO_FILTER) from the mirror
+            failed = call_git(['--git-dir=' + mirror, 'config', 'uploadpack.allowFilter', 'true'])
+    if failed:
+        raise RuntimeError("{0}Synchronizing mirror of {1} in {2} failed{3}"
+                           .format(ANSI_RED, url, mirror, ANSI_RESET))
+
+
+def mirror_sync(args):
+    if not ci['mirror_path']:
+        raise RuntimeError("{0}MIRROR_PATH must be set for 'mirror-sync'{1}".format(ANSI_RED, ANSI_RESET))
+    names = args.sets or [os.environ.get('SET')]
+
+    fold_start('load.setup', 'Loading setup files')
+    repos = []
+    for name in names:
+        setup.clear()
+        seen_setups.clear()
+        load_setup(name)
+        for mod in modlist():
+            repo = (setup[mod + '_REPOURL'], setup[mod],
+                    setup[mod + '_RECURSIVE'].lower() not in ['0', 'no'])
+            if repo not in repos:
+                repos.append(repo)
+    fold_end('load.setup', 'Loading setup files')
+
+    fold_start('sync.mirrors', 'Synchronizing dependency mirrors')
+    synced = set()
+    def sync(url):
+        if url not in synced:
+            synced.add(url)
+            sync_mirror(url)
+    for url, version, recursive in repos:
+        sync(url)
+        if recursive:
+            # the submodules of the version in the setup (and their submodules)
+            submodule_urls(mirror_location(url), version, url, sync)
+    fold_end('sync.mirrors', 'Synchronizing dependency mirrors')
+
+def lock(args):
+    lockfile = args.output or ci['lockfile'] or 'cue.lock'
+
+    fold_start('load.setup', 'Loading setup files')
+    load_setup(os.environ.get('SET'))
+    fold_end('load.setup', 'Loading setup files')
+
+    mods = modlist()
+    pool = ThreadPool(max(1, min(ci['clone_jobs'], len(mods))))
+    try:
+        commits = pool.map(lambda mod: get_remote_hash(repo_url(mod), setup[mod]), mods)
+    finally:
+        pool.close()
+        pool.join()
+
+    for mod, commit in zip(mods, commits):
+        if commit is None:
+            raise RuntimeError("{0}{1} is neither a tag nor a branch name for {2} ({3}){4}"
+                               .format(ANSI_RED, setup[mod], mod, setup[mod + '_REPOURL'], ANSI_RESET))
+
+    with open(lockfile, 'w') as f:
+        print('# Dependency lock file generated by cue.py lock', file=f)
+        for mod, commit in zip(mods, commits):
+            print('{0}={1}'.format(mod, setup[mod]), file=f)
+            print('{0}_REPOURL={1}'.format(mod, setup[mod + '_REPOURL']), file=f)
+            print('{0}_COMMIT={1}'.format(mod, commit), file=f)
+            print('Locked {0} ({1}) at {2}'.format(mod, setup[mod], commit))
+    print('Wrote lock file {0}'.format(lockfile))
+
+
+def resolve(args):
+    name = args.set or os.environ.get('SET')
+    load_setup(name)
+    if ci['lockfile']:
+        load_lockfile(ci['lockfile'])
+    resolved = {
+        'set': name,
+        'files': list(seen_setups),
+        'modules': modlist(),
+        'setup': setup,
+        'locked': locked,
+    }
+    print(json.dumps(resolved, indent=2, sort_keys=True), file=args.output)
+
+
+def cache_prune(args):
+    max_size = ci['cache_max_size']
+    if args.max_size:
+        max_size = parse_size(args.max_size)
+    if max_size is None:
+        raise RuntimeError("{0}Size limit needed for 'cache prune' (use --max-size or CACHE_MAX_SIZE){1}"
+                           .format(ANSI_RED, ANSI_RESET))
+
+    fold_start('load.setup', 'Loading setup files')
+    load_setup(os.environ.get('SET'))
+    fold_end('load.setup', 'Loading setup files')
+
+    prune_cache(max_size)
+
+
+# Binary cache
+#
+# With BINARY_CACHE set to a directory, the installed build products of every
+# dependency that is built are stored there under a key that covers everything
+# that goes into the build (see binary_cache_keys()).
+# A dependency that needs to be built is restored from the cache instead
+# if there is an entry with the same key.
+cached_install_dirs = ['bin', 'cfg', 'db', 'dbd', 'html', 'include', 'lib', 'templates']
+binary_cache_info = 'cue-binaries'
+
+
+# build_environment()
+#
+# Return a string describing the build environment that the dependencies are built in
+def build_environment():
+    compiler = ci['compiler']
+    if not compiler.startswith('vs'):
+        try:
+            with open(os.devnull, 'w') as devnull:
+                compiler = sp.check_output([compiler, '--version'], stderr=devnull)\
+                    .decode('utf-8', 'replace').splitlines()[0]
+        except (sp.CalledProcessError, OSError, IndexError):
+            pass
+    return '\n'.join(['compiler: ' + compiler,
+                      'host arch: ' + os.environ.get('EPICS_HOST_ARCH', ''),
+                      'configuration: ' + ci['configuration'],
+                      'cross targets: ' + os.environ.get('CI_CROSS_TARGETS', '')])
+
+
+# binary_cache_keys()
+#
+# Compute the binary cache keys of all modules in the module list from
+#  - the build environment (compiler, EPICS_HOST_ARCH, configuration, cross targets)
+#  - the contents of RELEASE.local
+#  - the checked-out commit
+#  - all local changes to the checkout (RELEASE, CONFIG_SITE edits, hook patches,
+#    files added by hooks and patches), see local_changes()
+#  - the contents of the hook file
+#  - the keys of the modules it depends on
+def binary_cache_keys():
+    order = modlist()
+    graph = dependency_graph(order)
+    # RELEASE.local has the absolute paths of the dependencies, which end up in the
+    # installed files (RELEASE files, rpaths), so builds in different cache areas
+    # (e.g. the configurations of cue.py matrix) do not share binary cache entries
+    with open(os.path.join(ci['cachedir'], 'RELEASE.local'), 'rb') as f:
+        common = [build_environment().encode(), f.read()]
+    keys = {}
+    for mod in order:
+        place = places[setup[mod + '_VARNAME']]
+        items = common + [get_git_hash(place).encode(), local_changes(place).encode()]
+        if mod + '_HOOK' in setup:
+            hook_file = os.path.join(curdir, setup[mod + '_HOOK'])
+            if os.path.exists(hook_file):
+                with open(hook_file, 'rb') as f:
+                    items.append(f.read())
+        items += [keys[dep].encode() for dep in sorted(graph[mod])]
+        key = hashlib.sha256()
+        for item in items:
+            key.update(hashlib.sha256(item).digest())
+        keys[mod] = key.hexdigest()
+        logger.debug('Binary cache key of %s is %s', mod, keys[mod])
+    return keys
+
+
+# restore_binaries(mod, key)
+#
+# Replace the installed build products of mod by the binary cache entry for key.
+# Returns False if there is no such entry.
+def restore_binaries(mod, key):
+    entry = os.path.join(ci['binary_cache'], key)
+    if not os.path.exists(os.path.join(entry, binary_cache_info)):
+        return False
+    place = places[setup[mod + '_VARNAME']]
+    print('{0}Restoring binaries of dependency {1} from {2}{3}'.format(ANSI_GREEN, mod, entry, ANSI_RESET))
+    sys.stdout.flush()
+    for dirname in cached_install_dirs:
+        target = os.path.join(place, dirname)
+        if os.path.isdir(target):
+            shutil.rmtree(target, onerror=remove_readonly)
+        if os.path.isdir(os.path.join(entry, dirname)):
+            shutil.copytree(os.path.join(entry, dirname), target, symlinks=True)
+    return True
+
+
+# store_binaries(mod, key)
+#
+# Store the installed build products of mod in the binary cache entry for key.
+# The entry is assembled in a temporary directory and renamed when complete.
+def store_binaries(mod, key):
+    entry = os.path.join(ci['binary_cache'], key)
+    if os.path.isdir(entry):
+        return
+    if not os.path.isdir(ci['binary_cache']):
+        os.makedirs(ci['binary_cache'])
+    place = places[setup[mod + '_VARNAME']]
+    logger.debug('Storing binaries of %s in %s', mod, entry)
+    tmp = tempfile.mkdtemp(prefix='.tmp-', dir=ci['binary_cache'])
+    for dirname in cached_install_dirs:
+        if os.path.isdir(os.path.join(place, dirname)):
+            shutil.copytree(os.path.join(place, dirname), os.path.join(tmp, dirname), symlinks=True)
+    with open(os.path.join(tmp, binary_cache_info), 'w') as f:
+        print('module: {0}'.format(mod), file=f)
+        print('version: {0}'.format(setup[mod]), file=f)
+        print('commit: {0}'.format(get_git_hash(place)), file=f)
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # stored by someone else in the meantime
+        shutil.rmtree(tmp, onerror=remove_readonly)
+
+
+# Compaction
+#
+# With CLEAN_DEPS=COMPACT, a dependency is reduced to what the builds of the
+# modules depending on it use, right after it has been built (or restored):
+# the install directories, configure (and Base's startup) and the checked_out marker.
+# The information needed later from the removed git repository (the variables
+# of the original RELEASE file and a hash of the local changes) is kept
+# in the 'compacted' marker file.
+compacted_keep = ['bin', 'cfg', 'config', 'configure', 'db', 'dbd', 'include', 'lib', 'startup', 'templates',
+                  'checked_out', 'compacted']
+
+
+# compacted_info(place)
+#
+# Return the contents of the 'compacted' marker file in place as a dict,
+# None if the dependency in place was not compacted
+def compacted_info(place):
+    fname = os.path.join(place, 'compacted')
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        return dict(line.rstrip('\n').split(': ', 1) for line in f if ': ' in line)
+
+
+# local_changes(place)
+#
+# Return a hash of the local changes (against the checked-out commit) of the dependency in place:
+# the changes to tracked files and the untracked (not ignored) files, except for
+# build products (install directories, O.* directories) and cue's marker files
+def local_changes(place):
+    info = compacted_info(place)
+    if info is not None:
+        return info['local changes']
+    changes = hashlib.sha256(sp.check_output(['git', 'diff', '--no-ext-diff', '--binary', 'HEAD'], cwd=place))
+    untracked = sp.check_output(['git', 'ls-files', '--others', '--exclude-standard', '-z'], cwd=place)
+    for name in sorted(untracked.decode('utf-8', 'replace').split('\0')):
+        parts = name.split('/')
+        if (not name or parts[0] in cached_install_dirs or name in ['checked_out', 'compacted']
+                or any(part.startswith('O.') for part in parts[:-1])):
+            continue
+        path = os.path.join(place, *parts)
+        changes.update(b'\0' + name.encode('utf-8') + b'\0')
+        if os.path.islink(path):
+            changes.update(os.readlink(path).encode('utf-8'))
+        elif os.path.isfile(path):
+            with open(path, 'rb') as f:
+                changes.update(f.read())
+    return changes.hexdigest()
+
+
+# strip_binaries(place)
+#
+# Remove the debug information from the host libraries and executables in place (Linux only)
+def strip_binaries(place):
+    if ci['os'] != 'linux':
+        return
+    binaries = []
+    for dirname in ['bin', 'lib']:
+        for path in glob(os.path.join(place, dirname, os.environ['EPICS_HOST_ARCH'], '*')):
+            if os.path.isfile(path) and not os.path.islink(path):
+                with open(path, 'rb') as f:
+                    magic = f.read(8)
+                if magic[:4] == b'\x7fELF' or magic == b'!<arch>\n':
+                    binaries.append(path)
+    if binaries:
+        logger.debug("EXEC 'strip --strip-debug' on %d files in %s", len(binaries), place)
+        if sp.call(['strip', '--strip-debug'] + binaries):
+            print('{0}WARNING: Stripping the binaries in {1} failed{2}'.format(ANSI_RED, place, ANSI_RESET))
+
+
+# compact_dependency(mod, changes=None)
+#
+# Compact the checkout of mod, recording changes (the local_changes() of the
+# checkout before it was built) or its current local changes
+def compact_dependency(mod, changes=None):
+    place = places[setup[mod + '_VARNAME']]
+    before = directory_size(place)
+    names = module_release_vars(place)
+    if changes is None:
+        changes = local_changes(place)
+    if ci['strip_deps']:
+        strip_binaries(place)
+    for name in os.listdir(place):
+        if name not in compacted_keep:
+            path = os.path.join(place, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, onerror=remove_readonly)
+            else:
+                os.remove(path)
+    with open(os.path.join(place, 'compacted'), 'w') as f:
+        if names is not None:
+            print('release vars: {0}'.format(' '.join(sorted(names))), file=f)
+        print('local changes: {0}'.format(changes), file=f)
+    after = directory_size(place)
+    print('Compacted dependency {0} in {1} from {2} to {3} ({4} saved)'
+          .format(mod, place, format_size(before), format_size(after), format_size(before - after)))
+    sys.stdout.flush()
+
+
+# Output fingerprints
+#
+# After a dependency has been built or restored, a fingerprint of its installed
+# outputs is kept in $CACHEDIR/fingerprints (outside the checkout, so that it
+# survives re-cloning). A module that only needs to be compiled because modules
+# it depends on were compiled is skipped if the outputs of these modules did not change.
+fingerprint_dirs = [dirname for dirname in cached_install_dirs if dirname != 'html']
+
+
+# output_fingerprint(place)
+#
+# Hash the location, names, contents and symlink targets of the installed outputs in place
+def output_fingerprint(place):
+    fingerprint = hashlib.sha256(os.path.abspath(place).encode())
+    for dirname in fingerprint_dirs:
+        for root, dirs, files in os.walk(os.path.join(place, dirname)):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                fingerprint.update(os.path.relpath(path, place).replace('\\', '/').encode() + b'\0')
+                if os.path.islink(path):
+                    fingerprint.update(os.readlink(path).encode() + b'\0')
+                else:
+                    with open(path, 'rb') as f:
+                        fingerprint.update(hashlib.sha256(f.read()).digest())
+    return fingerprint.hexdigest()
+
+
+# update_fingerprint(mod)
+#
+# Record the fingerprint of the installed outputs of mod,
+# return True if it differs from the previous one (or there was none)
+def update_fingerprint(mod):
+    fname = os.path.join(ci['cachedir'], 'fingerprints', dependency_dirname(mod))
+    previous = None
+    if os.path.exists(fname):
+        with open(fname) as f:
+            previous = f.read().strip()
+    current = output_fingerprint(places[setup[mod + '_VARNAME']])
+    logger.debug('Output fingerprint of %s is %s (was %s)', mod, current, previous)
+    if current == previous:
+        return False
+    if not os.path.isdir(os.path.dirname(fname)):
+        os.makedirs(os.path.dirname(fname))
+    with open(fname, 'w') as f:
+        print(current, file=f)
+    return True
+
+
+# Cache eviction
+#
+# The last use of the entries in the cache area (dependency checkouts, shared
+# object stores and binary cache entries) is recorded in $CACHEDIR/last-used.
+# Pruning the cache removes the least recently used entries that are not
+# referenced by the current module list, until the cache fits into the size budget.
+# The dependency checkouts and module worktrees in the cache areas of
+# 'cue.py matrix' configurations ($CACHEDIR/matrix/*) are entries as well;
+# a configuration area is removed when its last entry has been removed.
+# (The compiler caches are not included, they manage their size themselves.)
+def parse_size(size):
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', size, re.I)
+    if not m:
+        raise ValueError("Invalid size '{0}' (expected a number with optional suffix K, M, G or T)".format(size))
+    return int(float(m.group(1)) * 1024 ** ' KMGT'.index(m.group(2).upper() or ' '))
+
+
+def format_size(size):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024:
+            break
+        size /= 1024.
+    return '{0:.1f} {1}'.format(size, unit)
+
+
+def directory_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        size += sum(os.lstat(os.path.join(root, name)).st_size for name in files)
+    return size
+
+
+# cache_entries()
+#
+# Return the locations of all entries in the cache area
+def cache_entries():
+    places = glob(os.path.join(ci['cachedir'], '*')) + glob(os.path.join(ci['cachedir'], 'matrix', '*', '*'))
+    entries = [place for place in places if os.path.exists(os.path.join(place, 'checked_out'))]
+    entries += [place for place in glob(os.path.join(ci['cachedir'], 'matrix', '*', 'src'))
+                if os.path.isfile(os.path.join(place, '.git'))]
+    entries += glob(os.path.join(ci['objects_dir'], '*.git'))
+    if ci['binary_cache']:
+        entries += [entry for entry in glob(os.path.join(ci['binary_cache'], '*'))
+                    if os.path.exists(os.path.join(entry, binary_cache_info))]
+    return [os.path.abspath(entry) for entry in entries]
+
+
+# referenced_cache_entries()
+#
+# Return the locations of the cache entries that the modules in the current
+# module list use: their checkouts, shared object stores, and the binary
+# cache entries for their versions and checked-out commits
+def referenced_cache_entries():
+    refs = set()
+    versions = set()
+    for mod in modlist():
+        place = os.path.join(ci['cachedir'], dependency_dirname(mod))
+        if os.path.isdir(place):
+            refs.add(os.path.abspath(place))
+            versions.add((mod, setup[mod], get_git_hash(place)))
+        store = object_store(setup[mod + '_REPOURL'])
+        if os.path.isdir(store):
+            refs.add(os.path.abspath(store))
+    if ci['binary_cache']:
+        for entry in glob(os.path.join(ci['binary_cache'], '*', binary_cache_info)):
+            with open(entry) as f:
+                info = dict(line.strip().split(': ', 1) for line in f if ': ' in line)
+            if (info.get('module'), info.get('version'), info.get('commit')) in versions:
+                refs.add(os.path.abspath(os.path.dirname(entry)))
+    return refs
+
+
+def load_last_used():
+    last_used = {}
+    # the runs of matrix configurations record their use in their cache areas
+    for area in [ci['cachedir']] + glob(os.path.join(ci['cachedir'], 'matrix', '*')):
+        fname = os.path.join(area, 'last-used')
+        if os.path.exists(fname):
+            with open(fname) as f:
+                for line in f:
+                    (stamp, entry) = line.strip().split(' ', 1)
+                    entry = os.path.abspath(os.path.join(area, entry))
+                    last_used[entry] = max(float(stamp), last_used.get(entry, 0))
+    return last_used
+
+
+def save_last_used(last_used):
+    with open(os.path.join(ci['cachedir'], 'last-used'), 'w') as f:
+        for entry, stamp in sorted(last_used.items()):
+            print('{0:.0f} {1}'.format(stamp, os.path.relpath(entry, ci['cachedir']).replace('\\', '/')), file=f)
+
+
+# record_cache_use(entries)
+#
+# Set the last-used time of the cache entries to now
+def record_cache_use(entries):
+    if not entries:
+        return
+    last_used = load_last_used()
+    now = time.time()
+    for entry in entries:
+        last_used[entry] = now
+    save_last_used(last_used)
+
+
+# borrowed_store(place)
+#
+# Return the shared object store that the checkout in place borrows its objects from (or None)
+def borrowed_store(place):
+    alternates = os.path.join(place, '.git', 'objects', 'info', 'alternates')
+    if not os.path.exists(alternates):
+        return None
+    with open(alternates) as f:
+        objects = f.readline().strip()
+    return os.path.abspath(os.path.dirname(os.path.join(place, '.git', 'objects', objects)))
+
+
+# remove_worktree(place)
+#
+# Remove the git worktree in place and unregister it from its repository
+def remove_worktree(place):
+    try:
+        with open(os.devnull, 'w') as devnull:
+            common = sp.check_output(['git', 'rev-parse', '--git-common-dir'],
+                                     cwd=place, stderr=devnull).decode().strip()
+        common = os.path.join(place, common)
+    except (sp.CalledProcessError, OSError):
+        common = None
+    if common and not call_git(['--git-dir=' + common, 'worktree', 'remove', '--force', place]):
+        return
+    shutil.rmtree(place, onerror=remove_readonly)
+    if common:
+        call_git(['--git-dir=' + common, 'worktree', 'prune'])
+
+
+# prune_cache(max_size)
+#
+# Remove the least recently used cache entries that are not referenced by
+# the current module list, until the total size is at most max_size.
+# Shared object stores are only removed when no remaining checkout uses them.
+def prune_cache(max_size):
+    entries = cache_entries()
+    refs = referenced_cache_entries()
+    last_used = load_last_used()
+    sizes = dict((entry, directory_size(entry)) for entry in entries)
+    total = sum(sizes.values())
+    print('Cache size is {0} (limit {1})'.format(format_size(total), format_size(max_size)))
+    # entries without a recorded use count as older than all others, oldest first by modification time
+    candidates = sorted((entry for entry in entries if entry not in refs),
+                        key=lambda entry: (last_used.get(entry, 0), os.path.getmtime(entry)))
+    removed = True
+    while total > max_size and removed:
+        removed = False
+        for entry in candidates[:]:
+            if total <= max_size:
+                break
+            if any(borrowed_store(other) == entry for other in entries):
+                continue
+            print('Removing {0} from the cache ({1})'.format(entry, format_size(sizes[entry])))
+            sys.stdout.flush()
+            if os.path.isfile(os.path.join(entry, '.git')):
+                remove_worktree(entry)
+            else:
+                shutil.rmtree(entry, onerror=remove_readonly)
+            for leftover in [os.path.join(os.path.dirname(entry), 'fingerprints', os.path.basename(entry)),
+                             entry + '.lock']:
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            area = os.path.dirname(entry)
+            if (os.path.dirname(area) == os.path.abspath(os.path.join(ci['cachedir'], 'matrix'))
+                    and not any(os.path.dirname(other) == area for other in entries if other != entry)):
+                print('Removing matrix configuration area {0}'.format(area))
+                shutil.rmtree(area, onerror=remove_readonly)
+                if os.path.exists(area + '.log'):
+                    os.remove(area + '.log')
+            candidates.remove(entry)
+            entries.remove(entry)
+            last_used.pop(entry, None)
+            total -= sizes[entry]
+            removed = True
+    save_last_used(last_used)
+    if total > max_size:
+        print('{0}WARNING: Cache size {1} exceeds the limit of {2} (entries in use are not removed){3}'
+              .format(ANSI_RED, format_size(total), format_size(max_size), ANSI_RESET))
+    else:
+        print('Cache size is {0} after pruning'.format(format_size(total)))
+
+
+# module_release_vars(place)
+#
+# Return the names of all variables that are set in the original
+# configure/RELEASE* files of the module in place (including commented-out
+# settings, as optional dependencies are enabled through RELEASE.local),
+# None if the original configure/RELEASE can't be found.
+def module_release_vars(place):
+    info = compacted_info(place)
+    if info is not None:
+        if 'release vars' not in info:
+            return None
+        return set(info['release vars'].split())
+    try:
+        with open(os.devnull, 'w') as devnull:
+            text = sp.check_output(['git', 'show', 'HEAD:configure/RELEASE'],
+                                   cwd=place, stderr=devnull).decode('utf-8', 'replace')
+    except (sp.CalledProcessError, OSError):
+        return None
+    for fname in glob(os.path.join(place, 'configure', 'RELEASE?*')):
+        with open(fname) as f:
+            text += f.read()
+    return set(re.findall(r'^[ \t]*#?[ \t]*([A-Za-z_][A-Za-z0-9_]*)[ \t]*[:?+]?=', text, re.M))
+
+
+# dependency_graph(mods)
+#
+# For each of the modules in mods, find the modules (earlier in the module list)
+# that it depends on, using the variables of its configure/RELEASE files.
+# Modules without a readable RELEASE file depend on all earlier modules.
+# Modules that are not in the module list come after all modules in the list.
+def dependency_graph(mods):
+    order = modlist()
+    modules = dict((setup[mod + '_VARNAME'], mod) for mod in order if mod + '_VARNAME' in setup)
+    graph = {}
+    for mod in mods:
+        if mod in order:
+            earlier = order[:order.index(mod)]
+        else:
+            earlier = order
+        names = module_release_vars(places[setup[mod + '_VARNAME']])
+        if names is None:
+            graph[mod] = set(earlier)
+        else:
+            graph[mod] = set(modules[name] for name in names
+                             if name in modules and modules[name] in earlier)
+            if 'BASE' in earlier:
+                graph[mod].add('BASE')
+        logger.debug('Dependency %s depends on %s', mod, ', '.join(sorted(graph[mod])) or 'nothing')
+    return graph
+
+
+class DependencyBuild(object):
+    '''make runs (build, optionally clean) for one dependency, with buffered output'''
+    def __init__(self, mod, slots, jobserver=None):
+        self.mod, self.slots, self.jobserver = mod, slots, jobserver
+        self.place = places[setup[mod + '_VARNAME']]
+        self.steps = [[]]
+        if ci['clean_deps']:
+            self.steps.append(['clean'])
+        self.built = False
+        self.output = tempfile.TemporaryFile()
+        self.child = None
+        self.profile = None
+        self.build_profile = None
+        self.reader = None
+        self.build_started = None
+        # files written by the build must not change the recorded local changes
+        self.local_changes = local_changes(self.place) if ci['compact_deps'] else None
+    def start_next(self):
+        args = self.steps.pop(0)
+        # profile the build step only
+        self.profile = None
+        if ci['build_profile'] and not self.built:
+            self.profile = self.build_profile = MakeProfile(self.mod, self.place)
+        cmd = ['make'] + make_options(self.slots, silent_dep_builds, jobserver=self.jobserver is not None,
+                                      profile=self.profile is not None) + args
+        self.cmd = cmd
+        logger.debug("EXEC '%s' in %s", ' '.join(cmd), self.place)
+        self.output.write('$ {0}\n'.format(' '.join(cmd)).encode())
+        self.output.flush()
+        self.started = time.time()
+        if self.build_started is None:
+            self.build_started = self.started
+        kws = child_kws({})
+        self.own_group = 'preexec_fn' in kws
+        if self.jobserver:
+            self.jobserver.client_kws(kws)
+        if self.profile:
+            self.child = sp.Popen(cmd, cwd=self.place, stdout=sp.PIPE, stderr=sp.STDOUT, **kws)
+            self.watchdog = OutputWatchdog(self.child, 'the build of dependency ' + self.mod)
+            self.reader = threading.Thread(target=copy_make_output,
+                                           args=(self.child.stdout, self.output.write, self.profile, self.watchdog))
+            self.reader.daemon = True
+            self.reader.start()
+        else:
+            self.child = sp.Popen(cmd, cwd=self.place, stdout=self.output, stderr=sp.STDOUT, **kws)
+            self.watchdog = OutputWatchdog(self.child, 'the build of dependency ' + self.mod, [self.output])
+    def wait_output(self):
+        '''Wait until all output of the make run has been collected'''
+        if self.reader:
+            self.reader.join()
+            self.reader = None
+    def print_output(self):
+        self.wait_output()
+        self.output.seek(0)
+        sys.stdout.write(self.output.read().decode('utf-8', 'replace'))
+        self.output.close()
+        sys.stdout.flush()
+
+
+# build_dependencies(mods)
+#
+# Build the modules in mods, running the builds of modules that do not depend
+# on each other concurrently. All builds share the jobserver; where there is none,
+# the ci['parallel_make'] job slots are split between the concurrent builds.
+# The output of each build is printed when it is done.
+# On the first failure, all other builds are stopped.
+# Modules that were not checked out fresh are skipped (and removed from
+# modules_to_compile) if the outputs of the modules they depend on did not change.
+# If cache_keys are given, modules are restored from the binary cache if possible,
+# and the binaries of the successful builds are stored in the binary cache.
+def build_dependencies(mods, cache_keys=None):
+    mods = list(mods)
+    graph = dependency_graph(mods)
+    pending = list(mods)
+    running = []
+    built = set()
+    changed = set()
+    total_slots = max(1, ci['parallel_make'])
+    js = get_jobserver()
+    last_report = time.time()
+
+    while pending or running:
+        ready = [mod for mod in pending if not (graph[mod] & set(mods)) - built]
+        for mod in ready[:]:
+            started = time.time()
+            if mod not in fresh_checkouts and not graph[mod] & changed:
+                print('{0}Skipping dependency {1}: the outputs of the modules it depends on did not change{2}'
+                      .format(ANSI_GREEN, mod, ANSI_RESET))
+                if mod in modules_to_compile:
+                    modules_to_compile.remove(mod)
+            elif cache_keys and restore_binaries(mod, cache_keys[mod]):
+                trace_event('restore ' + mod, 'dependency', started, track=mod)
+                modules_restored.append(mod)
+                if ci['compact_deps']:
+                    compact_dependency(mod)
+                if update_fingerprint(mod):
+                    changed.add(mod)
+            else:
+                continue
+            ready.remove(mod)
+            pending.remove(mod)
+            built.add(mod)
+        while ready:
+            if js:
+                # a new build needs a free job slot (blocking if nothing is running)
+                if not js.acquire(block=not running):
+                    break
+                slots = total_slots
+                info = 'sharing {0} make jobs'.format(total_slots)
+            else:
+                free = total_slots - sum(job.slots for job in running)
+                if free <= 0 and running:
+                    break
+                slots = max(1, free // len(ready))
+                info = '{0} make jobs'.format(slots)
+            mod = ready.pop(0)
+            pending.remove(mod)
+            place = places[setup[mod + '_VARNAME']]
+            if compacted_info(place) is not None:
+                print('{0}Checking out dependency {1} again to rebuild it (the sources were removed by compaction){2}'
+                      .format(ANSI_YELLOW, mod, ANSI_RESET))
+                shutil.rmtree(place, onerror=remove_readonly)
+                checkout_dependency(mod)
+            job = DependencyBuild(mod, slots, js)
+            print('{0}Building dependency {1} in {2} ({3}){4}'
+                  .format(ANSI_YELLOW, mod, job.place, info, ANSI_RESET))
+            sys.stdout.flush()
+            job.start_next()
+            running.append(job)
+
+        time.sleep(0.1)
+        for job in running[:]:
+            exitcode = job.child.poll()
+            if exitcode is None:
+                if make_timeout and time.time() - job.started > make_timeout and job.watchdog.fired is None:
+                    logger.error('Timeout')
+                    job.watchdog.stop()
+                job.watchdog.check()
+                continue
+            trace_event(process_event_name(job.cmd), 'process', job.started, track=job.mod,
+                        cmd=' '.join(job.cmd), cwd=job.place, exitcode=exitcode)
+            if exitcode != 0:
+                print('{0}Building dependency {1} failed{2}'.format(ANSI_RED, job.mod, ANSI_RESET))
+                job.print_output()
+                running.remove(job)
+                for other in running:
+                    print('{0}Stopping build of dependency {1}{2}'.format(ANSI_RED, other.mod, ANSI_RESET))
+                    kill_process_tree(other.child)
+                    other.child.wait()
+                    other.print_output()
+                if js:
+                    for other in [job] + running:
+                        js.release()
+                    # killed makes do not return the job slots they took
+                    js.refill()
+                sys.exit(exitcode)
+            if not job.built:
+                job.built = True
+                job.wait_output()
+                if job.profile:
+                    job.profile.finished = time.time()
+                if ci['compact_deps']:
+                    compact_dependency(job.mod, job.local_changes)
+                built.add(job.mod)
+                if update_fingerprint(job.mod):
+                    changed.add(job.mod)
+            if job.steps:
+                job.start_next()
+            else:
+                print('{0}Finished building dependency {1}{2}'.format(ANSI_GREEN, job.mod, ANSI_RESET))
+                trace_event('build ' + job.mod, 'dependency', job.build_started, track=job.mod)
+                job.print_output()
+                if job.build_profile:
+                    job.build_profile.report()
+                running.remove(job)
+                if cache_keys:
+                    store_binaries(job.mod, cache_keys[job.mod])
+                if js:
+                    js.release()
+
+        if running and time.time() - last_report > 60:
+            # keep the CI service from killing a job without output
+            print('Still building {0}'.format(', '.join(job.mod for job in running)))
+            sys.stdout.flush()
+            last_report = time.time()
+
+
+def build(args):
+    setup_for_build(args)
+    fold_start('build.module', 'Build the main module')
+    call_make(args.makeargs, use_extra=True, profile='build')
+    fold_end('build.module', 'Build the main module')
+    if ci['compiler_cache']:
+        compiler_cache_stats()
+
+
+# Test sharding
+#
+# With TEST_SHARD=i/N, the test scripts (*.t) in the O.<EPICS_HOST_ARCH>
+# directories of the main module are distributed over N shards, and only
+# the tests of shard i are run. If TEST_DURATIONS names a file with the
+# durations of the tests (lines "<seconds> <test>", or a copy of the
+# test times database), the shards are balanced by duration.
+# All shards must see the same test scripts and durations.
+
+# discover_test_scripts()
+#
+# Return the test scripts of the main module as a dict
+# test name (<test directory>/<script>) -> (O.<arch> directory, script)
+def discover_test_scripts():
+    scripts = {}
+    odir_name = 'O.' + os.environ['EPICS_HOST_ARCH']
+    cachedir = os.path.abspath(ci['cachedir'])
+    for root, dirs, files in os.walk(curdir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and os.path.join(root, d) != cachedir)
+        if odir_name in dirs:
+            odir = os.path.join(root, odir_name)
+            for script in sorted(glob(os.path.join(odir, '*.t'))):
+                name = os.path.relpath(os.path.join(root, os.path.basename(script)), curdir).replace('\\', '/')
+                scripts[name] = (odir, os.path.basename(script))
+    return scripts
+
+
+def load_test_durations():
+    durations = {}
+    if ci['test_durations'] and os.path.exists(ci['test_durations']):
+        with open(ci['test_durations']) as f:
+            for line in f:
+                fields = line.split()
+                if fields:
+                    durations[fields[-1]] = float(fields[0])
+    return durations
+
+
+# select_shard(names, durations, index, count)
+#
+# Distribute the tests over count shards (longest first, each to the shard with the
+# smallest total duration; tests without a known duration count as the average)
+# and return the names of the tests in shard index (1..count)
+def select_shard(names, durations, index, count):
+    known = [durations[name] for name in names if name in durations]
+    default = sum(known) / len(known) if known else 1.
+    totals = [0.] * count
+    shards = [[] for i in range(count)]
+    for name in sorted(names, key=lambda name: (-durations.get(name, default), name)):
+        shard = totals.index(min(totals))
+        totals[shard] += durations.get(name, default)
+        shards[shard].append(name)
+    return sorted(shards[index - 1])
+
+
+# selected_test_scripts()
+#
+# Return the test scripts to run (all, or the ones of this shard)
+# in the format of discover_test_scripts()
+def selected_test_scripts():
+    scripts = discover_test_scripts()
+    if not ci['test_shard']:
+        return scripts
+    index, count = ci['test_shard']
+    selected = select_shard(list(scripts), load_test_durations(), index, count)
+    print('{0}Test shard {1}/{2}: running {3} of {4} tests{5}'
+          .format(ANSI_CYAN, index, count, len(selected), len(scripts), ANSI_RESET))
+    for name in selected:
+        print('  ' + name)
+    sys.stdout.flush()
+    return dict((name, scripts[name]) for name in selected)
+
+
+# shard_test_scripts()
+#
+# Return the test scripts of this shard as a dict O.<arch> directory -> list of scripts
+def shard_test_scripts():
+    odirs = {}
+    for name, (odir, script) in sorted(selected_test_scripts().items()):
+        odirs.setdefault(odir, []).append(script)
+    return odirs
+
+
+# Test times database
+#
+# With TEST_TIMES=YES, the test scripts are run one by one (through 'make <script>.tap',
+# up to PARALLEL_MAKE at a time), longest first according to the durations recorded
+# in $CACHEDIR/test-times, where the duration and outcome of every test run is recorded
+# (lines "<seconds> <outcome> <test>"). Tests that have a recorded duration are stopped
+# after TEST_TIMEOUT_FACTOR times that duration (at least one minute).
+def load_test_times():
+    times = {}
+    fname = os.path.join(ci['cachedir'], 'test-times')
+    if os.path.exists(fname):
+        with open(fname) as f:
+            for line in f:
+                (seconds, outcome, name) = line.strip().split(' ', 2)
+                times[name] = (float(seconds), outcome)
+    return times
+
+
+def save_test_times(times):
+    if not os.path.isdir(ci['cachedir']):
+        os.makedirs(ci['cachedir'])
+    with open(os.path.join(ci['cachedir'], 'test-times'), 'w') as f:
+        for name, (seconds, outcome) in sorted(times.items()):
+            print('{0:.2f} {1} {2}'.format(seconds, outcome, name), file=f)
+
+
+# tap_outcome(tapfile)
+#
+# Return 'ok' if the TAP output in tapfile shows a complete and successful test run, else 'failed'
+# (failing tests with a TODO directive do not count as failures)
+def tap_outcome(tapfile):
+    if not os.path.exists(tapfile):
+        return 'failed'
+    planned = None
+    passed = 0
+    with open(tapfile) as f:
+        for line in f:
+            m = re.match(r'^1\.\.(\d+)', line)
+            if m:
+                planned = int(m.group(1))
+            elif re.match(r'^ok\b', line) or re.match(r'^not ok\b[^#]*#\s*TODO\b', line, re.IGNORECASE):
+                passed += 1
+            elif re.match(r'^(not ok\b|Bail out!)', line):
+                return 'failed'
+    if planned is None or passed != planned:
+        return 'failed'
+    return 'ok'
+
+
+# test_timeout(name, times)
+#
+# Return the timeout (in seconds) for test name, None for no timeout
+def test_timeout(name, times):
+    timeout = None
+    if name in times and ci['test_timeout_factor'] > 0:
+        timeout = max(60., ci['test_timeout_factor'] * times[name][0])
+    if make_timeout:
+        timeout = min(timeout or make_timeout, make_timeout)
+    return timeout
+
+
+class TestRun(object):
+    '''make run for the TAP file of one test script, with buffered output'''
+    def __init__(self, name, odir, script, timeout):
+        self.name, self.timeout = name, timeout
+        self.tapfile = os.path.join(odir, re.sub(r'\.t$', '.tap', script))
+        if os.path.exists(self.tapfile):
+            os.remove(self.tapfile)
+        self.output = tempfile.TemporaryFile()
+        kws = {}
+        if os.name == 'posix':
+            # own process group, so that the test can be stopped with all its children
+            kws['preexec_fn'] = os.setsid
+        logger.debug("EXEC 'make %s' in %s", os.path.basename(self.tapfile), odir)
+        self.started = time.time()
+        self.child = sp.Popen(['make', '-s', os.path.basename(self.tapfile)],
+                              cwd=odir, stdout=self.output, stderr=sp.STDOUT, **kws)
+        # the test output goes to the TAP file
+        self.watchdog = OutputWatchdog(self.child, 'test ' + name, [self.output, self.tapfile])
+        self.bail_out = None
+    def print_output(self):
+        self.output.seek(0)
+        sys.stdout.write(self.output.read().decode('utf-8', 'replace'))
+        self.output.close()
+        sys.stdout.flush()
+
+
+# run_tests(scripts)
+#
+# Run the test scripts (in the format of discover_test_scripts()), longest first,
+# and record their durations and outcomes in the test times database.
+# Exits with the exit code of the first make run that failed.
+def run_tests(scripts):
+    times = load_test_times()
+    # tests without recorded duration first (they might be long)
+    pending = sorted(scripts, key=lambda name: (-times.get(name, (float('inf'),))[0], name))
+    slots = max(1, ci['parallel_make'])
+    running = []
+    exitcode = 0
+    print('Running {0} tests, longest first, {1} at a time'.format(len(pending), slots))
+    sys.stdout.flush()
+
+    while pending or running:
+        while pending and len(running) < slots:
+            name = pending.pop(0)
+            (odir, script) = scripts[name]
+            run = TestRun(name, odir, script, test_timeout(name, times))
+            # one trace track per slot
+            run.slot = min(set(range(slots)) - set(other.slot for other in running))
+            running.append(run)
+
+        time.sleep(0.1)
+        for run in running[:]:
+            duration = time.time() - run.started
+            if run.child.poll() is None:
+                if run.bail_out:
+                    # kills the test if it does not go away
+                    run.watchdog.check()
+                elif run.timeout and duration > run.timeout:
+                    print('{0}Test {1} timed out after {2:.0f} seconds, stopping it{3}'
+                          .format(ANSI_RED, run.name, duration, ANSI_RESET))
+                    sys.stdout.flush()
+                    run.bail_out = 'Timed out after {0:.0f} seconds'.format(duration)
+                    run.watchdog.stop()
+                elif run.watchdog.check():
+                    run.bail_out = 'No output for {0:.0f} seconds'.format(idle_timeout)
+                continue
+            if run.bail_out:
+                # processes of the test that ignored SIGTERM may still be there
+                kill_process_tree(run.child, force=True)
+                # make removes the unfinished TAP file, test-results must not run the test again
+                with open(run.tapfile, 'a') as f:
+                    print('Bail out! {0}'.format(run.bail_out), file=f)
+                outcome = 'timeout'
+            else:
+                outcome = tap_outcome(run.tapfile)
+            if outcome == 'ok':
+                print('{0}{1:<8}{2} {3} ({4:.1f} s)'.format(ANSI_GREEN, outcome, ANSI_RESET, run.name, duration))
+                run.output.close()
+            else:
+                print('{0}{1:<8}{2} {3} ({4:.1f} s)'.format(ANSI_RED, outcome, ANSI_RESET, run.name, duration))
+                run.print_output()
+            sys.stdout.flush()
+            trace_event(run.name, 'test', run.started, track='tests {0}'.format(run.slot + 1), outcome=outcome)
+            times[run.name] = (duration, outcome)
+            running.remove(run)
+            if run.child.returncode != 0 and not exitcode:
+                exitcode = run.child.returncode
+
+    save_test_times(times)
+    if exitcode != 0:
+        sys.exit(exitcode)
+
+
+def test(args):
+    if ci['test']:
+        setup_for_build(args)
+        fold_start('test.module', 'Run the main module tests')
+        if has_test_results and ci['test_times']:
+            run_tests(selected_test_scripts())
+        elif ci['test_shard']:
+            for odir, scripts in sorted(shard_test_scripts().items()):
+                if has_test_results:
+                    tapfiles = [re.sub(r'\.t$', '.tap', script) for script in scripts]
+                    call_make(['TAPFILES=' + ' '.join(tapfiles), 'tapfiles'], cwd=odir)
+                else:
+                    call_make(['TESTSCRIPTS=' + ' '.join(scripts), 'runtests'], cwd=odir)
+        elif has_test_results:
+            call_make(['tapfiles'])
+        else:
+            call_make(['runtests'])
+        fold_end('test.module', 'Run the main module tests')
+    else:
+        print("{0}Action 'test' skipped as per configuration{1}"
+              .format(ANSI_YELLOW, ANSI_RESET))
+
+
+def test_results(args):
+    if ci['test']:
+        setup_for_build(args)
+        fold_start('test.results', 'Sum up main module test results')
+        if has_test_results and ci['test_shard']:
+            for odir, scripts in sorted(shard_test_scripts().items()):
+                tapfiles = [re.sub(r'\.t$', '.tap', script) for script in scripts]
+                call_make(['TAPFILES=' + ' '.join(tapfiles), 'test-results'], cwd=odir, parallel=0, silent=True)
+        elif has_test_results:
+            call_make(['test-results'], parallel=0, silent=True)
+        else:
+            print("{0}Base in {1} does not implement 'test-results' target{2}"
+                  .format(ANSI_YELLOW, places['EPICS_BASE'], ANSI_RESET))
+        fold_end('test.results', 'Sum up main module test results')
+    else:
+        print("{0}Action 'test-results' skipped as per configuration{1}"
+              .format(ANSI_YELLOW, ANSI_RESET))
+
+
+# Build matrix (cue.py matrix)
+#
+# Run the actions (prepare, build, test, test-results) for every combination
+# of the given settings (VAR=value1,value2,...), running up to --jobs
+# configurations at a time, each in its own cue.py processes with
+# - a worktree of the main module (HEAD plus the uncommitted changes to tracked
+#   files) in $CACHEDIR/matrix/<configuration>/src,
+# - its own cache area $CACHEDIR/matrix/<configuration> for the dependencies,
+# - the git object stores, the binary cache and the compiler cache in $CACHEDIR
+#   shared with all other configurations.
+# The output of each configuration goes to $CACHEDIR/matrix/<configuration>.log.
+
+# matrix_configurations(specs)
+#
+# Return all combinations of the VAR=value1,value2,... specs
+# as lists of (VAR, value) pairs
+def matrix_configurations(specs):
+    axes = []
+    for spec in specs:
+        m = re.match(r'^([A-Za-z_][A-Za-z0-9_]*)=(.+)$', spec)
+        if not m:
+            raise ValueError("Invalid matrix setting '{0}' (expected VAR=value1,value2,...)".format(spec))
+        axes.append([(m.group(1), value.strip()) for value in m.group(2).split(',') if value.strip()])
+    return [list(config) for config in itertools.product(*axes)]
+
+
+def configuration_name(config):
+    return '_'.join(re.sub(r'[^\w.-]', '-', '{0}-{1}'.format(var, value)) for var, value in config)
+
+
+# prepare_worktree(place)
+#
+# Create (or reset) a worktree of the main module in place,
+# with the uncommitted changes to tracked files applied
+def prepare_worktree(place):
+    head = sp.check_output(['git', 'rev-parse', 'HEAD'], cwd=curdir).decode().strip()
+    if os.path.isdir(place):
+        if call_git(['checkout', '--quiet', '--force', '--detach', head], cwd=place):
+            raise RuntimeError('{0}Resetting worktree {1} failed{2}'.format(ANSI_RED, place, ANSI_RESET))
+    elif call_git(['worktree', 'add', '--quiet', '--detach', place, head], cwd=curdir):
+        raise RuntimeError('{0}Creating worktree {1} failed{2}'.format(ANSI_RED, place, ANSI_RESET))
+    changes = sp.check_output(['git', 'diff', '--binary', 'HEAD'], cwd=curdir)
+    if changes:
+        child = sp.Popen(['git', 'apply', '--whitespace=nowarn'], cwd=place, stdin=sp.PIPE)
+        child.communicate(changes)
+        if child.returncode:
+            raise RuntimeError('{0}Applying the local changes in {1} failed{2}'.format(ANSI_RED, place, ANSI_RESET))
+
+
+class MatrixRun(object):
+    '''cue.py runs (one per action) for one configuration of the matrix'''
+    def __init__(self, config, actions, options, jobs):
+        self.config, self.actions, self.options = config, list(actions), options
+        self.name = configuration_name(config)
+        self.cachedir = os.path.join(ci['cachedir'], 'matrix', self.name)
+        self.place = os.path.join(self.cachedir, 'src')
+        self.logfile = os.path.join(ci['cachedir'], 'matrix', self.name + '.log')
+        self.env = dict(os.environ)
+        self.env.update({
+            'CACHEDIR': self.cachedir,
+            'SHARED_OBJECTS': 'YES',
+            'SHARED_OBJECTS_DIR': ci['objects_dir'],
+            'BINARY_CACHE': ci['binary_cache'] or os.path.join(ci['cachedir'], 'binaries'),
+            # the compiler caches are shared, with paths relative to the cache area
+            'CCACHE_DIR': os.environ.get('CCACHE_DIR', os.path.join(ci['cachedir'], 'ccache')),
+            'CCACHE_BASEDIR': os.environ.get('CCACHE_BASEDIR', ci['cachedir']),
+            'SCCACHE_DIR': os.environ.get('SCCACHE_DIR', os.path.join(ci['cachedir'], 'sccache')),
+        })
+        if 'PARALLEL_MAKE' not in os.environ:
+            self.env['PARALLEL_MAKE'] = str(max(1, ci['parallel_make'] // jobs))
+        # concurrent configurations must not update the same trace file
+        self.trace_file = ''
+        if ci['trace_file']:
+            self.trace_file = os.path.join(ci['cachedir'], 'matrix', self.name + '.trace.json')
+            self.env['TRACE_FILE'] = self.trace_file
+        self.env.update(config)
+        self.results = []
+        self.child = None
+        self.log = None
+    def start_next(self):
+        self.action, self.started = self.actions.pop(0), time.time()
+        if not self.log:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            self.log = open(self.logfile, 'w')
+            prepare_worktree(self.place)
+            record_cache_use([os.path.abspath(self.place)])
+        cmd = [sys.executable, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cue.py')]
+        cmd += self.options + self.action.split()
+        self.log.write('$ {0}\n'.format(' '.join(cmd)))
+        self.log.flush()
+        logger.debug("EXEC '%s' in %s", ' '.join(cmd), self.place)
+        self.child = sp.Popen(cmd, cwd=self.place, env=self.env, stdout=self.log, stderr=sp.STDOUT)
+    def failed(self):
+        return any(not ok for action, seconds, ok in self.results)
+
+
+def matrix(args):
+    configs = matrix_configurations(args.specs)
+    actions = args.actions.replace(',', ' ').split()
+    jobs = max(1, args.jobs)
+    options = []
+    if args.timeout:
+        options += ['-T', str(args.timeout)]
+    if args.idle_timeout:
+        options += ['-I', str(args.idle_timeout)]
+    print('{0}Running {1} configurations ({2}), {3} at a time{4}'
+          .format(ANSI_CYAN, len(configs), ', '.join(actions), jobs, ANSI_RESET))
+    sys.stdout.flush()
+
+    def start(run):
+        '''Start the next action of run; return False (recording the failure) if that fails'''
+        try:
+            run.start_next()
+            return True
+        except (RuntimeError, OSError, sp.CalledProcessError) as e:
+            run.results.append((run.action, time.time() - run.started, False))
+            print('{0}{1}: {2} failed to start ({3}){4}'
+                  .format(ANSI_RED, run.name, run.action, e, ANSI_RESET))
+            sys.stdout.flush()
+            if run.log:
+                print('Starting {0} failed: {1}'.format(run.action, e), file=run.log)
+                run.log.close()
+            return False
+
+    pending = [MatrixRun(config, actions, options, jobs) for config in configs]
+    runs = list(pending)
+    running = []
+    try:
+        while pending or running:
+            while pending and len(running) < jobs:
+                run = pending.pop(0)
+                if start(run):
+                    running.append(run)
+            time.sleep(0.2)
+            for run in running[:]:
+                exitcode = run.child.poll()
+                if exitcode is None:
+                    continue
+                seconds = time.time() - run.started
+                run.results.append((run.action, seconds, exitcode == 0))
+                if exitcode == 0:
+                    print('{0}{1}: {2} done ({3:.1f} s){4}'
+                          .format(ANSI_GREEN, run.name, run.action, seconds, ANSI_RESET))
+                else:
+                    print('{0}{1}: {2} failed ({3:.1f} s, see {4}){5}'
+                          .format(ANSI_RED, run.name, run.action, seconds, run.logfile, ANSI_RESET))
+                sys.stdout.flush()
+                if exitcode == 0 and run.actions:
+                    if not start(run):
+                        running.remove(run)
+                else:
+                    run.log.close()
+                    running.remove(run)
+    finally:
+        # do not leave configurations running if the matrix is interrupted
+        for run in running:
+            if run.child.poll() is None:
+                print('{0}Stopping {1}{2}'.format(ANSI_RED, run.name, ANSI_RESET))
+                run.child.terminate()
+                run.child.wait()
+        for run in runs:
+            if run.trace_file:
+                merge_trace(run.trace_file)
+
+    width = max(len(' '.join('{0}={1}'.format(var, value) for var, value in run.config)) for run in runs)
+    width = max(width, len('Configuration'))
+    print('{0}{1:<{2}}  {3}  Result{4}'
+          .format(ANSI_CYAN, 'Configuration', width, ''.join('{0:>14}'.format(action) for action in actions),
+                  ANSI_RESET))
+    for run in runs:
+        times = ['{0:.1f} s'.format(seconds) for action, seconds, ok in run.results]
+        columns = ''.join('{0:>14}'.format(cell) for cell in times + ['-'] * (len(actions) - len(times)))
+        if run.failed():
+            result = '{0}failed{1} ({2})'.format(ANSI_RED, ANSI_RESET, run.logfile)
+        else:
+            result = '{0}ok{1}'.format(ANSI_GREEN, ANSI_RESET)
+        print('{0:<{1}}  {2}  {3}'.format(' '.join('{0}={1}'.format(var, value) for var, value in run.config),
+                                          width, columns, result))
+    sys.stdout.flush()
+    if any(run.failed() for run in runs):
+        sys.exit(1)
+
+
+def doExec(args):
+    'exec user command with vcvars'
+    setup_for_build(args)
+    fold_start('exec.command', 'Execute command {}'.format(args.cmd))
+    sp.check_call(' '.join(args.cmd), shell=True)
+    fold_end('exec.command', 'Execute command {}'.format(args.cmd))
+
+
+# Self-profiling (--profile)
+#
+# The subcommand runs under cProfile; the profile is written to cue-<subcommand>.prof
+# (for pstats, snakeviz etc.) next to the TRACE_FILE if that is set, else in $CACHEDIR,
+# so that it does not end up in the module's checkout. The summary separates the time that cue spent
+# blocked (waiting for child processes, pipes and threads) from its own work,
+# and shows the functions with the most own (self) time.
+# Only the main thread is profiled.
+blocking_calls = re.compile(r'waitpid|wait4|select|poll|sleep|readline|\bread\b|acquire|WaitForSingleObject')
+
+
+# profile_times(stats)
+#
+# Return (blocked time, own time, [(own time, calls, function), ...] by own time)
+# for the pstats.Stats stats
+def profile_times(stats):
+    blocked = own = 0.
+    functions = []
+    for (fname, line, func), (cc, nc, tt, ct, callers) in stats.stats.items():
+        if fname == '~' and blocking_calls.search(func):
+            blocked += tt
+        else:
+            own += tt
+            if fname != '~':
+                func = '{0}:{1}({2})'.format(os.path.basename(fname), line, func)
+            functions.append((tt, nc, func))
+    functions.sort(key=lambda f: -f[0])
+    return blocked, own, functions
+
+
+def run_profiled(func, args, name):
+    import cProfile
+    import pstats
+    outdir = os.path.dirname(os.path.abspath(ci['trace_file'])) if ci['trace_file'] else ci['cachedir']
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    fname = os.path.abspath(os.path.join(outdir, 'cue-{0}.prof'.format(name)))
+    started, times = time.time(), os.times()
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(func, args)
+    finally:
+        wall = time.time() - started
+        cpu = [after - before for before, after in zip(times, os.times())]
+        profiler.dump_stats(fname)
+        blocked, own, functions = profile_times(pstats.Stats(fname))
+        print('{0}Profile of {1} written to {2}{3}'.format(ANSI_CYAN, name, fname, ANSI_RESET))
+        print('{0:10.1f} s  wall time'.format(wall))
+        print('{0:10.1f} s  blocked on child processes, pipes and threads'.format(blocked))
+        print('{0:10.1f} s  own work (cue.py CPU time: {1:.1f} s user, {2:.1f} s system)'
+              .format(own, cpu[0], cpu[1]))
+        if os.name == 'posix':
+            print('{0:10.1f} s  CPU time of child processes'.format(cpu[2] + cpu[3]))
+        print('Functions with most own time:')
+        for tt, nc, func in functions[:15]:
+            print('{0:10.3f} s  {1:8d} calls  {2}'.format(tt, nc, func))
+        sys.stdout.flush()
+
+
+def with_vcvars(cmd):
+    '''re-exec main script with a (hopefully different) command
+    '''
+    CC = ci['compiler']
+
+    # cf. https://docs.microsoft.com/en-us/cpp/build/building-on-the-command-line
+
+    info = {
+        'python': sys.executable,
+        'self': sys.argv[0],
+        'cmd': cmd,
+    }
+
+    info['arch'] = {
+        'x86': 'x86',  # 'amd64_x86' ??
+        'x64': 'amd64',
+    }[ci['platform']]  # 'x86' or 'x64'
+
+    info['vcvars'] = find_vcvars()[CC]
+
+    script = '''
+call "{vcvars}" {arch}
+
+"{python}" "{self}" {cmd}
+'''.format(**info)
+
+    print('{0}Calling vcvars-trampoline.bat to set environment for {1} on {2}{3}'
+          .format(ANSI_YELLOW, CC, ci['platform'], ANSI_RESET))
+    sys.stdout.flush()
+
+    logger.debug('----- Creating vcvars-trampoline.bat -----')
+    for line in script.split('\n'):
+        logger.debug(line)
+    logger.debug('----- snip -----')
+
+    with open('vcvars-trampoline.bat', 'w') as F:
+        F.write(script)
+
+    returncode = sp.call('vcvars-trampoline.bat', shell=True)
+    if returncode != 0:
+        sys.exit(returncode)
+
+
+def getargs():
+    from argparse import ArgumentParser, ArgumentError, REMAINDER
+    def timespec(s):
+        M = re.match(r'^\s*(\d+)\s*([A-Za-z]*)', s)
+        if not M:
+            raise ArgumentError('Expected timespec not {!r}'.format(s))
+        val = float(M.group(1))
+        try:
+            mult = {
+                '':1.0,
+                'S':1.0,
+                'M':60.0,
+                'H':60.0*60.0,
+            }[M.group(2).upper()]
+        except KeyError:
+            raise ArgumentError('Expect suffix S, M, or H.  not {!r}'.format(s))
+        return val*mult
+
+    p = ArgumentParser()
+    p.add_argument('--no-vcvars', dest='vcvars', default=True, action='store_false',
+                   help='Assume vcvarsall.bat has already been run')
+    p.add_argument('--add-path', dest='extra_env_vars', type=lambda x: "PATH={}".format(x), default=[], action='append',
+                   help='Append directory to $PATH or %%PATH%%. Expands {ENVVAR}. Equivalent to: "--add-env PATH=<PATHS>"')
+    p.add_argument('--add-env', dest='extra_env_vars', default=[], action='append',
+                   help='Append directory to the specified $ENVVAR or %%ENVVAR%%. Expands {OTHER_ENVVAR}. Example: "--add-env \'LD_LIBRARY_PATH={EPICS_BASE}/lib/{EPICS_HOST_ARCH}\'"')
+    p.add_argument('-T', '--timeout', type=timespec, metavar='DLY',
+                   help='Terminate make after delay.  DLY interpreted as second, or may be qualified with "S", "M", or "H".  (default no timeout)')
+    p.add_argument('-I', '--idle-timeout', type=timespec, metavar='DLY',
+                   help='Stop make and test runs that did not produce output for this delay.  Same format as --timeout.  (default no idle timeout)')
+    p.add_argument('--profile', default=False, action='store_true',
+                   help='Run the command under the Python profiler, write the profile to cue-<command>.prof and show a summary')
+    subp = p.add_subparsers()
+
+    cmd = subp.add_parser('prepare')
+    cmd.set_defaults(func=prepare)
+
+    cmd = subp.add_parser('build')
+    cmd.add_argument('makeargs', nargs=REMAINDER)
+    cmd.set_defaults(func=build)
+
+    cmd = subp.add_parser('test')
+    cmd.set_defaults(func=test)
+
+    cmd = subp.add_parser('test-results')
+    cmd.set_defaults(func=test_results)
+
+    cmd = subp.add_parser('mirror-sync')
+    cmd.add_argument('sets', nargs='*', metavar='SET',
+                     help='Setup files to read the dependencies from (default: $SET)')
+    cmd.set_defaults(func=mirror_sync)
+
+    cmd = subp.add_parser('lock')
+    cmd.add_argument('-o', '--output', metavar='FILE',
+                     help='Lock file to write (default: $LOCKFILE or cue.lock)')
+    cmd.set_defaults(func=lock)
+
+    cmd = subp.add_parser('resolve')
+    cmd.add_argument('set', nargs='?', metavar='SET',
+                     help='Setup file to resolve (default: $SET)')
+    cmd.set_defaults(func=resolve, output=None)
+
+    cmd = subp.add_parser('cache')
+    cachep = cmd.add_subparsers(dest='cache_cmd', metavar='COMMAND')
+    cachep.required = True
+    cmd = cachep.add_parser('prune')
+    cmd.add_argument('--max-size', metavar='SIZE',
+                     help='Size limit for the cache, e.g. 2G (default: $CACHE_MAX_SIZE)')
+    cmd.set_defaults(func=cache_prune)
+
+    cmd = subp.add_parser('matrix')
+    cmd.add_argument('specs', nargs='+', metavar='VAR=VALUES',
+                     help='Setting with comma separated values, e.g. CMP=gcc,clang (all combinations are run)')
+    cmd.add_argument('-j', '--jobs', type=int, default=2,
+                     help='Number of configurations to run concurrently (default: 2)')
+    cmd.add_argument('-a', '--actions', default='prepare,build,test,test-results',
+                     help='Comma separated actions to run for each configuration (default: %(default)s)')
+    cmd.set_defaults(func=matrix)
+
+    cmd = subp.add_parser('exec')
+    cmd.add_argument('cmd', nargs=REMAINDER)
+    cmd.set_defaults(func=doExec)
+
+    return p
+
+
+def main(raw):
+    global silent_dep_builds
+    global make_timeout, idle_timeout
+    args = getargs().parse_args(raw)
+    if 'VV' in os.environ and os.environ['VV'] == '1':
+        logging.basicConfig(level=logging.DEBUG)
+        silent_dep_builds = False
+    else:
+        logging.basicConfig(level=logging.CRITICAL)
+
+    make_timeout = args.timeout
+    if make_timeout:
+        logger.info('Will timeout after %.1f seconds', make_timeout)
+    idle_timeout = args.idle_timeout
+    if idle_timeout:
+        logger.info('Will stop make and test runs after %.1f seconds without output', idle_timeout)
+    forward_signals()
+
+    stdout = sys.stdout
+    if args.func is resolve:
+        # only the JSON output goes to stdout
+        args.output = stdout
+        sys.stdout = sys.stderr
+
+    try:
+        prepare_env()
+        detect_context()
+
+        if args.vcvars and ci['compiler'].startswith('vs'):
+            # re-exec with MSVC in PATH
+            with_vcvars(' '.join(['--no-vcvars'] + raw))
+        else:
+            try:
+                if args.profile:
+                    run_profiled(args.func, args, args.func.__name__.replace('_', '-'))
+                else:
+                    args.func(args)
+            finally:
+                write_trace(' '.join(['cue.py'] + raw))
+    finally:
+        sys.stdout = stdout
+
+if __name__ == '__main__':
+    main(sys.argv[1:])